@@ -0,0 +1,88 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.codec import encode, decode
+
+# JSON vs the negotiated 'binary' codec on message mixes the server really
+# sees. Each mix is encoded and decoded in full; numbers are per message.
+#   python3 benchmarks/bench_codec.py
+
+def relay_mix(count):
+    # a game in progress: a request and a relayed push per move, with the
+    # occasional restart
+    messages = []
+    for index in range(count):
+        if index % 50 == 0:
+            messages.append({'type': 'game_start', 'symbol': 'X', 'opponent': 'player2', 'turn': True})
+        cell = random.randrange(9)
+        messages.append({'command': 'game_move', 'room_id': random.randrange(1, 500), 'index': cell, 'symbol': 'X'})
+        messages.append({'type': 'opponent_move', 'index': cell, 'symbol': 'X'})
+    return messages
+
+def lobby_mix(count):
+    room = {'id': 7, 'game_id': 3, 'game_name': 'TicTacToe', 'host': 'alice', 'players': ['alice', 'bob'],
+            'status': 'waiting', 'chat_history': [f"alice: message {line}" for line in range(10)]}
+    templates = [
+        {'command': 'login', 'role': 'player', 'username': 'alice', 'password': 'secret'},
+        {'status': 'success', 'msg': 'Login successful'},
+        {'command': 'get_room_info', 'room_id': 7},
+        {'status': 'success', 'data': room},
+        {'type': 'room_event', 'room_id': 7, 'event': 'chat', 'line': 'bob: gg'},
+        {'status': 'success', 'data': [room] * 5},
+    ]
+    return [templates[index % len(templates)] for index in range(count)]
+
+def catalog_mix(count):
+    games = [{'id': game_id, 'name': f"Game {game_id}", 'author': 'dev', 'description': 'A small party game. ' * 4,
+              'version': 3, 'type': 'GUI', 'rating': 4.2, 'rating_count': 17} for game_id in range(100)]
+    return [{'status': 'success', 'data': games}] * count
+
+def measure(messages, codec, repeat):
+    payloads = [encode(message, codec) for message in messages]
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            encode(message, codec)
+    encode_seconds = (time.perf_counter() - start_time) / (repeat * len(messages))
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for payload in payloads:
+            decode(payload)
+    decode_seconds = (time.perf_counter() - start_time) / (repeat * len(messages))
+
+    for message, payload in zip(messages, payloads):
+        assert decode(payload) == message
+
+    size = sum(len(payload) for payload in payloads) / len(messages)
+    return size, encode_seconds * 1e6, decode_seconds * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON vs binary frame codec")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    random.seed(1)
+
+    mixes = [
+        ('relay', relay_mix(args.messages)),
+        ('lobby', lobby_mix(args.messages)),
+        ('catalog', catalog_mix(max(1, args.messages // 100))),
+    ]
+    print(f"{'mix':<9}{'codec':<8}{'bytes/msg':>11}{'enc us':>10}{'dec us':>10}{'speedup':>9}")
+    for name, messages in mixes:
+        baseline = None
+        for codec in ('json', 'binary'):
+            size, encode_us, decode_us = measure(messages, codec, args.repeat)
+            total = encode_us + decode_us
+            if baseline is None:
+                baseline = total
+            print(f"{name:<9}{codec:<8}{size:>11.1f}{encode_us:>10.2f}{decode_us:>10.2f}{baseline / total:>8.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.protocol import send_json, recv_json, send_file, recv_file, file_sha256
+
+# Concurrent download_game throughput. Publishes one generated game, then
+# every client process downloads it over its own connection in a loop.
+# Start the server first and pass its pid to also get server CPU time
+# (Linux only), e.g.
+#   python3 server/server.py &
+#   python3 benchmarks/bench_download.py --pid $!
+# then again with python3 server/server.py --no-sendfile.
+#
+# With --pipelined N every download is preceded by N list_games requests
+# with ids on the same connection, as the player client does while the
+# Store is open, and each file is checked against its SHA-256; replies
+# from the request pool must never land inside a transfer.
+
+BENCH_USER = 'bench_dev'
+
+def login(host, port, role, username):
+    connection = socket.create_connection((host, port))
+    send_json(connection, {'command': 'register', 'role': role, 'username': username, 'password': 'bench'})
+    recv_json(connection)
+    send_json(connection, {'command': 'login', 'role': role, 'username': username, 'password': 'bench'})
+    response = recv_json(connection)
+    if not response or response['status'] != 'success':
+        raise SystemExit(f"login failed: {response}")
+    return connection
+
+def publish_game(host, port, size):
+    connection = login(host, port, 'dev', BENCH_USER)
+    with tempfile.NamedTemporaryFile('w', suffix='.py', delete=False) as file_handle:
+        line = 0
+        while file_handle.tell() < size:
+            file_handle.write(f"print('download benchmark line {line}')\n")
+            line += 1
+        source_path = file_handle.name
+    try:
+        send_json(connection, {'command': 'upload_game',
+                               'meta': {'name': f'bench-{size}', 'description': 'benchmark', 'type': 'CLI'}})
+        recv_json(connection)
+        send_file(connection, source_path)
+        recv_json(connection)
+        send_json(connection, {'command': 'my_games'})
+        games = recv_json(connection)['data']
+        return [game['id'] for game in games if game['name'] == f'bench-{size}'][0], os.path.getsize(source_path)
+    finally:
+        os.remove(source_path)
+        connection.close()
+
+def pipelined_download(connection, request, save_path, pipelined):
+    # Sends the list_games requests and then the download, all with ids,
+    # and reads replies in whatever order they come. A frame misread from
+    # inside a transfer usually leaves the reader waiting for bytes that
+    # never come, hence the timeout.
+    connection.settimeout(10)
+    for request_id in range(pipelined):
+        send_json(connection, {'command': 'list_games', 'id': request_id})
+    send_json(connection, dict(request, id='download'))
+    pending = pipelined + 1
+    while pending:
+        response = recv_json(connection)
+        if response is None:
+            raise SystemExit("connection closed or stalled")
+        pending -= 1
+        if response.get('id') != 'download':
+            continue
+        if not recv_file(connection, save_path, response.get('encoding')):
+            raise SystemExit("download failed")
+        if file_sha256(save_path) != response['sha256']:
+            raise SystemExit("download corrupted")
+
+def run_downloads(host, port, client, game_id, downloads, accept_encoding, pipelined, results):
+    connection = login(host, port, 'player', f'bench_player{client}')
+    save_path = os.path.join(tempfile.gettempdir(), f'bench_download_{os.getpid()}.py')
+    request = {'command': 'download_game', 'game_id': game_id}
+    if accept_encoding:
+        request['accept_encoding'] = ['zlib']
+
+    start_time = time.perf_counter()
+    try:
+        for _ in range(downloads):
+            if pipelined:
+                pipelined_download(connection, request, save_path, pipelined)
+                continue
+            send_json(connection, request)
+            response = recv_json(connection)
+            if not recv_file(connection, save_path, response.get('encoding')):
+                raise SystemExit("download failed")
+    except SystemExit as error:
+        # reported by the parent, which is waiting for a result
+        results.put(str(error))
+        return
+    elapsed = time.perf_counter() - start_time
+    results.put(elapsed)
+
+    os.remove(save_path)
+    connection.close()
+
+def server_cpu_seconds(pid):
+    # utime + stime of the server and its reaped children (--workers)
+    if not pid:
+        return None
+    with open(f'/proc/{pid}/stat') as file_handle:
+        fields = file_handle.read().rsplit(')', 1)[1].split()
+    return sum(int(value) for value in fields[11:15]) / os.sysconf('SC_CLK_TCK')
+
+def main():
+    parser = argparse.ArgumentParser(description="concurrent download_game throughput")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12131)
+    parser.add_argument('--size', type=int, default=8 * 1024 * 1024, help="game size in bytes")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--downloads', type=int, default=20, help="downloads per client")
+    parser.add_argument('--zlib', action='store_true', help="accept the precompressed copy")
+    parser.add_argument('--pipelined', type=int, default=0,
+                        help="list_games requests pipelined ahead of each download")
+    parser.add_argument('--pid', type=int, default=0, help="server pid, to report its CPU time")
+    args = parser.parse_args()
+
+    game_id, file_size = publish_game(args.host, args.port, args.size)
+    results = multiprocessing.Queue()
+    cpu_before = server_cpu_seconds(args.pid)
+    processes = []
+    for client in range(args.clients):
+        process = multiprocessing.Process(target=run_downloads,
+                                          args=(args.host, args.port, client, game_id, args.downloads, args.zlib,
+                                                args.pipelined, results))
+        process.start()
+        processes.append(process)
+
+    elapsed = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    failures = [result for result in elapsed if isinstance(result, str)]
+    if failures:
+        raise SystemExit(f"{len(failures)} of {len(processes)} clients failed: {failures[0]}")
+    slowest = max(elapsed)
+    cpu_after = server_cpu_seconds(args.pid)
+
+    total_bytes = file_size * args.clients * args.downloads
+    print(f"{args.clients} clients x {args.downloads} downloads of {file_size / 1e6:.1f} MB in {slowest:.2f}s: "
+          f"{total_bytes / slowest / 1e6:,.0f} MB/s")
+    if cpu_before is not None:
+        cpu_seconds = cpu_after - cpu_before
+        print(f"server CPU {cpu_seconds:.2f}s ({cpu_seconds / (total_bytes / 1e9):.2f}s per GB)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.protocol import send_json, recv_json
+
+# Relay throughput: R rooms, two players each, every move relayed to the
+# opponent. Rooms are split over client processes so the load generator is
+# not the bottleneck. Start the server first, e.g.
+#   python3 server/server.py
+#   python3 server/server.py --workers 4
+# then compare moves/s for the same --rooms.
+
+def run_rooms(host, port, room_ids, moves, results):
+    pairs = []
+    for room_id in room_ids:
+        first = socket.create_connection((host, port))
+        second = socket.create_connection((host, port))
+        send_json(first, {'command': 'game_join', 'room_id': room_id, 'username': f'a{room_id}'})
+        send_json(second, {'command': 'game_join', 'room_id': room_id, 'username': f'b{room_id}'})
+        recv_json(first)
+        recv_json(second)
+        pairs.append((room_id, first, second))
+
+    start_time = time.perf_counter()
+    for index in range(moves):
+        for room_id, first, second in pairs:
+            send_json(first, {'command': 'game_move', 'room_id': room_id, 'index': index, 'symbol': 'X'})
+        for room_id, first, second in pairs:
+            recv_json(second)
+    elapsed = time.perf_counter() - start_time
+    results.put((len(pairs) * moves, elapsed))
+
+    for room_id, first, second in pairs:
+        first.close()
+        second.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="game relay throughput")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12131)
+    parser.add_argument('--rooms', type=int, default=64)
+    parser.add_argument('--moves', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=os.cpu_count() or 1,
+                        help="load generator processes")
+    args = parser.parse_args()
+
+    # high room ids so the benchmark never touches rooms of a live lobby
+    room_ids = [100000 + index for index in range(args.rooms)]
+    results = multiprocessing.Queue()
+    processes = []
+    for client in range(args.clients):
+        process = multiprocessing.Process(target=run_rooms,
+                                          args=(args.host, args.port, room_ids[client::args.clients], args.moves, results))
+        process.start()
+        processes.append(process)
+
+    total_moves = 0
+    slowest = 0.0
+    for _ in processes:
+        moves, elapsed = results.get()
+        total_moves += moves
+        slowest = max(slowest, elapsed)
+    for process in processes:
+        process.join()
+
+    print(f"{args.rooms} rooms, {total_moves} moves in {slowest:.2f}s: {total_moves / slowest:,.0f} moves/s")
+
+if __name__ == '__main__':
+    main()
@@ -3,44 +3,54 @@ from tkinter import messagebox, filedialog, ttk
 import socket
 import os
 import sys
+from concurrent.futures import Future
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from common.protocol import send_json, recv_json, send_file
+from common.protocol import send_file
+from common.multiplex import MultiplexConnection
+from common.worker import NetworkWorker
+from common.catalog import CatalogCache
 
 HOST = 'linux3.cs.nycu.edu.tw'
 PORT = 12131
+UPLOAD_COMPRESSION_LEVEL = 6
 
 # =====logic code ===================
 class GameStoreService:
     def __init__(self):
         self.socket = None
+        self.connection = None
+        # catalog as of the last refresh, for conditional list_games
+        self.catalog = CatalogCache()
 
     def connect(self):
         try:
-            if self.socket:
-                self.socket.close()
+            if self.connection:
+                self.connection.close()
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(5)
             self.socket.connect((HOST, PORT))
             self.socket.settimeout(None)
+            self.connection = MultiplexConnection(self.socket)
             return True
         except Exception as error:
             print(f"[Service] Connection Error: {error}")
             return False
 
     def close(self):
-        if self.socket:
-            self.socket.close()
+        if self.connection:
+            self.connection.close()
 
-    def _send_command(self, data):
-        if not self.socket:
-            return None
-        try:
-            if send_json(self.socket, data):
-                return recv_json(self.socket)
-        except Exception:
-            return None
-        return None
+    def request(self, data, on_reply=None, exclusive=False):
+        # Future of the reply; any number may be outstanding at once.
+        if not self.connection:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self.connection.request(data, on_reply, exclusive)
+
+    def _send_command(self, data, on_reply=None, exclusive=False):
+        return self.request(data, on_reply, exclusive).result()
 
     def login(self, username, password):
         return self._send_command({
@@ -59,8 +69,8 @@ class GameStoreService:
         })
 
     def get_my_games(self, username):
-        response = self._send_command({'command': 'list_games'})
-        if response and response['status'] == 'success':
+        response = self.catalog.update(self._send_command(self.catalog.request()))
+        if response:
             my_games = []
             for game in response['data']:
                 if game['author'] == username:
@@ -71,19 +81,24 @@ class GameStoreService:
     def delete_game(self, game_id):
         return self._send_command({'command': 'remove_game', 'game_id': game_id})
 
-    def get_game_reviews(self, game_id):
-        return self._send_command({'command': 'get_game_details', 'game_id': game_id})
+    def get_game_reviews(self, game_id, offset=0):
+        # one page of reviews, skipping the 'offset' newest
+        return self._send_command({'command': 'get_game_details', 'game_id': game_id, 'review_offset': offset})
 
     def upload_game(self, metadata, file_path):
-        response = self._send_command({'command': 'upload_game', 'meta': metadata})
-        
-        if response and response['status'] == 'ready':
-            if send_file(self.socket, file_path):
-                return recv_json(self.socket) 
-            else:
-                return {'status': 'fail', 'msg': 'File transfer failed'}
-        
-        return response
+        # Offer a compressed upload; the server echoes the encoding if it
+        # takes it, an old server does not and gets the raw file. The file
+        # has to follow the request on the wire (hence exclusive), and the
+        # final status is a second reply to the same request.
+        def send_game(response):
+            if response['status'] != 'ready':
+                return response
+            if send_file(self.socket, file_path, response.get('encoding'), UPLOAD_COMPRESSION_LEVEL):
+                return MultiplexConnection.MORE
+            return {'status': 'fail', 'msg': 'File transfer failed'}
+
+        request = {'command': 'upload_game', 'meta': metadata, 'encoding': 'zlib'}
+        return self._send_command(request, send_game, exclusive=True)
 
 # ====UI ==============================
 COLORS = {
@@ -100,6 +115,8 @@ class DeveloperApp:
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.setup_styles()
         self.service = GameStoreService()
+        # service calls run off the Tk thread; see common/worker.py
+        self.worker = NetworkWorker(self.root)
         self.username = None
         
         self.init_login_ui()
@@ -135,6 +152,7 @@ class DeveloperApp:
         except: pass
 
     def on_close(self):
+        self.worker.close()
         self.service.close()
         try: 
             self.root.destroy()
@@ -159,30 +177,43 @@ class DeveloperApp:
         ttk.Button(frame, text="LOGIN", style="Action.TButton", command=self.handle_login).pack(fill="x", pady=5)
         ttk.Button(frame, text="REGISTER", command=self.handle_register).pack(fill="x")
 
-    def handle_login(self):
+    def connect_and_send(self, command, username, password):
+        # worker side of login / register: (connected, reply)
         if not self.service.connect():
-            return self.safe_alert("error", "Error", "Cannot connect to server")
-            
-        resp = self.service.login(self.entry_user.get(), self.entry_pass.get())
-        if resp and resp['status'] == 'success':
-            self.username = self.entry_user.get()
-            self.init_main_ui()
-        else:
-            msg = resp['msg'] if resp else "Login failed"
-            self.safe_alert("error", "Error", msg)
-            self.service.close()
+            return False, None
+        return True, command(username, password)
+
+    def handle_login(self):
+        username = self.entry_user.get()
+
+        def done(result):
+            connected, resp = result
+            if not connected:
+                return self.safe_alert("error", "Error", "Cannot connect to server")
+            if resp and resp['status'] == 'success':
+                self.username = username
+                self.init_main_ui()
+            else:
+                msg = resp['msg'] if resp else "Login failed"
+                self.safe_alert("error", "Error", msg)
+                self.service.close()
+
+        self.worker.submit(self.connect_and_send, self.service.login, username, self.entry_pass.get(), on_done=done)
 
     def handle_register(self):
-        if not self.service.connect():
-            return self.safe_alert("error", "Error", "Cannot connect to server")
-            
-        resp = self.service.register(self.entry_user.get(), self.entry_pass.get())
-        if resp and resp['status'] == 'success':
-            self.safe_alert("info", "Success", "Registered! Please login.")
-        else:
-            msg = resp['msg'] if resp else "Register Failed"
-            self.safe_alert("error", "Error", msg)
-        self.service.close()
+        def done(result):
+            connected, resp = result
+            if not connected:
+                return self.safe_alert("error", "Error", "Cannot connect to server")
+            if resp and resp['status'] == 'success':
+                self.safe_alert("info", "Success", "Registered! Please login.")
+            else:
+                msg = resp['msg'] if resp else "Register Failed"
+                self.safe_alert("error", "Error", msg)
+            self.service.close()
+
+        self.worker.submit(self.connect_and_send, self.service.register, self.entry_user.get(), self.entry_pass.get(),
+                           on_done=done)
 
     # pure UI
     # --- Main Dashboard ---
@@ -259,9 +290,10 @@ class DeveloperApp:
             if item:
                 gid = item[0]
                 if self.safe_alert("askyesno", "Confirm", f"Delete Game ID {gid}?"):
-                    resp = self.service.delete_game(gid)
-                    if resp: self.safe_alert("info", "Info", resp.get('msg'))
-                    self.refresh_table(tree)
+                    def deleted(resp):
+                        if resp: self.safe_alert("info", "Info", resp.get('msg'))
+                        self.refresh_table(tree)
+                    self.worker.submit(self.service.delete_game, gid, on_done=deleted)
 
         ttk.Button(actions, text="View Reviews", style="Action.TButton", command=on_review).pack(side="left", padx=(0, 10))
         ttk.Button(actions, text="Update Version", style="Success.TButton", command=on_update).pack(side="left", padx=(0, 10))
@@ -271,11 +303,13 @@ class DeveloperApp:
 
     # refresh 
     def refresh_table(self, tree):
-        for item in tree.get_children(): tree.delete(item)
-        
-        games = self.service.get_my_games(self.username)
-        for g in games:
-            tree.insert("", "end", values=(g['id'], g['name'], g['version'], g['type'], g.get('rating', 0.0), g['description']))
+        def fill(games):
+            if not tree.winfo_exists(): return
+            for item in tree.get_children(): tree.delete(item)
+            for g in games:
+                tree.insert("", "end", values=(g['id'], g['name'], g['version'], g['type'], g.get('rating', 0.0), g['description']))
+
+        self.worker.submit(self.service.get_my_games, self.username, on_done=fill)
 
     # --- upload / new ---
     def view_upload_new(self):
@@ -342,8 +376,12 @@ class DeveloperApp:
                 return
             
             meta = {"name": ent_name.get(), "description": ent_desc.get(), "type": cbox.get()}
-            resp = self.service.upload_game(meta, path_var.get())
-            
+            submit_button.config(state="disabled")
+            self.worker.submit(self.service.upload_game, meta, path_var.get(), on_done=uploaded)
+
+        def uploaded(resp):
+            if submit_button.winfo_exists():
+                submit_button.config(state="normal")
             if resp and resp.get('status') == 'success':
                 if is_update:
                     msg = f"Updated to v{old_ver+1}" 
@@ -352,20 +390,24 @@ class DeveloperApp:
 
                 self.safe_alert("info", "Success", msg)
                 if is_update: 
-                    parent.destroy() # Close popup
+                    if parent.winfo_exists(): parent.destroy() # Close popup
                     self.refresh_table(self.content.winfo_children()[1]) # Refresh list if possible
                 else:
                     self.view_my_games()
             else:
-                self.safe_alert("error", "Error", resp.get('msg', 'Failed'))
+                self.safe_alert("error", "Error", resp.get('msg', 'Failed') if resp else 'Failed')
 
         btn_txt = "Confirm Update" if is_update else "Publish to Store"
         btn_style = "Success.TButton" if is_update else "Action.TButton"
-        ttk.Button(form, text=btn_txt, style=btn_style, command=submit).pack(fill="x", pady=10)
+        submit_button = ttk.Button(form, text=btn_txt, style=btn_style, command=submit)
+        submit_button.pack(fill="x", pady=10)
 
     # --- Reviews ---
     def open_reviews_window(self, gid, name):
-        resp = self.service.get_game_reviews(gid)
+        self.worker.submit(self.service.get_game_reviews, gid,
+                           on_done=lambda resp: self.render_reviews_window(gid, name, resp))
+
+    def render_reviews_window(self, gid, name, resp):
         if not resp or resp['status'] != 'success': return
         
         reviews = resp.get('reviews', [])
@@ -378,21 +420,60 @@ class DeveloperApp:
             
             tk.Label(win, text=f"{name}", font=("Helvetica", 18, "bold"), bg="white").pack(pady=20)
             
-            avg = 0
-            if reviews: avg = sum(r['rating'] for r in reviews) / len(reviews)
-            tk.Label(win, text=f"Rating: {avg:.1f} / 5.0  ({len(reviews)} reviews)", fg="#f39c12", bg="white", font=("Arial", 12)).pack()
+            summary = resp.get('rating_summary')
+            if summary:
+                avg, count = summary['average'], summary['count']
+            else: # older server
+                avg, count = 0, len(reviews)
+                if reviews: avg = sum(r['rating'] for r in reviews) / len(reviews)
+            tk.Label(win, text=f"Rating: {avg:.1f} / 5.0  ({count} reviews)", fg="#f39c12", bg="white", font=("Arial", 12)).pack()
             
+            # The server sends the newest reviews a page at a time (an older
+            # server sends them all); older pages are fetched on demand.
+            more_button = ttk.Button(win, text="Load older reviews")
             list_frame = tk.Frame(win)
             list_frame.pack(fill="both", expand=True, padx=20, pady=20)
             
             if not reviews:
                 tk.Label(list_frame, text="No reviews yet.").pack()
-            else:
-                for r in reviews:
+            # a review posted meanwhile shifts the pages by one; users review
+            # a game once, so repeats are skipped by user
+            shown = set()
+            loaded = [0]
+
+            def add_page(page):
+                loaded[0] += len(page)
+                for r in reversed(page):
+                    if r['user'] in shown: continue
+                    shown.add(r['user'])
                     card = tk.Frame(list_frame, bd=1, relief="solid", padx=10, pady=5)
                     card.pack(fill="x", pady=5)
                     tk.Label(card, text=f"{r['user']} ({r['rating']}★)", font=("bold")).pack(anchor="w")
                     tk.Label(card, text=r['comment'], fg="gray", anchor="w").pack(fill="x")
+
+            def update_more(total):
+                if loaded[0] < total:
+                    more_button.config(state="normal")
+                    more_button.pack(before=list_frame, side="bottom", pady=(0, 10))
+                else:
+                    more_button.pack_forget()
+
+            def load_more():
+                more_button.config(state="disabled")
+                self.worker.submit(self.service.get_game_reviews, gid, loaded[0], on_done=more_loaded,
+                                   on_error=lambda error: more_loaded(None))
+
+            def more_loaded(page):
+                if not win.winfo_exists(): return
+                if page and page.get('status') == 'success' and page.get('reviews'):
+                    add_page(page['reviews'])
+                    update_more(page.get('reviews_total', loaded[0]))
+                else:
+                    more_button.config(state="normal")
+
+            more_button.config(command=load_more)
+            add_page(reviews)
+            update_more(resp.get('reviews_total', len(reviews)))
         except: pass
 
 if __name__ == "__main__":
@@ -6,46 +6,154 @@ import subprocess
 import sys
 import shutil
 import json
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from common.protocol import send_json, recv_json, recv_file
+from common.protocol import send_json, recv_json, recv_file, file_sha256
+from common.multiplex import MultiplexConnection, SEARCH_VERSION, UPDATES_VERSION
+from common.delta import apply_delta
+from common.worker import NetworkWorker
+from common.catalog import CatalogCache, page_from_catalog, search_catalog
 
 HOST = 'linux3.cs.nycu.edu.tw'
 PORT = 12131
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DOWNLOAD_DIR = os.path.join(BASE_DIR, 'downloads')
+PAGE_SIZE = 12
+# Store pages kept for revisits (each with its catalog version)
+PAGE_CACHE_SIZE = 64
+# downloads an Update All runs at once, by default
+SYNC_PARALLEL = 4
+# pause in typing before the Store searches
+SEARCH_DELAY_MS = 250
+# reviews the details window shows, and fetches per "older" click
+DETAILS_REVIEWS = 3
+STORE_SORTS = [("Newest", 'newest'), ("Top Rated", 'rating'), ("Name", 'name'), ("Most Played", 'most_played')]
 
 # ======logic =============================
+def installed_sha256(game_file_path):
+    # SHA-256 of an installed game.py, or None if there is none. The hash is
+    # kept in game.py.sha256 with the file's size and mtime, so checking an
+    # unchanged file costs one stat; a file changed since is hashed again.
+    try:
+        stat = os.stat(game_file_path)
+    except OSError:
+        return None
+    try:
+        with open(game_file_path + '.sha256') as f:
+            digest, size, mtime_ns = f.read().split()
+        if (int(size), int(mtime_ns)) == (stat.st_size, stat.st_mtime_ns):
+            return digest
+    except (OSError, ValueError):
+        pass
+    digest = file_sha256(game_file_path)
+    record_installed(game_file_path, digest)
+    return digest
+
+def record_installed(game_file_path, digest):
+    stat = os.stat(game_file_path)
+    with open(game_file_path + '.sha256', 'w') as f:
+        f.write(f"{digest} {stat.st_size} {stat.st_mtime_ns}\n")
+
+def library_state(user_path):
+    # {'id', 'sha256', 'version'} for every game folder under user_path, as
+    # check_updates wants it; both are None for a game whose first download
+    # never finished.
+    state = []
+    for dir_name in os.listdir(user_path):
+        try:
+            game_id = int(dir_name)
+        except ValueError:
+            continue
+        game_dir = os.path.join(user_path, dir_name)
+        try:
+            with open(os.path.join(game_dir, 'version.txt')) as f:
+                version = int(f.read().strip())
+        except (OSError, ValueError):
+            version = None
+        digest = installed_sha256(os.path.join(game_dir, 'game.py')) if version is not None else None
+        state.append({'id': game_id, 'sha256': digest, 'version': version})
+    return state
+
+def needs_update(game, game_dir, local_version):
+    # Servers with the blob store list each game's sha256: the installed
+    # file must have exactly that content, whatever its version number says.
+    # Older servers only give the version.
+    if game.get('sha256'):
+        return installed_sha256(os.path.join(game_dir, 'game.py')) != game['sha256']
+    return local_version < game['version']
+
+class RoomSubscription:
+    # Own connection that only receives room_event pushes for one room. A
+    # reader thread queues them; the Tk side drains the queue with after().
+    def __init__(self, sock, room_id):
+        self.socket = sock
+        self.room_id = room_id
+        self.events = queue.Queue()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def _read_loop(self):
+        while True:
+            try:
+                message = recv_json(self.socket)
+            except Exception:
+                message = None
+            if message is None:
+                self.events.put({'type': 'room_event', 'event': 'disconnected'})
+                return
+            self.events.put(message)
+
+    def close(self):
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
 class GameStoreService:
     def __init__(self):
         self.socket = None
+        self.connection = None
+        # replaced by the user's on-disk cache once logged in
+        self.catalog = CatalogCache()
+        # (sort, offset, limit, filters) -> last list_games page reply
+        self.pages = {}
 
     def connect(self):
         try:
-            if self.socket:
-                self.socket.close()
+            if self.connection:
+                self.connection.close()
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(5)
             self.socket.connect((HOST, PORT))
             self.socket.settimeout(None)
+            self.connection = MultiplexConnection(self.socket)
             return True
         except Exception as error:
             print(f"[Service] Connection Error: {error}")
             return False
 
     def close(self):
-        if self.socket:
-            self.socket.close()
+        if self.connection:
+            self.connection.close()
 
-    def _send_command(self, data):
-        if not self.socket:
-            return None
-        try:
-            if send_json(self.socket, data):
-                return recv_json(self.socket)
-        except Exception:
-            return None
-        return None
+    def request(self, data, on_reply=None):
+        # Future of the reply; any number may be outstanding at once.
+        if not self.connection:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self.connection.request(data, on_reply)
+
+    def _send_command(self, data, on_reply=None):
+        return self.request(data, on_reply).result()
+
+    def batch(self, commands):
+        # Replies for several commands in one round trip, in order.
+        if not self.connection:
+            return [None] * len(commands)
+        return self.connection.batch(commands)
 
     def login(self, username, password):
         return self._send_command({
@@ -63,28 +171,215 @@ class GameStoreService:
             'password': password
         })
 
+    def open_catalog(self, path):
+        self.catalog = CatalogCache(path)
+        self.pages = {}
+
     def get_game_list(self):
-        return self._send_command({'command': 'list_games'})
+        # The whole catalog through the cache, usually for one not_modified
+        # round trip. Offline, the last known catalog comes back with status
+        # 'offline'.
+        response = self.catalog.update(self._send_command(self.catalog.request()))
+        if response is None:
+            return {'status': 'offline', 'data': self.catalog.list(), 'unchanged': True}
+        return response
+
+    def _page_key(self, sort, offset, limit, filters):
+        filters = {key: value for key, value in (filters or {}).items() if value is not None}
+        return (sort, offset, limit, tuple(sorted(filters.items()))), filters
+
+    def cached_page(self, sort, offset, limit, filters=None):
+        # What get_game_page last returned for this page, else the page of
+        # the cached catalog: something to draw before the reply is in.
+        key, filters = self._page_key(sort, offset, limit, filters)
+        return self.pages.get(key) or page_from_catalog(self.catalog.list(), sort, offset, limit, filters)
+
+    def get_game_page(self, sort, offset, limit, filters=None):
+        # One sorted, filtered page of the catalog and the 'total' it pages
+        # through. A page seen before is asked for with its catalog version,
+        # so it usually costs a not_modified reply ('unchanged' is set).
+        # Servers that do not page get the whole catalog synced and paged
+        # here; offline, the cached catalog is paged (status 'offline').
+        key, filters = self._page_key(sort, offset, limit, filters)
+        request = {'command': 'list_games', 'sort': sort, 'offset': offset, 'limit': limit, 'filters': filters}
+        cached = self.pages.get(key)
+        if cached:
+            request['catalog_epoch'] = cached['catalog_epoch']
+            request['catalog_version'] = cached['catalog_version']
+        response = self._send_command(request)
+
+        if response is None:
+            page = page_from_catalog(self.catalog.list(), sort, offset, limit, filters)
+            page['status'] = 'offline'
+            return page
+        if response.get('status') == 'not_modified' and cached:
+            return dict(cached, unchanged=True)
+        if response.get('status') == 'fail':
+            return response
+        if 'total' not in response:
+            catalog = self.get_game_list()
+            page = page_from_catalog(catalog['data'], sort, offset, limit, filters)
+            page['status'] = catalog['status']
+            page['unchanged'] = catalog.get('unchanged')
+            return page
+
+        if len(self.pages) >= PAGE_CACHE_SIZE:
+            self.pages.clear()
+        self.pages[key] = response
+        return response
+
+    def check_updates(self, installed, missing=False):
+        # (games to download, ids removed) for a whole library_state() in
+        # one request, or None offline; with missing, the games to download
+        # include every game not installed yet. Servers before
+        # UPDATES_VERSION never answer check_updates, and older ones leave
+        # out 'missing'; the catalog is compared here instead.
+        if self.connection and (self.connection.server_version or 0) >= UPDATES_VERSION:
+            response = self._send_command({'command': 'check_updates', 'installed': installed, 'missing': missing})
+            if response and response.get('status') == 'success' and (not missing or 'missing' in response):
+                return response['updates'] + response.get('missing', []), response['removed']
+        catalog = self.get_game_list()
+        if catalog['status'] != 'success':
+            return None
+        games = {game['id']: game for game in catalog['data']}
+        updates = []
+        for entry in installed:
+            game = games.get(entry['id'])
+            if game and (entry['version'] is None or (entry['sha256'] != game['sha256'] if game.get('sha256')
+                                                      else entry['version'] < game['version'])):
+                updates.append(game)
+        if missing:
+            installed_ids = {entry['id'] for entry in installed}
+            updates += [game for game in catalog['data'] if game['id'] not in installed_ids]
+        return updates, [entry['id'] for entry in installed if entry['id'] not in games]
+
+    def search_games(self, text, offset, limit, filters=None):
+        # One page of ranked matches for text, words matched as prefixes
+        # (server/search.py). Servers before SEARCH_VERSION never answer
+        # search_games, so then, or offline, the catalog is searched here.
+        _, filters = self._page_key(None, offset, limit, filters)
+        if self.connection and (self.connection.server_version or 0) >= SEARCH_VERSION:
+            response = self._send_command({'command': 'search_games', 'query': text, 'offset': offset,
+                                           'limit': limit, 'filters': filters})
+            if response and response.get('status') == 'success':
+                return response
+        catalog = self.get_game_list()
+        page = search_catalog(catalog['data'], text, offset, limit, filters)
+        page['status'] = catalog['status']
+        return page
 
     def get_room_list(self):
         return self._send_command({'command': 'list_rooms'})
 
-    def get_game_details(self, game_id):
-        return self._send_command({'command': 'get_game_details', 'game_id': game_id})
+    def get_game_details(self, game_id, review_limit=0, review_offset=0):
+        # the game plus its review_limit newest reviews after skipping
+        # review_offset (an older server sends every review)
+        return self._send_command({'command': 'get_game_details', 'game_id': game_id,
+                                   'review_limit': review_limit, 'review_offset': review_offset})
 
-    def download_game(self, game_id, save_path):
-        response = self._send_command({'command': 'download_game', 'game_id': game_id})
-        
-        if response and response['status'] == 'success':
-            server_version = response['version']
-            os.makedirs(save_path, exist_ok=True)
-            game_file_path = os.path.join(save_path, 'game.py')
-            version_file_path = os.path.join(save_path, 'version.txt')
-            if recv_file(self.socket, game_file_path): 
-                with open(version_file_path, 'w') as f:
-                    f.write(str(server_version))
+    def download_game(self, game_id, save_path, use_delta=True, progress=None):
+        # Downloads into game.py.part; game.py and then version.txt are only
+        # replaced once the SHA-256 from the reply matches. A part left by a
+        # dropped connection is resumed, as long as the game has not changed
+        # since (its expected hash is kept next to it). An installed game is
+        # sent only if its hash differs from the server's, and then as deltas
+        # when the server has them; if patching fails, the whole file is
+        # downloaded instead. progress(done, total) follows a full transfer.
+        game_file_path = os.path.join(save_path, 'game.py')
+        version_file_path = os.path.join(save_path, 'version.txt')
+        partial_path = game_file_path + '.part'
+        expected_path = partial_path + '.sha256'
+
+        request = {'command': 'download_game', 'game_id': game_id, 'accept_encoding': ['zlib']}
+        if os.path.exists(partial_path) and os.path.exists(expected_path):
+            with open(expected_path) as f:
+                request['if_range'] = f.read().strip()
+            request['offset'] = os.path.getsize(partial_path)
+        elif os.path.exists(game_file_path):
+            request['if_none_match'] = installed_sha256(game_file_path)
+            if use_delta and os.path.exists(version_file_path):
+                try:
+                    with open(version_file_path) as f:
+                        request['have_version'] = int(f.read().strip())
+                    request['have_sha256'] = request['if_none_match']
+                except (OSError, ValueError):
+                    pass
+
+        # The file follows the reply on the same socket, so it is read on
+        # the connection's reader thread before any other reply.
+        def receive(response):
+            if response['status'] == 'not_modified':
+                with open(version_file_path + '.tmp', 'w') as f:
+                    f.write(str(response['version']))
+                os.replace(version_file_path + '.tmp', version_file_path)
                 return True
-        return False
+            if response['status'] != 'success':
+                if 'offset' in request:
+                    # the server refused the partial copy: drop it and
+                    # download the whole file
+                    os.remove(partial_path)
+                    os.remove(expected_path)
+                    return None
+                return False
+            os.makedirs(save_path, exist_ok=True)
+            digest = response.get('sha256')
+            if digest:
+                with open(expected_path, 'w') as f:
+                    f.write(digest)
+            elif os.path.exists(expected_path):
+                os.remove(expected_path)
+
+            if 'patches' in response:
+                if not self._receive_patches(response['patches'], game_file_path, partial_path):
+                    return None
+            else:
+                resumed = response.get('offset', 0) > 0
+                if not recv_file(self.socket, partial_path, response.get('encoding'), append=resumed,
+                                 progress=progress):
+                    return False
+            if digest and file_sha256(partial_path) != digest:
+                print(f"[Service] Download of game {game_id} failed verification")
+                os.remove(partial_path)
+                os.remove(expected_path)
+                return None if 'patches' in response else False
+
+            with open(version_file_path + '.tmp', 'w') as f:
+                f.write(str(response['version']))
+            os.replace(partial_path, game_file_path)
+            os.replace(version_file_path + '.tmp', version_file_path)
+            if digest:
+                record_installed(game_file_path, digest)
+                os.remove(expected_path)
+            return True
+
+        result = self._send_command(request, receive)
+        if result is None and ('have_version' in request or 'offset' in request) and self.connection and not self.connection.closed:
+            return self.download_game(game_id, save_path, use_delta=False, progress=progress)
+        return bool(result)
+
+    def _receive_patches(self, patch_sizes, game_file_path, partial_path):
+        # Reads every patch transfer (the stream must stay in step even if
+        # one is bad) and writes the patched game to partial_path.
+        patches = []
+        delta_path = partial_path + '.delta'
+        for _ in patch_sizes:
+            if not recv_file(self.socket, delta_path):
+                return False
+            with open(delta_path, 'rb') as f:
+                patches.append(f.read())
+        os.remove(delta_path)
+
+        with open(game_file_path, 'rb') as f:
+            data = f.read()
+        try:
+            for patch in patches:
+                data = apply_delta(data, patch)
+        except ValueError as error:
+            print(f"[Service] Patch Error: {error}")
+            return False
+        with open(partial_path, 'wb') as f:
+            f.write(data)
+        return True
 
     def create_room(self, game_id):
         return self._send_command({'command': 'create_room', 'game_id': game_id})
@@ -98,6 +393,25 @@ class GameStoreService:
     def get_room_info(self, room_id):
         return self._send_command({'command': 'get_room_info', 'room_id': room_id})
 
+    def subscribe_room(self, room_id):
+        # Returns (subscription, room) or (None, None) when the server does
+        # not know subscribe_room; older servers never answer unknown
+        # commands, hence the timeout.
+        sub_socket = None
+        try:
+            sub_socket = socket.create_connection((HOST, PORT), timeout=5)
+            sub_socket.settimeout(3)
+            send_json(sub_socket, {'command': 'subscribe_room', 'room_id': room_id})
+            response = recv_json(sub_socket)
+            if response and response.get('status') == 'success':
+                sub_socket.settimeout(None)
+                return RoomSubscription(sub_socket, room_id), response['data']
+        except Exception as error:
+            print(f"[Service] Subscribe Error: {error}")
+        if sub_socket:
+            sub_socket.close()
+        return None, None
+
     def start_game(self, room_id):
         return self._send_command({'command': 'start_game', 'room_id': room_id})
 
@@ -120,6 +434,258 @@ class GameStoreService:
             'msg': message
         })
 
+class LibrarySync:
+    # Update All: one check_updates request for the whole library, then the
+    # downloads, at most `parallel` at a time. Each download thread keeps a
+    # data connection of its own (downloads need no login), so transfers run
+    # side by side instead of queueing on the control connection. cancel()
+    # closes those connections; what was cut off resumes from its .part.
+    # Install All is the same with install_missing: every game in the
+    # catalog that is not installed yet is downloaded too.
+    def __init__(self, service, user_path, parallel=SYNC_PARALLEL, install_missing=False):
+        self.service = service
+        self.user_path = user_path
+        self.parallel = max(1, parallel)
+        self.install_missing = install_missing
+        self.cancelled = False
+        # set once no more data connections may open
+        self.closed = False
+        self.connections = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def run(self, progress=None):
+        # (updated game ids, failed game ids), or None if the library could
+        # not be checked. progress(done, total) covers all the downloads,
+        # each weighted by its file size.
+        os.makedirs(self.user_path, exist_ok=True)
+        checked = self.service.check_updates(library_state(self.user_path), self.install_missing)
+        if checked is None:
+            return None
+        updates, removed = checked
+        for game_id in removed:
+            shutil.rmtree(os.path.join(self.user_path, str(game_id)), ignore_errors=True)
+
+        sizes = {game['id']: max(game.get('size') or 0, 1) for game in updates}
+        total = sum(sizes.values())
+        fractions = {}
+
+        def report(game_id, fraction):
+            with self.lock:
+                fractions[game_id] = fraction
+                done = sum(sizes[i] * f for i, f in fractions.items())
+            if progress:
+                progress(int(done), total)
+
+        def fetch(game):
+            service = self._connection()
+            if service is None:
+                return False
+            ok = service.download_game(game['id'], os.path.join(self.user_path, str(game['id'])),
+                                       progress=lambda done, size: report(game['id'], done / max(size, 1)))
+            if ok:
+                # deltas and not_modified replies report no progress
+                report(game['id'], 1.0)
+            return ok
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+            results = list(pool.map(fetch, updates))
+        with self.lock:
+            self.closed = True
+        for service in self.connections:
+            service.close()
+        return ([game['id'] for game, ok in zip(updates, results) if ok],
+                [game['id'] for game, ok in zip(updates, results) if not ok])
+
+    def _connection(self):
+        service = getattr(self.local, 'service', None)
+        if service is None:
+            service = GameStoreService()
+            if not service.connect():
+                return None
+            with self.lock:
+                if self.closed:
+                    service.close()
+                    return None
+                self.connections.append(service)
+            self.local.service = service
+        return service
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = self.closed = True
+        for service in list(self.connections):
+            service.close()
+
+# =============================================================================
+# [UI Layer] Recycled views
+# =============================================================================
+class CardGrid:
+    # The Store's game cards. A card is built the first time its grid slot
+    # is needed and reused from then on: showing another page, or a
+    # refreshed one, only rewrites the labels whose text changed and hides
+    # the slots left over, so a redraw costs the same whatever the catalog.
+    def __init__(self, parent, columns, on_open):
+        self.parent = parent
+        self.columns = columns
+        self.on_open = on_open
+        self.slots = []
+
+    def _new_slot(self, i):
+        card = tk.Frame(self.parent, bg="white", relief="raised", bd=1, padx=15, pady=15)
+        card.grid(row=i // self.columns, column=i % self.columns, padx=10, pady=10, sticky="nsew")
+        slot = {'card': card, 'game': None, 'texts': (None, None, None)}
+        slot['labels'] = (tk.Label(card, font=("Arial", 14, "bold"), bg="white"),
+                          tk.Label(card, bg="white", fg="gray"),
+                          tk.Label(card, bg="white", wraplength=200))
+        slot['labels'][0].pack(anchor="w")
+        slot['labels'][1].pack(anchor="w")
+        slot['labels'][2].pack(fill="x", pady=10)
+        ttk.Button(card, text="Details / Download", command=lambda: self.on_open(slot['game'])).pack(fill="x")
+        return slot
+
+    def show(self, games):
+        while len(self.slots) < len(games):
+            self.slots.append(self._new_slot(len(self.slots)))
+        for slot, game in zip(self.slots, games):
+            texts = (game['name'], f"Type: {game['type']} | Rating: {game['rating']}", game['description'][:40]+"...")
+            for label, old, new in zip(slot['labels'], slot['texts'], texts):
+                if old != new:
+                    label.config(text=new)
+            slot['texts'] = texts
+            slot['game'] = game
+            slot['card'].grid()
+        for slot in self.slots[len(games):]:
+            slot['card'].grid_remove()
+            slot['game'] = None
+
+class VirtualTable:
+    # A Treeview over any number of rows that holds one item per visible
+    # line. Scrolling moves a window over the rows and rewrites only the
+    # lines whose values changed; so does set_rows() on a refresh, so
+    # neither depends on how many rows there are. Each row is a tuple whose
+    # first value is its key, and the selection follows the key as the
+    # rows move under it.
+    def __init__(self, parent, columns, lines=15):
+        self.frame = tk.Frame(parent, bg="#f5f5f5")
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings", height=lines, selectmode="browse")
+        for c in columns: self.tree.heading(c, text=c)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.yview)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.rows = []
+        self.positions = {}
+        self.top = 0
+        # item ids, one per line, and the values each line shows (None: the
+        # line is detached, past the last row)
+        self.lines = []
+        self.shown = []
+        self.selected_key = None
+        self.resize(lines)
+
+        self.tree.bind("<<TreeviewSelect>>", self._selected)
+        self.tree.bind("<MouseWheel>", self._wheel)
+        self.tree.bind("<Button-4>", self._wheel)
+        self.tree.bind("<Button-5>", self._wheel)
+        self.tree.bind("<Up>", lambda e: self._step(-1))
+        self.tree.bind("<Down>", lambda e: self._step(1))
+        self.tree.bind("<Prior>", lambda e: self.yview('scroll', -1, 'pages') or "break")
+        self.tree.bind("<Next>", lambda e: self.yview('scroll', 1, 'pages') or "break")
+        self.tree.bind("<Configure>", self._configured)
+
+    def set_rows(self, rows):
+        self.rows = list(rows)
+        self.positions = {row[0]: i for i, row in enumerate(self.rows)}
+        self.scroll_to(self.top)
+
+    def resize(self, count):
+        while len(self.lines) < count:
+            iid = self.tree.insert("", "end")
+            self.tree.detach(iid)
+            self.lines.append(iid)
+            self.shown.append(None)
+        while len(self.lines) > count:
+            self.tree.delete(self.lines.pop())
+            self.shown.pop()
+        self.scroll_to(self.top)
+
+    def scroll_to(self, top):
+        self.top = max(0, min(top, len(self.rows) - len(self.lines)))
+        # attached lines are always a prefix of self.lines, so a line that
+        # comes back goes in at its own index
+        for n, iid in enumerate(self.lines):
+            position = self.top + n
+            values = self.rows[position] if position < len(self.rows) else None
+            if values == self.shown[n]:
+                continue
+            if values is None:
+                self.tree.detach(iid)
+            else:
+                if self.shown[n] is None:
+                    self.tree.move(iid, "", n)
+                self.tree.item(iid, values=values)
+            self.shown[n] = values
+
+        selected = [iid for iid, values in zip(self.lines, self.shown)
+                    if values is not None and values[0] == self.selected_key]
+        if tuple(selected) != tuple(self.tree.selection()):
+            if selected:
+                self.tree.selection_set(selected)
+                self.tree.focus(selected[0])
+            else:
+                self.tree.selection_remove(*self.tree.selection())
+
+        if self.rows:
+            self.scrollbar.set(self.top / len(self.rows), min(1.0, (self.top + len(self.lines)) / len(self.rows)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def yview(self, *args):
+        # Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units' / 'pages')
+        if args[0] == 'moveto':
+            self.scroll_to(round(float(args[1]) * len(self.rows)))
+        elif args[0] == 'scroll':
+            step = int(args[1]) * (len(self.lines) if args[2] == 'pages' else 1)
+            self.scroll_to(self.top + step)
+
+    def _selected(self, event):
+        # a line scrolled out of view deselects itself; that keeps the key
+        selection = self.tree.selection()
+        if selection and selection[0] in self.lines:
+            values = self.shown[self.lines.index(selection[0])]
+            if values is not None:
+                self.selected_key = values[0]
+
+    def _wheel(self, event):
+        step = -3 if event.num == 4 or event.delta > 0 else 3
+        self.scroll_to(self.top + step)
+        return "break"
+
+    def _step(self, delta):
+        if not self.rows:
+            return "break"
+        position = self.positions.get(self.selected_key)
+        if position is None:
+            position = self.top - delta
+        position = max(0, min(len(self.rows) - 1, position + delta))
+        self.selected_key = self.rows[position][0]
+        top = self.top
+        if position < top:
+            top = position
+        elif position >= top + len(self.lines):
+            top = position - len(self.lines) + 1
+        self.scroll_to(top)
+        return "break"
+
+    def _configured(self, event):
+        # as many lines as the tree has room for, measured on the first one
+        box = self.tree.bbox(self.lines[0]) if self.lines and self.shown[0] is not None else ''
+        if box:
+            count = max(1, (event.height - box[1]) // box[3])
+            if count != len(self.lines):
+                self.resize(count)
+
 # =============================================================================
 # [UI Layer] PlayerApp
 # =============================================================================
@@ -134,8 +700,23 @@ class PlayerApp:
     
         self.setup_styles()
         self.service = GameStoreService()
+        # every service call runs on the worker; see common/worker.py
+        self.worker = NetworkWorker(self.root)
+        # calls whose results draw into the current view
+        self.view_tasks = []
+        # view name -> (frame, refresh) of views built once and kept
+        self.kept_views = {}
         self.username = None
         self.room_cache = {}
+        # Store sort order, filters and page offset, kept across views
+        self.store_query = {'search': '', 'sort': 'newest', 'type': None, 'author': None, 'min_rating': None,
+                            'offset': 0}
+        # game_id -> 'GUI' / 'CLI', filled from every catalog or details
+        # reply so launching a game needs no extra request
+        self.game_types = {}
+        self.sync_parallel = SYNC_PARALLEL
+        # started without the server, from the cached catalog
+        self.offline = False
         self.installed_plugins = set()
         
         self.init_login_ui()
@@ -153,6 +734,7 @@ class PlayerApp:
         self.style.configure("Danger.TButton", background="#D32F2F", foreground="white")
 
     def on_close(self):
+        self.worker.close()
         self.service.close()
         try: self.root.destroy()
         except: pass
@@ -207,34 +789,58 @@ class PlayerApp:
         ttk.Button(box, text="Login", command=self.handle_login).pack(fill="x", pady=5)
         ttk.Button(box, text="Register", command=self.handle_register).pack(fill="x")
 
-    def handle_login(self):
+    def connect_and_send(self, command, username, password):
+        # worker side of login / register: (connected, reply)
         if not self.service.connect():
-            messagebox.showerror("Error", "Server not available")
-            return
-            
-        resp = self.service.login(self.entry_user.get(), self.entry_pass.get())
-        if resp and resp['status'] == 'success':
-            self.username = self.entry_user.get()
-            # [Fix] 登入成功後才載入 Plugin
-            self.load_user_plugins()
-            self.init_main_ui()
-        else:
-            msg = resp['msg'] if resp else "Login failed"
-            messagebox.showerror("Failed", msg)
-            self.service.close()
+            return False, None
+        return True, command(username, password)
+
+    def handle_login(self):
+        username = self.entry_user.get()
+
+        def done(result):
+            connected, resp = result
+            if not connected:
+                # the last known catalog and the Library still work offline
+                catalog_path = os.path.join(DOWNLOAD_DIR, username, 'catalog.json')
+                if username and os.path.exists(catalog_path) and messagebox.askyesno(
+                        "Offline", "Server not available. Browse the last known catalog offline?"):
+                    self.start_session(username, offline=True)
+                else:
+                    messagebox.showerror("Error", "Server not available")
+                return
+            if resp and resp['status'] == 'success':
+                self.start_session(username)
+            else:
+                msg = resp['msg'] if resp else "Login failed"
+                messagebox.showerror("Failed", msg)
+                self.service.close()
+
+        self.worker.submit(self.connect_and_send, self.service.login, username, self.entry_pass.get(), on_done=done)
+
+    def start_session(self, username, offline=False):
+        self.username = username
+        self.offline = offline
+        self.service.open_catalog(os.path.join(DOWNLOAD_DIR, username, 'catalog.json'))
+        # [Fix] 登入成功後才載入 Plugin
+        self.load_user_plugins()
+        self.init_main_ui()
 
     def handle_register(self):
-        if not self.service.connect():
-            messagebox.showerror("Error", "Server not available")
-            return
-            
-        resp = self.service.register(self.entry_user.get(), self.entry_pass.get())
-        if resp and resp['status'] == 'success':
-            messagebox.showinfo("Success", "Registered!")
-        else:
-            msg = resp['msg'] if resp else "Register Failed"
-            messagebox.showerror("Failed", msg)
-        self.service.close()
+        def done(result):
+            connected, resp = result
+            if not connected:
+                messagebox.showerror("Error", "Server not available")
+                return
+            if resp and resp['status'] == 'success':
+                messagebox.showinfo("Success", "Registered!")
+            else:
+                msg = resp['msg'] if resp else "Register Failed"
+                messagebox.showerror("Failed", msg)
+            self.service.close()
+
+        self.worker.submit(self.connect_and_send, self.service.register, self.entry_user.get(), self.entry_pass.get(),
+                           on_done=done)
 
     # --- Main Dashboard ---
     def init_main_ui(self):
@@ -244,7 +850,8 @@ class PlayerApp:
         nav.pack(fill="x")
         
         tk.Label(nav, text="GameStore", bg="#2196F3", fg="white", font=("Arial", 18, "bold")).pack(side="left", padx=20)
-        tk.Label(nav, text=f"User: {self.username}", bg="#2196F3", fg="#BBDEFB").pack(side="right", padx=20)
+        user_text = f"User: {self.username}" + (" (Offline)" if self.offline else "")
+        tk.Label(nav, text=user_text, bg="#2196F3", fg="#BBDEFB").pack(side="right", padx=20)
         
         btn_frame = tk.Frame(nav, bg="#2196F3")
         btn_frame.pack(side="right", padx=20)
@@ -256,32 +863,155 @@ class PlayerApp:
 
         self.content = tk.Frame(self.root, bg="#f5f5f5")
         self.content.pack(fill="both", expand=True, padx=20, pady=20)
+        self.kept_views = {}
         
         self.view_store()
 
     def clear_content(self):
-        for w in self.content.winfo_children(): w.destroy()
+        for task in self.view_tasks: task.cancel()
+        self.view_tasks = []
+        kept_frames = [frame for frame, _ in self.kept_views.values()]
+        for w in self.content.winfo_children():
+            if w in kept_frames: w.pack_forget()
+            else: w.destroy()
+
+    def show_kept_view(self, name, build):
+        # Store and Lobby build their widgets once, on first visit, and only
+        # refresh them when shown again; build(frame) returns the refresh.
+        self.clear_content()
+        if name not in self.kept_views:
+            frame = tk.Frame(self.content, bg="#f5f5f5")
+            self.kept_views[name] = (frame, build(frame))
+        frame, refresh = self.kept_views[name]
+        frame.pack(fill="both", expand=True)
+        refresh()
+
+    def run_in_view(self, function, *args, on_done=None):
+        # background call drawing into the current view; cancelled when the
+        # view is cleared, so a late reply never lands in another view
+        task = self.worker.submit(function, *args, on_done=on_done)
+        self.view_tasks.append(task)
+        return task
+
+    def loading_label(self):
+        label = tk.Label(self.content, text="Loading...", fg="gray", bg="#f5f5f5")
+        label.pack(pady=20)
+        return label
 
     # --- View: Store ---
     def view_store(self):
-        self.clear_content()
-        tk.Label(self.content, text="Game Store", font=("Arial", 20, "bold"), bg="#f5f5f5").pack(anchor="w", pady=10)
-        
-        resp = self.service.get_game_list()
-        games = resp.get('data', []) if resp and resp.get('status') == 'success' else []
-        
-        container = tk.Frame(self.content, bg="#f5f5f5")
+        self.show_kept_view('store', self.build_store)
+
+    def build_store(self, frame):
+        tk.Label(frame, text="Game Store", font=("Arial", 20, "bold"), bg="#f5f5f5").pack(anchor="w", pady=10)
+        query = self.store_query
+
+        bar = tk.Frame(frame, bg="#f5f5f5")
+        bar.pack(fill="x", pady=5)
+        tk.Label(bar, text="Search:", bg="#f5f5f5").pack(side="left")
+        search_entry = ttk.Entry(bar, width=18)
+        search_entry.insert(0, query['search'])
+        search_entry.pack(side="left", padx=5)
+        tk.Label(bar, text="Sort:", bg="#f5f5f5").pack(side="left")
+        sort_box = ttk.Combobox(bar, values=[label for label, _ in STORE_SORTS], width=11, state="readonly")
+        sort_box.set(next(label for label, order in STORE_SORTS if order == query['sort']))
+        sort_box.pack(side="left", padx=5)
+        tk.Label(bar, text="Type:", bg="#f5f5f5").pack(side="left")
+        type_box = ttk.Combobox(bar, values=["All", "GUI", "CLI"], width=5, state="readonly")
+        type_box.set(query['type'] or "All")
+        type_box.pack(side="left", padx=5)
+        tk.Label(bar, text="Rating:", bg="#f5f5f5").pack(side="left")
+        rating_box = ttk.Combobox(bar, values=["Any", "1+", "2+", "3+", "4+"], width=5, state="readonly")
+        rating_box.set(f"{query['min_rating']:.0f}+" if query['min_rating'] else "Any")
+        rating_box.pack(side="left", padx=5)
+        tk.Label(bar, text="Author:", bg="#f5f5f5").pack(side="left")
+        author_entry = ttk.Entry(bar, width=12)
+        author_entry.insert(0, query['author'] or "")
+        author_entry.pack(side="left", padx=5)
+
+        status = tk.Label(frame, fg="gray", bg="#f5f5f5")
+        status.pack(anchor="w")
+        container = tk.Frame(frame, bg="#f5f5f5")
         container.pack(fill="both", expand=True)
-        
-        for i, game in enumerate(games):
-            card = tk.Frame(container, bg="white", relief="raised", bd=1, padx=15, pady=15)
-            card.grid(row=i//3, column=i%3, padx=10, pady=10, sticky="nsew")
-            
-            tk.Label(card, text=game['name'], font=("Arial", 14, "bold"), bg="white").pack(anchor="w")
-            tk.Label(card, text=f"Type: {game['type']} | Rating: {game['rating']}", bg="white", fg="gray").pack(anchor="w")
-            tk.Label(card, text=game['description'][:40]+"...", bg="white", wraplength=200).pack(fill="x", pady=10)
-            
-            ttk.Button(card, text="Details / Download", command=lambda g=game: self.show_details_window(g)).pack(fill="x")
+        grid = CardGrid(container, 3, self.show_details_window)
+
+        pager = tk.Frame(frame, bg="#f5f5f5")
+        pager.pack(fill="x", pady=5)
+        prev_button = ttk.Button(pager, text="< Prev", command=lambda: turn(-1))
+        prev_button.pack(side="left")
+        page_label = tk.Label(pager, bg="#f5f5f5")
+        page_label.pack(side="left", padx=10)
+        next_button = ttk.Button(pager, text="Next >", command=lambda: turn(1))
+        next_button.pack(side="left")
+        pending = []
+        typing = []
+
+        def show(page):
+            self.remember_game_types(page['data'])
+            grid.show(page['data'])
+            total = page['total']
+            page_label.config(text=f"Page {query['offset'] // PAGE_SIZE + 1} of {max(1, -(-total // PAGE_SIZE))} ({total} games)")
+            prev_button.state(['!disabled'] if query['offset'] > 0 else ['disabled'])
+            next_button.state(['!disabled'] if query['offset'] + PAGE_SIZE < total else ['disabled'])
+
+        def refreshed(resp):
+            if resp['status'] == 'fail':
+                status.config(text=resp.get('msg', "Failed to load games"))
+                return
+            status.config(text="Offline Mode" if resp['status'] == 'offline' else "")
+            if query['offset'] and query['offset'] >= resp['total']:
+                # the catalog shrank under this page
+                query['offset'] = max(0, (resp['total'] - 1) // PAGE_SIZE * PAGE_SIZE)
+                load()
+            elif not resp.get('unchanged'):
+                show(resp)
+
+        def load():
+            # the cached page right away, redrawn only if it changed; search
+            # results (ranked, so the sort order does not apply) are not cached
+            for task in pending: task.cancel()
+            filters = {'type': query['type'], 'author': query['author'], 'min_rating': query['min_rating']}
+            if query['search']:
+                status.config(text="Searching...")
+                pending[:] = [self.run_in_view(self.service.search_games, query['search'], query['offset'], PAGE_SIZE,
+                                               filters, on_done=refreshed)]
+                return
+            page = self.service.cached_page(query['sort'], query['offset'], PAGE_SIZE, filters)
+            show(page)
+            status.config(text="Refreshing..." if page['data'] else "Loading...")
+            pending[:] = [self.run_in_view(self.service.get_game_page, query['sort'], query['offset'], PAGE_SIZE,
+                                           filters, on_done=refreshed)]
+
+        def turn(step):
+            query['offset'] = max(0, query['offset'] + step * PAGE_SIZE)
+            load()
+
+        def apply_filters(event=None):
+            query['sort'] = dict(STORE_SORTS)[sort_box.get()]
+            query['type'] = None if type_box.get() == "All" else type_box.get()
+            query['min_rating'] = None if rating_box.get() == "Any" else float(rating_box.get()[:-1])
+            query['author'] = author_entry.get().strip() or None
+            query['offset'] = 0
+            load()
+
+        def search_now():
+            typing.clear()
+            text = search_entry.get().strip()
+            if text != query['search']:
+                query['search'] = text
+                query['offset'] = 0
+                load()
+
+        def search_typed(event=None):
+            # searches once typing pauses, not on every key
+            for after_id in typing: self.root.after_cancel(after_id)
+            typing[:] = [self.root.after(SEARCH_DELAY_MS, search_now)]
+
+        for box in (sort_box, type_box, rating_box):
+            box.bind("<<ComboboxSelected>>", apply_filters)
+        author_entry.bind("<Return>", apply_filters)
+        search_entry.bind("<KeyRelease>", search_typed)
+        return load
 
     # --- View: Library ---
     def view_library(self):
@@ -289,99 +1019,180 @@ class PlayerApp:
         tk.Label(self.content, text="My Library", font=("Arial", 20, "bold"), bg="#f5f5f5").pack(anchor="w", pady=10)
         
         user_path = os.path.join(DOWNLOAD_DIR, self.username)
-        if not os.path.exists(user_path):
-            tk.Label(self.content, text="No games downloaded yet.", bg="#f5f5f5").pack(pady=20)
-            return
-            
+        loading = self.loading_label()
+        self.run_in_view(self.scan_library, user_path, on_done=lambda result: self.render_library(result, loading))
+
+    def scan_library(self, user_path):
+        # Worker side of the Library: the catalog request, and hashing
+        # installed games to see which need an update. Returns
+        # (server_games or None when offline, rows).
         resp = self.service.get_game_list()
-        server_available = True
-        server_games = []
-        
-        if not resp or resp.get('status') != 'success':
-            tk.Label(self.content, text="Offline Mode", fg="red", bg="#f5f5f5").pack()
-            server_available = False
-        else:
-            server_games = resp.get('data', [])
-        
-        for dir_name in os.listdir(user_path):
+        server_available = resp['status'] == 'success'
+        server_games = resp['data']
+
+        rows = []
+        for dir_name in (os.listdir(user_path) if os.path.isdir(user_path) else []):
             try:
                 game_id = int(dir_name)
             except: continue
 
             game_dir = os.path.join(user_path, dir_name)
             version_file = os.path.join(game_dir, 'version.txt')
-            if not os.path.exists(version_file): continue
-            
-            with open(version_file) as f: 
-                local_ver = int(f.read().strip())
+            if os.path.exists(version_file):
+                with open(version_file) as f: 
+                    local_ver = int(f.read().strip())
+            elif os.path.exists(os.path.join(game_dir, 'game.py.part')):
+                # first download cut off; Update All finishes it
+                local_ver = None
+            else: continue
             
-            # Sync 
-            if server_available:
-                matching_game = None
-                for g in server_games:
-                    if g['id'] == game_id:
-                        matching_game = g
-                        break
-                
-                if not matching_game:
-                    try: shutil.rmtree(game_dir)
-                    except: pass
-                    continue
-            else:
-                matching_game = None
+            # Sync (offline, the last known catalog still names the games)
+            matching_game = None
+            for g in server_games:
+                if g['id'] == game_id:
+                    matching_game = g
+                    break
+
+            if server_available and not matching_game:
+                try: shutil.rmtree(game_dir)
+                except: pass
+                continue
 
-            # Render
-            if matching_game:
+            if matching_game and server_available:
                 name = matching_game['name']
-                is_outdated = local_ver < matching_game['version']
+                is_outdated = local_ver is None or needs_update(matching_game, game_dir, local_ver)
+            elif matching_game:
+                name = f"{matching_game['name']} (Offline)"
+                is_outdated = False
             else:
                 name = f"Game {game_id} (Offline)"
                 is_outdated = False
-            
+            rows.append((game_id, name, local_ver, is_outdated, matching_game))
+        return (server_games if server_available else None), rows
+
+    def render_library(self, result, loading):
+        loading.destroy()
+        server_games, rows = result
+        if server_games is None:
+            tk.Label(self.content, text="Offline Mode", fg="red", bg="#f5f5f5").pack()
+        else:
+            self.remember_game_types(server_games)
+
+        outdated_count = sum(1 for row in rows if row[3])
+        # games in the catalog with no folder here yet (offline: unknown)
+        local_ids = {row[0] for row in rows}
+        missing_count = sum(1 for g in server_games or [] if g['id'] not in local_ids)
+        if outdated_count or missing_count:
+            bar = tk.Frame(self.content, bg="#f5f5f5")
+            bar.pack(fill="x", pady=5)
+            parallel = tk.Spinbox(bar, from_=1, to=8, width=3)
+            parallel.delete(0, "end")
+            parallel.insert(0, self.sync_parallel)
+            if outdated_count:
+                ttk.Button(bar, text=f"Update All ({outdated_count})", style="Update.TButton",
+                           command=lambda: self.update_all(bar, parallel.get())).pack(side="left")
+            if missing_count:
+                ttk.Button(bar, text=f"Install All ({missing_count})",
+                           command=lambda: self.update_all(bar, parallel.get(), True)).pack(side="left", padx=5)
+            tk.Label(bar, text="Parallel downloads:", bg="#f5f5f5").pack(side="left", padx=(15, 5))
+            parallel.pack(side="left")
+        if not rows:
+            tk.Label(self.content, text="No games downloaded yet.", bg="#f5f5f5").pack(pady=20)
+
+        for game_id, name, local_ver, is_outdated, matching_game in rows:
             row = tk.Frame(self.content, bg="white", padx=15, pady=10, relief="flat")
             row.pack(fill="x", pady=5)
             
             tk.Label(row, text=name, font=("Arial", 12, "bold"), bg="white", width=20, anchor="w").pack(side="left")
-            tk.Label(row, text=f"v{local_ver}", bg="white", width=10).pack(side="left")
+            tk.Label(row, text=f"v{local_ver}" if local_ver is not None else "-", bg="white", width=10).pack(side="left")
             
             if is_outdated:
-                tk.Label(row, text="(Update Available)", fg="orange", bg="white").pack(side="left", padx=5)
+                tk.Label(row, text="(Update Available)" if local_ver is not None else "(Incomplete)",
+                         fg="orange", bg="white").pack(side="left", padx=5)
                 ttk.Button(row, text="Update Now", style="Update.TButton", 
                            command=lambda g=matching_game: self.show_details_window(g)).pack(side="right")
+            elif local_ver is None:
+                tk.Label(row, text="(Incomplete)", fg="gray", bg="white").pack(side="left", padx=5)
             else:
                 ttk.Button(row, text="Create Room", command=lambda gid=game_id: self.handle_create_room(gid)).pack(side="right")
 
+    def update_all(self, library_widget, parallel, install_missing=False):
+        # Runs a LibrarySync with one progress bar for all of it; the
+        # Library is redrawn afterwards if it is still on screen.
+        try:
+            self.sync_parallel = max(1, int(parallel))
+        except ValueError:
+            pass
+        sync = LibrarySync(self.service, os.path.join(DOWNLOAD_DIR, self.username), self.sync_parallel,
+                           install_missing)
+        win = tk.Toplevel(self.root)
+        win.title("Installing Games" if install_missing else "Updating Library")
+        win.geometry("360x130")
+        label = tk.Label(win, text="Checking for updates...")
+        label.pack(pady=(15, 5))
+        bar = ttk.Progressbar(win, length=300, mode="determinate")
+        bar.pack(pady=5)
+
+        def progress(done, total):
+            bar.config(maximum=max(total, 1), value=done)
+            label.config(text=f"Downloading... {done / 1048576:.1f} / {total / 1048576:.1f} MB")
+
+        def finished(result):
+            win.destroy()
+            if result is None:
+                messagebox.showerror("Error", "Could not check for updates")
+            elif result[1] and not sync.cancelled:
+                messagebox.showerror("Error", f"{len(result[1])} of {len(result[0]) + len(result[1])} downloads failed")
+            if library_widget.winfo_exists():
+                self.view_library()
+
+        self.worker.submit(sync.run, on_done=finished, on_progress=progress)
+
+        def cancel():
+            sync.cancel()
+            label.config(text="Cancelling...")
+
+        ttk.Button(win, text="Cancel", command=cancel).pack(pady=5)
+        win.protocol("WM_DELETE_WINDOW", cancel)
+
     # --- View: Lobby ---
     def view_lobby(self):
-        self.clear_content()
-        head = tk.Frame(self.content, bg="#f5f5f5")
+        self.show_kept_view('lobby', self.build_lobby)
+
+    def build_lobby(self, frame):
+        head = tk.Frame(frame, bg="#f5f5f5")
         head.pack(fill="x")
         tk.Label(head, text="Game Lobby", font=("Arial", 20, "bold"), bg="#f5f5f5").pack(side="left")
-        ttk.Button(head, text="Refresh", command=self.view_lobby).pack(side="right")
+        ttk.Button(head, text="Refresh", command=lambda: refresh()).pack(side="right")
         
         cols = ("ID", "Game", "Host", "Status")
-        tree = ttk.Treeview(self.content, columns=cols, show="headings", height=15)
-        for c in cols: tree.heading(c, text=c)
+        table = VirtualTable(frame, cols)
+        tree = table.tree
         tree.column("ID", width=60, anchor="center")
         tree.column("Status", width=100, anchor="center")
-        tree.pack(fill="both", expand=True, pady=10)
+        table.frame.pack(fill="both", expand=True, pady=10)
         
         tree.bind("<Double-1>", lambda e: self.handle_join_check(tree))
-        
-        resp = self.service.get_room_list()
-        self.room_cache = {} 
-        
-        if resp and resp.get('status') == 'success':
-            for room in resp.get('data', []):
-                self.room_cache[room['id']] = room
-                tree.insert("", "end", values=(room['id'], room['game_name'], room['host'], room['status']))
+
+        def render(resp):
+            if resp and resp.get('status') == 'success':
+                rooms = resp.get('data', [])
+                self.room_cache = {room['id']: room for room in rooms}
+                table.set_rows([(room['id'], room['game_name'], room['host'], room['status']) for room in rooms])
+
+        def refresh():
+            self.run_in_view(self.service.get_room_list, on_done=render)
+        return refresh
 
     # --- View: Plugins ---
     def view_plugins(self):
         self.clear_content()
         tk.Label(self.content, text="Plugin Store", font=("Arial", 20, "bold"), bg="#f5f5f5").pack(anchor="w", pady=10)
-        
-        resp = self.service.get_plugins()
+        loading = self.loading_label()
+        self.run_in_view(self.service.get_plugins, on_done=lambda resp: self.render_plugins(resp, loading))
+
+    def render_plugins(self, resp, loading):
+        loading.destroy()
         plugins = resp.get('data', []) if resp and resp.get('status') == 'success' else []
         
         for p in plugins:
@@ -429,53 +1240,104 @@ class PlayerApp:
         if not os.path.exists(game_path) or not os.path.exists(version_file):
             ans = messagebox.askyesno("Missing Game", f"Download '{game_name}' to join?")
             if ans:
-                if self.service.download_game(game_id, game_path):
-                    self.perform_join(room_id)
+                self.download_with_progress(game_id, game_name, game_path,
+                                            lambda ok: self.perform_join(room_id) if ok else None)
             return
 
-        # 2. Version check
+        # 2. Version check, in one round trip with the room's state (both
+        # read-only); the join is only sent once the installed version is
+        # current, so nobody is counted in a room while deciding or
+        # downloading.
         try:
             with open(version_file, 'r') as f:
                 local_ver = int(f.read().strip())
+        except (OSError, ValueError):
+            return
 
-            resp = self.service.get_game_details(game_id)
+        def check():
+            resp, room = self.service.batch([
+                {'command': 'get_game_details', 'game_id': game_id, 'review_limit': 0},
+                {'command': 'get_room_info', 'room_id': room_id},
+            ])
+            outdated = bool(resp and resp['status'] == 'success' and needs_update(resp['game'], game_path, local_ver))
+            return resp, room, outdated
+
+        def checked(result):
+            resp, room, outdated = result
             if resp and resp['status'] == 'success':
-                server_ver = resp['game']['version']
-                if local_ver < server_ver:
-                    ans = messagebox.askyesno("Update Required", "Version out-of-dated. Update now?")
-                    if ans:
-                        if self.service.download_game(game_id, game_path):
-                            self.perform_join(room_id)
-                    return
-        except:
-            return
-            
-        self.perform_join(room_id)
+                self.remember_game_types([resp['game']])
+            if room and (room['status'] != 'success' or room['data']['status'] != 'waiting'):
+                messagebox.showerror("Error", "This room is no longer open")
+            elif not outdated:
+                self.perform_join(room_id)
+            elif messagebox.askyesno("Update Required", "Version out-of-dated. Update now?"):
+                self.download_with_progress(game_id, game_name, game_path,
+                                            lambda ok: self.perform_join(room_id) if ok else None)
+
+        self.worker.submit(check, on_done=checked)
     
-    def perform_join(self, room_id):
-        resp = self.service.join_room(room_id)
+    def perform_join(self, room_id, resp=None):
+        if resp is None:
+            self.worker.submit(self.service.join_room, room_id, on_done=lambda resp: self.perform_join(room_id, resp or {'status': 'fail'}))
+            return
         if resp and resp['status'] == 'success':
             self.open_waiting_room(room_id, resp['game_id'], is_host=False)
         else:
             messagebox.showerror("Error", resp.get('msg', 'Full or Error'))
 
     def handle_create_room(self, game_id):
-        resp = self.service.create_room(game_id)
-        if resp and resp['status'] == 'success':
-            self.open_waiting_room(resp['room_id'], game_id, is_host=True)
-        else:
-            messagebox.showerror("Error", "Create room failed")
+        def done(resp):
+            if resp and resp['status'] == 'success':
+                self.open_waiting_room(resp['room_id'], game_id, is_host=True)
+            else:
+                messagebox.showerror("Error", "Create room failed")
+
+        self.worker.submit(self.service.create_room, game_id, on_done=done)
+
+    # --- Downloads ---
+    def download_with_progress(self, game_id, game_name, path, on_done):
+        # Small window with a progress bar while the worker downloads;
+        # on_done(ok) runs on the Tk thread. Cancel stops waiting for it.
+        win = tk.Toplevel(self.root)
+        win.title("Downloading")
+        win.geometry("320x120")
+        tk.Label(win, text=f"Downloading {game_name}...").pack(pady=(15, 5))
+        bar = ttk.Progressbar(win, length=260, mode="determinate")
+        bar.pack(pady=5)
+
+        def progress(done, total):
+            bar.config(maximum=max(total, 1), value=done)
+
+        def finished(ok):
+            win.destroy()
+            if not ok:
+                messagebox.showerror("Error", "Download failed")
+            on_done(ok)
+
+        task = self.worker.submit(self.service.download_game, game_id, path, on_done=finished, on_progress=progress)
+
+        def cancel():
+            task.cancel()
+            win.destroy()
+
+        ttk.Button(win, text="Cancel", command=cancel).pack(pady=5)
+        win.protocol("WM_DELETE_WINDOW", cancel)
 
     # --- Details Window ---
     def show_details_window(self, basic_info):
-        resp = self.service.get_game_details(basic_info['id'])
-        
+        self.worker.submit(self.service.get_game_details, basic_info['id'], DETAILS_REVIEWS,
+                           on_done=lambda resp: self.open_details_window(basic_info, resp))
+
+    def open_details_window(self, basic_info, resp):
         if resp and resp['status'] == 'success':
             game = resp['game']
-            reviews = resp['reviews']
+            reviews = resp['reviews'][-DETAILS_REVIEWS:]
+            reviews_total = resp.get('reviews_total', 0)
+            self.remember_game_types([game])
         else:
             game = basic_info
             reviews = []
+            reviews_total = 0
 
         win = tk.Toplevel(self.root)
         win.title(game['name'])
@@ -485,13 +1347,14 @@ class PlayerApp:
         tk.Label(win, text=f"Version {game['version']} | {game['type']}", fg="gray").pack()
         tk.Message(win, text=game['description'], width=350).pack(pady=20)
         
+        def downloaded(ok):
+            if ok:
+                if win.winfo_exists(): win.destroy()
+                self.view_library()
+
         def do_download():
             path = os.path.join(DOWNLOAD_DIR, self.username, str(game['id']))
-            if self.service.download_game(game['id'], path):
-                win.destroy()
-                self.view_library()
-            else:
-                messagebox.showerror("Error", "Download failed")
+            self.download_with_progress(game['id'], game['name'], path, downloaded)
 
         ttk.Button(win, text="Download / Update", command=do_download).pack(pady=10)
         
@@ -501,13 +1364,49 @@ class PlayerApp:
         
         if not reviews:
             tk.Label(review_frame, text="No reviews yet.", fg="gray").pack()
-        else:
-            for r in reviews[-3:]: 
+
+        # newest first; older ones a few at a time, on demand
+        shown = set()
+        loaded = [0]
+        older_button = ttk.Button(review_frame, text="Older reviews")
+
+        def add_reviews(page):
+            loaded[0] += len(page)
+            for r in reversed(page):
+                if r['user'] in shown: continue
+                shown.add(r['user'])
                 f = tk.Frame(review_frame, pady=2)
-                f.pack(fill="x")
+                if older_button.winfo_manager():
+                    f.pack(fill="x", before=older_button)
+                else:
+                    f.pack(fill="x")
                 tk.Label(f, text=f"{r['user']} ({r['rating']}★):", font=("bold")).pack(anchor="w")
                 tk.Label(f, text=r['comment'], wraplength=350, justify="left").pack(anchor="w")
 
+        def update_older(total):
+            if loaded[0] < total:
+                older_button.config(state="normal")
+                older_button.pack(pady=2)
+            else:
+                older_button.pack_forget()
+
+        def load_older():
+            older_button.config(state="disabled")
+            self.worker.submit(self.service.get_game_details, game['id'], DETAILS_REVIEWS, loaded[0],
+                               on_done=older_loaded, on_error=lambda error: older_loaded(None))
+
+        def older_loaded(page):
+            if not win.winfo_exists(): return
+            if page and page.get('status') == 'success' and page.get('reviews'):
+                add_reviews(page['reviews'][-DETAILS_REVIEWS:])
+                update_older(page.get('reviews_total', 0))
+            else:
+                older_button.config(state="normal")
+
+        older_button.config(command=load_older)
+        add_reviews(reviews)
+        update_older(reviews_total)
+
         tk.Label(win, text="Write Review:", font=("bold")).pack(pady=(10,5))
         input_frame = tk.Frame(win)
         input_frame.pack(fill="x", padx=20)
@@ -520,17 +1419,20 @@ class PlayerApp:
         entry = tk.Entry(input_frame)
         entry.pack(side="left", fill="x", expand=True)
         
+        def reviewed(resp):
+            if resp and resp['status'] == 'success':
+                messagebox.showinfo("Done", "Review submitted")
+                if win.winfo_exists(): win.destroy()
+            else:
+                msg = resp.get('msg', 'Error') if resp else 'Error'
+                messagebox.showerror("Error", msg)
+
         def do_review():
             try:
                 score = int(cbox.get())
-                resp = self.service.submit_review(game['id'], score, entry.get())
-                if resp and resp['status'] == 'success':
-                    messagebox.showinfo("Done", "Review submitted")
-                    win.destroy()
-                else:
-                    msg = resp.get('msg', 'Error') if resp else 'Error'
-                    messagebox.showerror("Error", msg)
-            except: pass
+            except ValueError:
+                return
+            self.worker.submit(self.service.submit_review, game['id'], score, entry.get(), on_done=reviewed)
             
         ttk.Button(win, text="Submit", command=do_review).pack(pady=10)
 
@@ -555,14 +1457,14 @@ class PlayerApp:
         lst = tk.Listbox(left_panel)
         lst.pack(fill="both", expand=True, pady=10)
         
-        btn_start = ttk.Button(left_panel, text="Start Game", state="disabled", command=lambda: self.service.start_game(room_id))
+        btn_start = ttk.Button(left_panel, text="Start Game", state="disabled",
+                               command=lambda: self.worker.submit(self.service.start_game, room_id))
         if is_host: 
             btn_start.pack(pady=5)
         
         def leave():
-            self.service.leave_room(room_id)
             win.destroy()
-            self.view_lobby()
+            self.worker.submit(self.service.leave_room, room_id, on_done=lambda resp: self.view_lobby())
 
         win.protocol("WM_DELETE_WINDOW", leave)
         ttk.Button(left_panel, text="Leave Room", command=leave).pack(pady=5)
@@ -587,63 +1489,160 @@ class PlayerApp:
             def send_msg(event=None):
                 msg = chat_entry.get()
                 if msg:
-                    self.service.send_chat(room_id, msg)
+                    self.worker.submit(self.service.send_chat, room_id, msg)
                     chat_entry.delete(0, 'end')
             
             chat_entry.bind("<Return>", send_msg)
             ttk.Button(input_frame, text="Send", command=send_msg).pack(side="right")
 
-        def poll():
+        state = {'players': [], 'is_host': is_host, 'subscription': None}
+
+        def unsubscribe():
+            if state['subscription']:
+                state['subscription'].close()
+                state['subscription'] = None
+
+        def close_room_window():
+            unsubscribe()
+            if win.winfo_exists():
+                win.destroy()
+
+        def update_start_button():
+            if state['is_host'] and len(state['players']) >= 2:
+                btn_start.config(state="normal")
+
+        def show_status(status):
+            lbl_status.config(text=f"Status: {status}")
+            if status == 'playing':
+                close_room_window()
+                self.launch_game_process(game_id, room_id)
+                return False
+            return True
+
+        def room_closed():
+            if win.winfo_exists():
+                messagebox.showwarning("System", "Room closed by host.")
+                close_room_window()
+                self.view_lobby()
+
+        def render(data):
+            # full room dict, from subscribe_room or get_room_info
+            state['players'] = list(data['players'])
+            lst.delete(0, tk.END)
+            for p in state['players']: lst.insert(tk.END, p)
+            
+            # [PL3] Update Chat
+            if chat_list and 'chat_history' in data:
+                chat_list.delete(0, tk.END)
+                for msg in data['chat_history']:
+                    chat_list.insert(tk.END, msg)
+                chat_list.see(tk.END)
+            
+            if show_status(data['status']):
+                update_start_button()
+
+        def apply_event(event):
+            kind = event.get('event')
+            if kind == 'player_joined':
+                state['players'].append(event['player'])
+                lst.insert(tk.END, event['player'])
+                update_start_button()
+            elif kind == 'player_left':
+                if event['player'] in state['players']:
+                    index = state['players'].index(event['player'])
+                    del state['players'][index]
+                    lst.delete(index)
+            elif kind == 'host':
+                if event['host'] == self.username and not state['is_host']:
+                    state['is_host'] = True
+                    btn_start.pack(pady=5)
+                    update_start_button()
+            elif kind == 'chat':
+                if chat_list:
+                    chat_list.insert(tk.END, event['line'])
+                    if chat_list.size() > 50:
+                        chat_list.delete(0)
+                    chat_list.see(tk.END)
+            elif kind == 'status':
+                return show_status(event['status'])
+            elif kind == 'closed':
+                room_closed()
+                return False
+            elif kind == 'disconnected':
+                # lost the push connection; keep the room alive by polling
+                state['subscription'] = None
+                poll()
+                return False
+            return True
+
+        def drain_events():
+            subscription = state['subscription']
+            if subscription is None or not win.winfo_exists():
+                return
             try:
-                resp = self.service.get_room_info(room_id)
+                while True:
+                    if not apply_event(subscription.events.get_nowait()):
+                        return
+            except queue.Empty:
+                pass
+            except Exception as e:
+                pass
+            win.after(50, drain_events)
 
+        def polled(resp):
+            if not win.winfo_exists():
+                return
+            try:
                 if not resp or resp['status'] != 'success': 
-                    if win.winfo_exists():
-                        messagebox.showwarning("System", "Room closed by host.")
-                        win.destroy()
-                        self.view_lobby() 
+                    room_closed()
                     return
 
-                if not resp or resp['status'] == 'fail': 
-                    win.destroy()
-                    return
-                
-                data = resp['data']
-                lbl_status.config(text=f"Status: {data['status']}")
-                
-                lst.delete(0, tk.END)
-                for p in data['players']: lst.insert(tk.END, p)
-                
-                # [PL3] Update Chat
-                if chat_list and 'chat_history' in data:
-                    chat_list.delete(0, tk.END)
-                    for msg in data['chat_history']:
-                        chat_list.insert(tk.END, msg)
-                    chat_list.see(tk.END)
-                
-                if data['status'] == 'playing':
-                    win.destroy()
-                    self.launch_game_process(game_id, room_id)
+                render(resp['data'])
+                if not win.winfo_exists():
                     return
-                
-                if is_host and len(data['players']) >= 2: 
-                    btn_start.config(state="normal")
             except Exception as e:
                 pass
   
-            if win.winfo_exists(): 
-                win.after(1000, poll)
-        
-        poll()
+            win.after(1000, poll)
+
+        def poll():
+            # fallback for servers without subscribe_room
+            if win.winfo_exists():
+                self.worker.submit(self.service.get_room_info, room_id, on_done=polled)
+
+        def subscribed(result):
+            subscription, room = result
+            if not win.winfo_exists():
+                if subscription: subscription.close()
+                return
+            if subscription is None:
+                poll()
+            else:
+                state['subscription'] = subscription
+                win.bind("<Destroy>", lambda event: unsubscribe() if event.widget is win else None)
+                render(room)
+                drain_events()
+
+        self.worker.submit(self.service.subscribe_room, room_id, on_done=subscribed)
 
     # --- Launch Game Process ---
+    def remember_game_types(self, games):
+        for game in games:
+            self.game_types[game['id']] = game['type']
+
     def launch_game_process(self, game_id, room_id):
-        resp = self.service.get_game_details(game_id)
-        if not resp or resp['status'] != 'success':
-            print("[Error] Cannot fetch game type")
+        game_type = self.game_types.get(game_id)
+        if game_type is None:
+            def fetched(resp):
+                if not resp or resp['status'] != 'success':
+                    print("[Error] Cannot fetch game type")
+                    return
+                self.remember_game_types([resp['game']])
+                self.launch_game_process(game_id, room_id)
+
+            self.worker.submit(self.service.get_game_details, game_id, on_done=fetched)
             return
-        
-        game_type = resp['game']['type']
+
         game_dir = os.path.join(DOWNLOAD_DIR, self.username, str(game_id))
         full_script_path = os.path.join(game_dir, 'game.py')
         
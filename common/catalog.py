@@ -0,0 +1,112 @@
+import json
+import os
+import re
+import threading
+
+# Client side of conditional list_games (see server/catalog.py): the last
+# known catalog and the catalog version it was at. Each refresh sends that
+# version and folds the answer in; usually it is a small not_modified reply.
+#
+# Given a path, the cache is also kept on disk, so a client can show the
+# last known catalog before the server has answered, or while it cannot be
+# reached. Replies from servers without catalog versions simply replace the
+# whole cache every time.
+
+class CatalogCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.epoch = None
+        self.version = None
+        self.games = {}
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.games = {game['id']: game for game in data['games']}
+            self.epoch = data['epoch']
+            self.version = data['version']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'epoch': self.epoch, 'version': self.version, 'games': self.list()}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def list(self):
+        return [self.games[game_id] for game_id in sorted(self.games)]
+
+    def request(self):
+        request = {'command': 'list_games'}
+        with self.lock:
+            if self.version is not None:
+                request['catalog_epoch'] = self.epoch
+                request['catalog_version'] = self.version
+        return request
+
+    def update(self, response):
+        # Folds a list_games reply into the cache. Returns the whole catalog
+        # as {'status': 'success', 'data': [...]}, with 'unchanged' set when
+        # nothing changed since the last refresh, or None if it failed.
+        if not response or response.get('status') not in ('success', 'not_modified'):
+            return None
+        with self.lock:
+            unchanged = response['status'] == 'not_modified'
+            if 'data' in response:
+                self.games = {game['id']: game for game in response['data']}
+            elif not unchanged:
+                for game in response.get('changed', []):
+                    self.games[game['id']] = game
+                for game_id in response.get('removed', []):
+                    self.games.pop(game_id, None)
+            self.epoch = response.get('catalog_epoch')
+            self.version = response.get('catalog_version')
+            if not unchanged:
+                try:
+                    self.save()
+                except OSError as error:
+                    print(f"[Catalog] Save Error: {error}")
+            return {'status': 'success', 'data': self.list(), 'unchanged': unchanged}
+
+# The sort orders of paged list_games, as server/storage.py sorts them:
+# every order ends with the game id, so pages never overlap.
+SORT_ORDERS = ('newest', 'rating', 'name', 'most_played')
+
+def sort_key(order, game):
+    if order == 'newest':
+        return (-game['id'],)
+    if order == 'rating':
+        return (-game.get('rating', 0), game['id'])
+    if order == 'name':
+        return (game['name'].lower(), game['id'])
+    return (-game.get('play_count', 0), game['id'])
+
+def page_from_catalog(games, sort, offset, limit, filters=None):
+    # A list_games page worked out locally from a whole catalog, for
+    # servers that do not page and for offline use.
+    filters = filters or {}
+    matching = [game for game in games
+                if filters.get('type') in (None, game['type'])
+                and filters.get('author') in (None, game['author'])
+                and (filters.get('min_rating') is None or game.get('rating', 0) >= filters['min_rating'])]
+    matching.sort(key=lambda game: sort_key(sort, game))
+    return {'status': 'success', 'total': len(matching), 'offset': offset,
+            'data': matching[offset:offset + limit]}
+
+def search_catalog(games, text, offset, limit, filters=None):
+    # search_games worked out locally: games with a name, author or
+    # description word starting with every word of text, best rated first.
+    terms = re.findall(r'\w+', text.lower())
+    matching = []
+    for game in games:
+        words = re.findall(r'\w+', f"{game['name']} {game['author']} {game.get('description', '')}".lower())
+        if terms and all(any(word.startswith(term) for word in words) for term in terms):
+            matching.append(game)
+    return page_from_catalog(matching, 'rating', offset, limit, filters)
@@ -0,0 +1,91 @@
+import json
+import struct
+
+# Frame payload encodings. JSON is the default and what every old client
+# speaks; 'binary' is only sent to a connection that asked for it with a
+# hello (see request_codec in protocol.py).
+#
+# 'binary' packs the fixed-shape game relay messages with struct and leaves
+# everything else as JSON: for the larger lobby and catalog dicts the C json
+# module is faster than any pure-Python tagged encoding (see
+# benchmarks/bench_codec.py). Receivers never need to know what was
+# negotiated: a JSON payload is an object and starts with '{', a binary one
+# starts with a tag byte below.
+
+CODECS = ('binary', 'json')
+
+TAG_OPPONENT_MOVE = 0x01    # {'type': 'opponent_move', 'index': int, 'symbol': str}
+TAG_GAME_MOVE = 0x02        # {'command': 'game_move', 'room_id': int, 'index': int, 'symbol': str}
+TAG_GAME_START = 0x03       # {'type': 'game_start', 'symbol': str, 'opponent': str, 'turn': bool}
+
+OPPONENT_MOVE = struct.Struct('>BiB')
+GAME_MOVE = struct.Struct('>BiiB')
+GAME_START = struct.Struct('>B?BB')
+
+INT32_MIN = -(1 << 31)
+INT32_MAX = (1 << 31) - 1
+
+def _short_text(value):
+    if type(value) is not str:
+        return None
+    data = value.encode('utf-8')
+    if len(data) > 255:
+        return None
+    return data
+
+def encode_binary(message):
+    # Returns the packed payload, or None when the message has no fixed
+    # layout (wrong keys, types or ranges) and should go out as JSON.
+    kind = message.get('type')
+    if kind == 'opponent_move' and len(message) == 3:
+        index = message.get('index')
+        symbol = _short_text(message.get('symbol'))
+        if type(index) is int and INT32_MIN <= index <= INT32_MAX and symbol is not None:
+            return OPPONENT_MOVE.pack(TAG_OPPONENT_MOVE, index, len(symbol)) + symbol
+
+    elif kind == 'game_start' and len(message) == 4:
+        symbol = _short_text(message.get('symbol'))
+        opponent = _short_text(message.get('opponent'))
+        turn = message.get('turn')
+        if symbol is not None and opponent is not None and type(turn) is bool:
+            return GAME_START.pack(TAG_GAME_START, turn, len(symbol), len(opponent)) + symbol + opponent
+
+    elif kind is None and len(message) == 4 and message.get('command') == 'game_move':
+        room_id = message.get('room_id')
+        index = message.get('index')
+        symbol = _short_text(message.get('symbol'))
+        if (type(room_id) is int and type(index) is int and symbol is not None
+                and INT32_MIN <= room_id <= INT32_MAX and INT32_MIN <= index <= INT32_MAX):
+            return GAME_MOVE.pack(TAG_GAME_MOVE, room_id, index, len(symbol)) + symbol
+
+    return None
+
+def encode(message, codec='json'):
+    if codec == 'binary':
+        payload = encode_binary(message)
+        if payload is not None:
+            return payload
+    return json.dumps(message).encode('utf-8')
+
+def decode(payload):
+    # payload: bytes, bytearray or memoryview of one frame
+    tag = payload[0]
+    if tag == TAG_OPPONENT_MOVE:
+        _, index, length = OPPONENT_MOVE.unpack_from(payload)
+        start = OPPONENT_MOVE.size
+        return {'type': 'opponent_move', 'index': index, 'symbol': str(payload[start:start + length], 'utf-8')}
+
+    if tag == TAG_GAME_MOVE:
+        _, room_id, index, length = GAME_MOVE.unpack_from(payload)
+        start = GAME_MOVE.size
+        return {'command': 'game_move', 'room_id': room_id, 'index': index,
+                'symbol': str(payload[start:start + length], 'utf-8')}
+
+    if tag == TAG_GAME_START:
+        _, turn, symbol_length, opponent_length = GAME_START.unpack_from(payload)
+        start = GAME_START.size
+        middle = start + symbol_length
+        return {'type': 'game_start', 'symbol': str(payload[start:middle], 'utf-8'),
+                'opponent': str(payload[middle:middle + opponent_length], 'utf-8'), 'turn': turn}
+
+    return json.loads(str(payload, 'utf-8'))
@@ -0,0 +1,81 @@
+import difflib
+import struct
+import zlib
+
+# Binary deltas between two versions of a game file, for update downloads.
+#
+# Both versions are cut into lines (any byte string splits on b'\n', so this
+# works for non-text files too, just less well) and matched with difflib.
+# The delta is a zlib-compressed list of operations that rebuild the new
+# version from the old one:
+#
+#   COPY    offset, length    bytes taken from the old version
+#   INSERT  length, data      new bytes
+#
+# A one-line fix to a large game is a handful of COPYs and one short INSERT.
+# apply_delta checks the result length; callers verify the SHA-256.
+
+OP_COPY = 0x00
+OP_INSERT = 0x01
+COPY = struct.Struct('>BII')
+INSERT = struct.Struct('>BI')
+HEADER = struct.Struct('>4sI')
+MAGIC = b'GDL1'
+
+def _line_offsets(lines):
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+def make_delta(old_data, new_data):
+    old_lines = old_data.splitlines(keepends=True)
+    new_lines = new_data.splitlines(keepends=True)
+    old_offsets = _line_offsets(old_lines)
+
+    operations = [HEADER.pack(MAGIC, len(new_data))]
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            start = old_offsets[old_start]
+            operations.append(COPY.pack(OP_COPY, start, old_offsets[old_end] - start))
+        elif new_end > new_start:
+            data = b''.join(new_lines[new_start:new_end])
+            operations.append(INSERT.pack(OP_INSERT, len(data)))
+            operations.append(data)
+    return zlib.compress(b''.join(operations), zlib.Z_BEST_COMPRESSION)
+
+def apply_delta(old_data, delta):
+    # Raises ValueError if the delta is malformed or does not fit old_data.
+    try:
+        operations = memoryview(zlib.decompress(delta))
+    except zlib.error as error:
+        raise ValueError(f"corrupt delta: {error}")
+    if len(operations) < HEADER.size:
+        raise ValueError("corrupt delta: no header")
+    magic, new_size = HEADER.unpack_from(operations)
+    if magic != MAGIC:
+        raise ValueError("not a game delta")
+
+    parts = []
+    position = HEADER.size
+    while position < len(operations):
+        operation = operations[position]
+        if operation == OP_COPY:
+            _, start, length = COPY.unpack_from(operations, position)
+            if start + length > len(old_data):
+                raise ValueError("delta does not match the old version")
+            parts.append(old_data[start:start + length])
+            position += COPY.size
+        elif operation == OP_INSERT:
+            _, length = INSERT.unpack_from(operations, position)
+            position += INSERT.size
+            parts.append(bytes(operations[position:position + length]))
+            position += length
+        else:
+            raise ValueError(f"corrupt delta: operation {operation}")
+
+    new_data = b''.join(parts)
+    if len(new_data) != new_size:
+        raise ValueError("delta produced the wrong size")
+    return new_data
@@ -0,0 +1,147 @@
+import itertools
+import queue
+import socket
+import threading
+from concurrent.futures import Future
+
+from common.protocol import send_json, recv_frame, unpack_message, PROTOCOL_VERSION
+
+# Client side of request ids (see process_request in server.py). Any thread
+# may call request() and gets a Future; one reader thread owns the socket
+# and resolves futures as replies arrive, in whatever order the server sends
+# them. Frames with a 'type' are pushes and go to the events queue.
+#
+# Servers that predate ids answer in order and without an id, so a reply
+# without one resolves the oldest outstanding request instead.
+#
+# The connection opens with a JSON-only hello just to learn the server's
+# protocol version (server_version stays None on servers without hello);
+# its answer always comes before the reply to any later request.
+
+# first protocol version with the batch command
+BATCH_VERSION = 4
+# first protocol version with search_games
+SEARCH_VERSION = 5
+# first protocol version with check_updates
+UPDATES_VERSION = 6
+
+class MultiplexConnection:
+    # Returned by an on_reply callback that expects another reply frame for
+    # the same request (upload_game: 'ready', then the final status).
+    MORE = object()
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.events = queue.Queue()
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        self.closed = False
+        self.server_version = None
+        threading.Thread(target=self._read_loop, daemon=True).start()
+        with self.send_lock:
+            send_json(sock, {'command': 'hello', 'codecs': ['json'], 'version': PROTOCOL_VERSION})
+
+    def request(self, message, on_reply=None, exclusive=False):
+        # on_reply(reply) runs on the reader thread before any later frame
+        # is read, so it may read a file transfer from self.socket; its
+        # return value becomes the result. With exclusive, no other request
+        # is sent until on_reply has run, so on_reply may also send a file
+        # the server reads right after this request. Failed connections
+        # resolve to None, like a lost reply did before.
+        future = Future()
+        self.send_lock.acquire()
+        with self.pending_lock:
+            if self.closed:
+                self.send_lock.release()
+                future.set_result(None)
+                return future
+            request_id = next(self.request_ids)
+            self.pending[request_id] = [future, on_reply, exclusive]
+        sent = send_json(self.socket, dict(message, id=request_id))
+        if not exclusive:
+            self.send_lock.release()
+        if not sent:
+            self._resolve(request_id, None)
+        return future
+
+    def call(self, message, on_reply=None, exclusive=False):
+        return self.request(message, on_reply, exclusive).result()
+
+    def batch(self, messages):
+        # One round trip for several commands that need no file transfer;
+        # the results line up with messages. Older servers get the same
+        # requests pipelined instead.
+        if (self.server_version or 0) >= BATCH_VERSION:
+            reply = self.call({'command': 'batch', 'commands': messages})
+            if reply and reply.get('status') == 'success':
+                return reply['results']
+            return [None] * len(messages)
+        futures = [self.request(message) for message in messages]
+        return [future.result() for future in futures]
+
+    def _release(self, entry):
+        # hands the send lock back once an exclusive request is answered
+        if entry[2]:
+            entry[2] = False
+            self.send_lock.release()
+
+    def _resolve(self, request_id, result):
+        with self.pending_lock:
+            entry = self.pending.pop(request_id, None)
+        if entry:
+            self._release(entry)
+            entry[0].set_result(result)
+
+    def _handle_reply(self, message):
+        with self.pending_lock:
+            request_id = message.get('id')
+            if request_id is None and self.pending:
+                request_id = min(self.pending)
+            entry = self.pending.get(request_id)
+        if entry is None:
+            return
+        on_reply = entry[1]
+        result = message
+        if on_reply:
+            try:
+                result = on_reply(message)
+            except Exception as error:
+                print(f"[Multiplex] Reply Error: {error}")
+                result = None
+        if result is self.MORE:
+            self._release(entry)
+        else:
+            self._resolve(request_id, result)
+
+    def _read_loop(self):
+        while True:
+            try:
+                payload = recv_frame(self.socket)
+                message = unpack_message(payload) if payload else None
+            except Exception:
+                message = None
+            if message is None:
+                break
+            if message.get('type') == 'codec':
+                self.server_version = message.get('version')
+            elif 'type' in message and 'id' not in message:
+                self.events.put(message)
+            else:
+                self._handle_reply(message)
+
+        with self.pending_lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for entry in pending.values():
+            self._release(entry)
+            entry[0].set_result(None)
+
+    def close(self):
+        # shutdown wakes the reader thread, which then fails what is pending
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
@@ -1,61 +1,322 @@
-import socket
 import struct
-import json
 import os
+import asyncio
+import hashlib
+import tempfile
+import weakref
+import zlib
+
+from common.codec import CODECS, encode, decode
+
+# Bumped when the wire protocol changes in a way a hello should announce.
+PROTOCOL_VERSION = 6
+
+def pack_message(data_dictionary, codec='json'):
+    payload = encode(data_dictionary, codec)
+    return struct.pack('>I', len(payload)) + payload
+
+# Codec this side sends with, per socket. Starts as JSON and only changes
+# when the server confirms a hello (see request_codec and recv_json).
+_send_codecs = weakref.WeakKeyDictionary()
 
 def send_json(socket_connection, data_dictionary):
     try:
-        json_string = json.dumps(data_dictionary)
-        json_bytes = json_string.encode('utf-8')
-        message_length = len(json_bytes)
-        
-        header = struct.pack('>I', message_length)
-        
-        socket_connection.sendall(header + json_bytes)
+        socket_connection.sendall(pack_message(data_dictionary, _send_codecs.get(socket_connection, 'json')))
         return True
     except Exception as error:
         print(f"[Protocol] Send Error: {error}")
         return False
 
+def unpack_message(payload):
+    # JSON or any binary layout from codec.py
+    return decode(payload)
+
+def request_codec(socket_connection, codecs=CODECS):
+    # Asks the server for a more compact codec without waiting for the
+    # answer: the reply is a {'type': 'codec'} frame that recv_json consumes
+    # on its own. Old servers ignore hello, so the socket just stays JSON.
+    return send_json(socket_connection, {'command': 'hello', 'codecs': list(codecs), 'version': PROTOCOL_VERSION})
+
+# ===== buffered reader =====
+# One FrameReader per socket. Each recv_into fills a reusable buffer with as
+# much as the kernel has, so a burst of small frames costs one syscall, and
+# payloads are handed out as memoryview slices of that buffer instead of
+# being copied into new bytes objects.
+#
+# A payload view is only valid until the next read on the same socket.
+# Every read of a socket must go through its reader (recv_frame, recv_json,
+# recv_file, receive_all_bytes), since it may already hold the next bytes.
+#
+# The buffer starts small, since most connections only ever see small
+# frames, and doubles (up to MAX_BUFFER_SIZE) when a frame or file header
+# announces a larger body.
+#
+# A header is only a claim: frames over MAX_FRAME_SIZE close the connection,
+# and the body of a frame over MAX_BUFFER_SIZE is collected as it arrives,
+# so memory follows the bytes actually received, not the header.
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+LARGE_READ_SIZE = 1024 * 1024
+
+class FrameTooLarge(ValueError):
+    pass
+
+def check_frame_size(length, limit=MAX_FRAME_SIZE):
+    if length > limit:
+        raise FrameTooLarge(f"{length} byte frame exceeds {limit}")
+
+class FrameReader:
+    INITIAL_BUFFER_SIZE = 8 * 1024
+    MAX_BUFFER_SIZE = 256 * 1024
+
+    def __init__(self, socket_connection):
+        self.socket = socket_connection
+        self.buffer = bytearray(self.INITIAL_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def _grow(self, size):
+        new_size = len(self.buffer)
+        while new_size < size:
+            new_size *= 2
+        new_size = min(new_size, self.MAX_BUFFER_SIZE)
+        if new_size <= len(self.buffer):
+            return
+        available = self.end - self.start
+        buffer = bytearray(new_size)
+        buffer[:available] = self.view[self.start:self.end]
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.start = 0
+        self.end = available
+
+    def _fill(self, minimum):
+        # Make at least `minimum` bytes available at self.start.
+        available = self.end - self.start
+        if available >= minimum:
+            return True
+        if self.start + minimum > len(self.buffer):
+            # move the unread tail to the front
+            self.view[:available] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = available
+        while self.end - self.start < minimum:
+            received = self.socket.recv_into(self.view[self.end:])
+            if not received:
+                return False
+            self.end += received
+        return True
+
+    def _take(self, length):
+        chunk = self.view[self.start:self.start + length]
+        self.start += length
+        if self.start == self.end:
+            self.start = self.end = 0
+        return chunk
+
+    def read_exactly(self, length):
+        if length <= self.MAX_BUFFER_SIZE:
+            self._grow(length)
+            if not self._fill(length):
+                return None
+            return self._take(length)
+
+        # Larger than the buffer: collect it in a buffer of its own, which
+        # grows only as the bytes come in.
+        payload = bytearray(self.view[self.start:self.end])
+        self.start = self.end = 0
+        while len(payload) < length:
+            received = self.socket.recv(min(length - len(payload), LARGE_READ_SIZE))
+            if not received:
+                return None
+            payload += received
+        return memoryview(payload)
+
+    def read_frame(self):
+        if not self._fill(4):
+            return None
+        message_length = FRAME_HEADER.unpack_from(self.buffer, self.start)[0]
+        check_frame_size(message_length)
+        self.start += 4
+        return self.read_exactly(message_length)
+
+    def read_into_file(self, file_handle, size):
+        # Copies `size` bytes to file_handle; returns how many were written.
+        self._grow(size)
+        remaining = size
+        while remaining:
+            if self.start == self.end:
+                self.start = self.end = 0
+                received = self.socket.recv_into(self.view)
+                if not received:
+                    break
+                self.end = received
+            chunk_size = min(remaining, self.end - self.start)
+            file_handle.write(self._take(chunk_size))
+            remaining -= chunk_size
+        return size - remaining
+
+_readers = weakref.WeakKeyDictionary()
+
+def frame_reader(socket_connection):
+    reader = _readers.get(socket_connection)
+    if reader is None:
+        reader = FrameReader(socket_connection)
+        _readers[socket_connection] = reader
+    return reader
+
+# Returns the raw payload of one frame (without the 4-byte header), or None.
+def recv_frame(socket_connection):
+    try:
+        return frame_reader(socket_connection).read_frame()
+    except Exception:
+        return None
+
 def recv_json(socket_connection):
     try:
-        header_data = receive_all_bytes(socket_connection, 4)
-        
-        if not header_data:
-            return None
-        
-        message_length = struct.unpack('>I', header_data)[0]
- 
-        json_bytes = receive_all_bytes(socket_connection, message_length)
-        
-        if not json_bytes:
-            return None
+        while True:
+            json_bytes = recv_frame(socket_connection)
             
-        json_string = json_bytes.decode('utf-8')
-        data_dictionary = json.loads(json_string)
-        
-        return data_dictionary
+            if not json_bytes:
+                return None
+                
+            message = unpack_message(json_bytes)
+            if message.get('type') == 'codec':
+                _send_codecs[socket_connection] = message['codec']
+                continue
+            return message
     except Exception as error:
         return None
 
-def send_file(socket_connection, file_path):
+# ===== file transfers =====
+# Raw transfers are an 8-byte size followed by the file. When both sides
+# agreed on encoding='zlib' (through fields of the request and reply that
+# start the transfer), the 8-byte header still carries the uncompressed size,
+# followed by the zlib stream in length-prefixed chunks and a zero-length
+# chunk. The sender can compress on the fly (at any level) or stream a copy
+# that was compressed ahead of time; the receiver inflates as it reads.
+#
+# Files that go out as they are on disk (raw files and precompressed copies,
+# which hold the framed body) use the kernel's sendfile where the platform
+# has it, so the bytes never pass through Python.
+#
+# A transfer may start at an offset into the file (resumed downloads); the
+# header then holds the size of the rest, and a zlib body compresses only
+# the rest, so precompressed copies are for whole files only. Receivers can
+# append to what they already have.
+TRANSFER_ENCODINGS = ('zlib',)
+COMPRESSION_LEVEL = 6
+CHUNK_SIZE = 65536
+CHUNK_HEADER = struct.Struct('>I')
+# far above what compressing CHUNK_SIZE bytes can produce
+MAX_CHUNK_SIZE = 16 * CHUNK_SIZE
+USE_SENDFILE = hasattr(os, 'sendfile')
+
+def _file_chunks(file_path, offset=0):
+    with open(file_path, 'rb') as file_handle:
+        file_handle.seek(offset)
+        while True:
+            chunk_data = file_handle.read(CHUNK_SIZE)
+            if not chunk_data:
+                break
+            yield chunk_data
+
+def _compressed_chunks(file_path, level, offset=0):
+    compressor = zlib.compressobj(level)
+    for chunk_data in _file_chunks(file_path, offset):
+        compressed = compressor.compress(chunk_data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def encoded_chunks(file_path, level=COMPRESSION_LEVEL, offset=0):
+    # The framed zlib body of a transfer, after its 8-byte header.
+    for chunk_data in _compressed_chunks(file_path, level, offset):
+        if chunk_data:
+            yield CHUNK_HEADER.pack(len(chunk_data)) + chunk_data
+    yield CHUNK_HEADER.pack(0)
+
+def compress_file(file_path, compressed_path, level=zlib.Z_BEST_COMPRESSION):
+    # Writes the framed zlib body of file_path to compressed_path
+    # (atomically), to be served later as a precompressed_path.
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(compressed_path) or '.')
+    with os.fdopen(file_descriptor, 'wb') as file_handle:
+        for chunk_data in encoded_chunks(file_path, level):
+            file_handle.write(chunk_data)
+    os.replace(temporary_path, compressed_path)
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    for chunk_data in _file_chunks(file_path):
+        digest.update(chunk_data)
+    return digest.hexdigest()
+
+def send_file(socket_connection, file_path, encoding=None, level=COMPRESSION_LEVEL, precompressed_path=None, offset=0):
     if not os.path.exists(file_path):
         return False
     
-    file_size = os.path.getsize(file_path)
+    file_size = os.path.getsize(file_path) - offset
     header = struct.pack('>Q', file_size)
     socket_connection.sendall(header)
+
+    if encoding == 'zlib' and not precompressed_path:
+        for chunk_data in encoded_chunks(file_path, level, offset):
+            socket_connection.sendall(chunk_data)
+        return True
     
-    with open(file_path, 'rb') as file_handle:
+    with open(precompressed_path or file_path, 'rb') as file_handle:
+        if USE_SENDFILE:
+            socket_connection.sendfile(file_handle, offset)
+            return True
+        file_handle.seek(offset)
         while True:
-            chunk_data = file_handle.read(4096)
+            chunk_data = file_handle.read(CHUNK_SIZE)
             if not chunk_data:
                 break
             socket_connection.sendall(chunk_data)
             
     return True
 
-def recv_file(socket_connection, save_path):
+def _inflate_into(file_handle, read_exactly, decompressor):
+    # read_exactly returns the next n bytes or None at end of stream. Returns
+    # the number of uncompressed bytes written.
+    written = 0
+    while True:
+        header_data = read_exactly(CHUNK_HEADER.size)
+        if header_data is None:
+            return None
+        chunk_size = CHUNK_HEADER.unpack(header_data)[0]
+        if chunk_size == 0:
+            break
+        check_frame_size(chunk_size, MAX_CHUNK_SIZE)
+        chunk_data = read_exactly(chunk_size)
+        if chunk_data is None:
+            return None
+        data = decompressor.decompress(chunk_data)
+        file_handle.write(data)
+        written += len(data)
+    data = decompressor.flush()
+    file_handle.write(data)
+    return written + len(data)
+
+class _ProgressWriter:
+    # file handle wrapper reporting progress(bytes written, total)
+    def __init__(self, file_handle, total, progress):
+        self.file_handle = file_handle
+        self.total = total
+        self.progress = progress
+        self.done = 0
+
+    def write(self, data):
+        self.file_handle.write(data)
+        self.done += len(data)
+        self.progress(self.done, self.total)
+
+def recv_file(socket_connection, save_path, encoding=None, append=False, progress=None):
+    # True only when the whole announced size arrived; with append the data
+    # goes after what save_path already holds. progress(done, total) is
+    # called as the data is written.
     header_data = receive_all_bytes(socket_connection, 8)
     
     if not header_data:
@@ -66,39 +327,144 @@ def recv_file(socket_connection, save_path):
     directory_path = os.path.dirname(save_path)
     if directory_path:
         os.makedirs(directory_path, exist_ok=True)
+
+    mode = 'ab' if append else 'wb'
+    if encoding == 'zlib':
+        reader = frame_reader(socket_connection)
+        with open(save_path, mode) as file_handle:
+            if progress:
+                file_handle = _ProgressWriter(file_handle, file_size, progress)
+            try:
+                written = _inflate_into(file_handle, reader.read_exactly, zlib.decompressobj())
+            except Exception:
+                return False
+        return written == file_size
+    
+    written = 0
+    with open(save_path, mode) as file_handle:
+        if progress:
+            file_handle = _ProgressWriter(file_handle, file_size, progress)
+        try:
+            written = frame_reader(socket_connection).read_into_file(file_handle, file_size)
+        except Exception:
+            pass
+            
+    return written == file_size
+
+def receive_all_bytes(socket_connection, target_length):
+    try:
+        received_data = frame_reader(socket_connection).read_exactly(target_length)
+    except Exception:
+        return None
+    if received_data is None:
+        return None
+    return bytes(received_data)
+
+# ===== asyncio streams =====
+# Counterparts of send_json / recv_json for asyncio streams. A stream has no
+# per-socket codec state, so the sender names the codec it negotiated;
+# decoding recognises every codec on its own.
+async def async_send_json(stream_writer, data_dictionary, codec='json'):
+    try:
+        stream_writer.write(pack_message(data_dictionary, codec))
+        await stream_writer.drain()
+        return True
+    except Exception as error:
+        print(f"[Protocol] Send Error: {error}")
+        return False
+
+async def async_recv_frame(stream_reader):
+    try:
+        header_data = await stream_reader.readexactly(4)
+        message_length = struct.unpack('>I', header_data)[0]
+        check_frame_size(message_length)
+        
+        return await stream_reader.readexactly(message_length)
+    except Exception as error:
+        return None
+
+async def async_recv_json(stream_reader):
+    try:
+        json_bytes = await async_recv_frame(stream_reader)
+        
+        if not json_bytes:
+            return None
+            
+        return unpack_message(json_bytes)
+    except Exception as error:
+        return None
+
+async def async_send_file(stream_writer, file_path, encoding=None, level=COMPRESSION_LEVEL, precompressed_path=None,
+                          offset=0):
+    if not os.path.exists(file_path):
+        return False
+    
+    file_size = os.path.getsize(file_path) - offset
+    stream_writer.write(struct.pack('>Q', file_size))
+
+    if encoding == 'zlib' and not precompressed_path:
+        for chunk_data in encoded_chunks(file_path, level, offset):
+            stream_writer.write(chunk_data)
+            await stream_writer.drain()
+        return True
+
+    await stream_writer.drain()
+    if USE_SENDFILE:
+        # falls back to buffered writes on transports without sendfile
+        with open(precompressed_path or file_path, 'rb') as file_handle:
+            await asyncio.get_running_loop().sendfile(stream_writer.transport, file_handle, offset)
+        return True
+
+    for chunk_data in _file_chunks(precompressed_path or file_path, offset):
+        stream_writer.write(chunk_data)
+        await stream_writer.drain()
+    
+    await stream_writer.drain()
+    return True
+
+async def async_recv_file(stream_reader, save_path, encoding=None):
+    try:
+        header_data = await stream_reader.readexactly(8)
+    except Exception:
+        return False
+        
+    file_size = struct.unpack('>Q', header_data)[0]
+    
+    directory_path = os.path.dirname(save_path)
+    if directory_path:
+        os.makedirs(directory_path, exist_ok=True)
+
+    if encoding == 'zlib':
+        decompressor = zlib.decompressobj()
+        written = 0
+        with open(save_path, 'wb') as file_handle:
+            try:
+                while True:
+                    header_data = await stream_reader.readexactly(CHUNK_HEADER.size)
+                    chunk_size = CHUNK_HEADER.unpack(header_data)[0]
+                    if chunk_size == 0:
+                        break
+                    check_frame_size(chunk_size, MAX_CHUNK_SIZE)
+                    data = decompressor.decompress(await stream_reader.readexactly(chunk_size))
+                    file_handle.write(data)
+                    written += len(data)
+                data = decompressor.flush()
+                file_handle.write(data)
+                written += len(data)
+            except Exception:
+                return False
+        return written == file_size
     
     total_received = 0
     with open(save_path, 'wb') as file_handle:
         while total_received < file_size:
-            remaining_bytes = file_size - total_received
-            
-            if remaining_bytes < 4096:
-                chunk_size = remaining_bytes
-            else:
-                chunk_size = 4096
-                
-            chunk_data = receive_all_bytes(socket_connection, chunk_size)
-            
-            if not chunk_data:
+            chunk_size = min(file_size - total_received, 65536)
+            try:
+                chunk_data = await stream_reader.readexactly(chunk_size)
+            except Exception:
                 break
                 
             file_handle.write(chunk_data)
             total_received += len(chunk_data)
             
-    return True
-
-def receive_all_bytes(socket_connection, target_length):
-    received_data = b''
-    
-    while len(received_data) < target_length:
-        bytes_needed = target_length - len(received_data)
-        
-        try:
-            packet = socket_connection.recv(bytes_needed)
-            if not packet:
-                return None
-            received_data += packet
-        except:
-            return None
-            
-    return received_data
\ No newline at end of file
+    return total_received == file_size
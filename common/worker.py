@@ -0,0 +1,101 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+# Runs blocking client calls (GameStoreService methods: requests, uploads,
+# downloads) off the Tk thread, so the window keeps redrawing however slow
+# the server is. Tk is not thread safe, so worker threads never touch a
+# widget: results and progress reports go to a completion queue that the Tk
+# thread drains from root.after once a frame, and the callbacks run there.
+#
+#   task = worker.submit(service.get_game_list, on_done=show_games)
+#   worker.submit(service.download_game, game_id, path,
+#                 on_done=finished, on_progress=update_bar)
+#
+# With on_progress the function is called with progress=report, where
+# report(done, total) may be called from any thread; reports are coalesced,
+# so a fast transfer costs at most one callback per frame.
+#
+# task.cancel() keeps a queued call from starting and drops the callbacks of
+# one that is running. A request already on the wire still completes, since
+# the control connection has to stay in step.
+
+FRAME_MS = 16
+NETWORK_WORKERS = 4
+
+class Task:
+    def __init__(self, on_done, on_error, on_progress):
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.cancelled = False
+        self.future = None
+        self.latest_progress = None
+        self.progress_queued = False
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future:
+            self.future.cancel()
+
+class NetworkWorker:
+    def __init__(self, root, workers=NETWORK_WORKERS):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.completions = queue.Queue()
+        self.closed = False
+        self.root.after(FRAME_MS, self._drain)
+
+    def submit(self, function, *args, on_done=None, on_error=None, on_progress=None):
+        task = Task(on_done, on_error, on_progress)
+        kwargs = {}
+        if on_progress:
+            kwargs['progress'] = lambda done, total: self._report(task, done, total)
+        task.future = self.executor.submit(self._run, task, function, args, kwargs)
+        return task
+
+    def _run(self, task, function, args, kwargs):
+        if task.cancelled:
+            return
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            self.completions.put((task, 'error', error))
+            return
+        self.completions.put((task, 'done', result))
+
+    def _report(self, task, done, total):
+        task.latest_progress = (done, total)
+        if not task.progress_queued and not task.cancelled:
+            task.progress_queued = True
+            self.completions.put((task, 'progress', None))
+
+    def _drain(self):
+        try:
+            while True:
+                task, kind, value = self.completions.get_nowait()
+                if task.cancelled:
+                    continue
+                try:
+                    if kind == 'progress':
+                        task.progress_queued = False
+                        task.on_progress(*task.latest_progress)
+                    elif kind == 'done':
+                        if task.on_done:
+                            task.on_done(value)
+                    elif task.on_error:
+                        task.on_error(value)
+                    else:
+                        print(f"[Worker] Error: {value}")
+                except Exception as error:
+                    print(f"[Worker] Callback Error: {error}")
+        except queue.Empty:
+            pass
+        if not self.closed:
+            try:
+                self.root.after(FRAME_MS, self._drain)
+            except Exception:
+                self.closed = True
+
+    def close(self):
+        self.closed = True
+        self.executor.shutdown(wait=False)
@@ -6,7 +6,7 @@ import time
 
 try:
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-    from common.protocol import send_json, recv_json
+    from common.protocol import send_json, recv_json, request_codec
 except ImportError:
     print("Error: Cannot find 'common.protocol'.")
     sys.exit(1)
@@ -35,6 +35,7 @@ class BingoGame:
             import socket
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((HOST, PORT))
+            request_codec(self.sock)
             send_json(self.sock, {'command': 'game_join', 'room_id': self.room_id, 'username': self.username})
             return True
         except Exception as e:
@@ -8,7 +8,7 @@ import random
 
 try:
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-    from common.protocol import send_json, recv_json
+    from common.protocol import send_json, recv_json, request_codec
 except ImportError:
     print("Error: Cannot find 'common.protocol'.")
     sys.exit(1)
@@ -45,6 +45,7 @@ class GuessGame:
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((HOST, PORT))
+            request_codec(self.sock)
             send_json(self.sock, {
                 'command': 'game_join', 
                 'room_id': self.room_id, 
@@ -5,10 +5,10 @@ import threading
 import sys
 
 try:
-    from common.protocol import send_json, recv_json
+    from common.protocol import send_json, recv_json, request_codec
 except ImportError:
     sys.path.append('../')
-    from common.protocol import send_json, recv_json
+    from common.protocol import send_json, recv_json, request_codec
 
 HOST = 'linux3.cs.nycu.edu.tw'
 PORT = 12131
@@ -39,6 +39,7 @@ class Game:
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((HOST, PORT))
+            request_codec(self.sock)
             send_json(self.sock, {'command': 'game_join', 'room_id': self.rid, 'username': self.user})
         except Exception as e:
             messagebox.showerror("Error", f"Connection Failed: {e}")
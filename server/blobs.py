@@ -0,0 +1,75 @@
+import os
+import shutil
+
+from common.protocol import compress_file, file_sha256
+
+# Content-addressed store for game files: blobs/<first two hex digits>/<sha256>.
+# The catalog points every game at the blob of its current file (the game's
+# sha256), so identical uploads, across games or versions, are stored once.
+# games/<id>/game.py and versions/<v>.py are hard links to their blob.
+#
+# Blobs are never written in place, only added whole, which is what makes
+# the links safe: uploads land in a temporary file that is added afterwards.
+# A blob's zlib copy (<sha256>.z, the framed body of common/protocol.py)
+# therefore never goes stale either.
+#
+# Blobs no game or version links to any more are left in place; their link
+# count (st_nlink == 1) tells them apart if the store ever needs cleaning.
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def add(self, file_path, digest=None):
+        # Returns the sha256 of file_path, adding it to the store unless an
+        # identical blob is already there. file_path itself is left alone.
+        digest = digest or file_sha256(file_path)
+        blob_path = self.path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            try:
+                os.link(file_path, blob_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                # no hard links on this file system
+                shutil.copyfile(file_path, blob_path + '.tmp')
+                os.replace(blob_path + '.tmp', blob_path)
+        return digest
+
+    def link(self, digest, target_path):
+        # Atomically makes target_path the blob, replacing what was there.
+        # (rename() is a no-op between two links to the same file, which
+        # would leave the temporary link behind.)
+        try:
+            if os.path.samefile(self.path(digest), target_path):
+                return
+        except FileNotFoundError:
+            pass
+        temp_path = target_path + '.link'
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(self.path(digest), temp_path)
+        except OSError:
+            shutil.copyfile(self.path(digest), temp_path)
+        os.replace(temp_path, target_path)
+
+    def compressed(self, digest):
+        # Best-compression copy of the blob, built on first use. This reads
+        # and deflates the whole blob; the server calls it off the request
+        # path and uses compressed_if_ready() while serving.
+        compressed_path = self.path(digest) + '.z'
+        if not os.path.exists(compressed_path):
+            compress_file(self.path(digest), compressed_path)
+        return compressed_path
+
+    def compressed_if_ready(self, digest):
+        # The blob's zlib copy if it has been built, else None.
+        compressed_path = self.path(digest) + '.z'
+        return compressed_path if os.path.exists(compressed_path) else None
@@ -0,0 +1,66 @@
+import bisect
+import os
+import threading
+
+# Catalog version for conditional list_games. Every change a catalog entry
+# can show (upload, remove, review) bumps the version and records which game
+# it touched, so a client that names the version it last saw gets only the
+# entries changed since, or nothing at all.
+#
+# The counter lives in memory. The epoch, a random token per server run,
+# tells clients whose version came from an earlier run (or another server)
+# that they need the full list.
+#
+# Handlers bump only after the storage write, and list_games reads the
+# version before reading storage, so a reply may carry a change newer than
+# its version (sent again next time) but never misses one. A removed game
+# stays removed until it is published again; later bumps (a late play or
+# review) must not drop it from the removed list.
+
+class CatalogVersion:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = os.urandom(8).hex()
+        self.version = 0
+        # game_id -> version of its last change / of its removal
+        self.changed = {}
+        self.removed = {}
+        # (version, game_id) of every bump, oldest first, so changes_since
+        # only looks at what came after the client's version. Entries a
+        # later bump of the same game made stale are skipped there, and
+        # dropped when they outnumber the live ones.
+        self.log = []
+
+    def bump(self, game_id, removed=False, published=False):
+        with self.lock:
+            if game_id in self.removed and not (removed or published):
+                return self.version
+            self.version += 1
+            if removed:
+                self.changed.pop(game_id, None)
+                self.removed[game_id] = self.version
+            else:
+                self.removed.pop(game_id, None)
+                self.changed[game_id] = self.version
+            self.log.append((self.version, game_id))
+            if len(self.log) > 2 * (len(self.changed) + len(self.removed)) + 64:
+                self.log = sorted((version, game_id) for latest in (self.changed, self.removed)
+                                  for game_id, version in latest.items())
+            return self.version
+
+    def current(self):
+        return self.epoch, self.version
+
+    def changes_since(self, epoch, version):
+        # (changed game ids, removed game ids) after version, or None when
+        # the client has to start over with the full list
+        with self.lock:
+            if epoch != self.epoch or type(version) is not int or not 0 <= version <= self.version:
+                return None
+            changed, removed = [], []
+            for logged_at, game_id in self.log[bisect.bisect_right(self.log, (version, float('inf'))):]:
+                if self.changed.get(game_id) == logged_at:
+                    changed.append(game_id)
+                elif self.removed.get(game_id) == logged_at:
+                    removed.append(game_id)
+            return changed, removed
@@ -0,0 +1,195 @@
+import time
+import threading
+
+# Command registry for server.py. Handlers are looked up in one dict instead
+# of walking an if/elif chain, and every dispatch is measured: call count,
+# latency histogram, time spent waiting on locks and bytes in/out.
+#
+# Per-request numbers are collected in a thread-local context, so relay bytes
+# sent to other players and lock waits inside storage are charged to the
+# command that caused them. This works for the asyncio engine too, because a
+# handler always runs to completion on the loop thread.
+
+_current = threading.local()
+
+def _context():
+    return getattr(_current, 'context', None)
+
+def count_bytes_out(byte_count):
+    context = _context()
+    if context is not None:
+        context['bytes_out'] += byte_count
+
+class TimedLock:
+    # Drop-in threading.Lock that charges contention to the current command.
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        start_time = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        context = _context()
+        if context is not None:
+            context['lock_wait'] += time.perf_counter() - start_time
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+class LatencyHistogram:
+    # Log-scale buckets from 10 us to ~100 s (each bucket 25% wider than the
+    # last), so recording is O(1) and percentiles are within one bucket.
+    BASE = 1e-5
+    GROWTH = 1.25
+    BUCKETS = 72
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.total = 0
+        self.max_seconds = 0.0
+
+    def record(self, seconds):
+        index = 0
+        bound = self.BASE
+        while seconds > bound and index < self.BUCKETS:
+            bound *= self.GROWTH
+            index += 1
+        self.counts[index] += 1
+        self.total += 1
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def percentile(self, fraction):
+        if not self.total:
+            return 0.0
+        target = fraction * self.total
+        seen = 0
+        bound = self.BASE
+        for count in self.counts:
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_seconds)
+            bound *= self.GROWTH
+        return self.max_seconds
+
+class CommandStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.lock_wait_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = LatencyHistogram()
+
+    def snapshot(self, uptime):
+        def ms(seconds):
+            return round(seconds * 1000, 3)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'per_sec': round(self.calls / uptime, 2) if uptime > 0 else 0.0,
+            'avg_ms': ms(self.total_seconds / self.calls) if self.calls else 0.0,
+            'p50_ms': ms(self.latency.percentile(0.50)),
+            'p95_ms': ms(self.latency.percentile(0.95)),
+            'p99_ms': ms(self.latency.percentile(0.99)),
+            'max_ms': ms(self.latency.max_seconds),
+            'lock_wait_ms': ms(self.lock_wait_seconds),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out
+        }
+
+class CommandRegistry:
+    def __init__(self):
+        self.handlers = {}
+        # read-only commands that may run off the connection's own thread
+        self.concurrent = set()
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.started_at = time.time()
+
+    def command(self, name, concurrent=False):
+        def register(handler):
+            self.handlers[name] = handler
+            self.stats[name] = CommandStats()
+            if concurrent:
+                self.concurrent.add(name)
+            return handler
+        return register
+
+    def dispatch(self, session, request, bytes_in=0, respond=True):
+        # Handlers return their reply, or None when they answered by
+        # themselves (e.g. a reply followed by a file transfer). With respond
+        # the reply is sent here (with session.send, or with respond itself
+        # if it is callable) so its bytes are measured; otherwise it is
+        # returned to the caller. Unknown commands are ignored.
+        name = request.get('command')
+        handler = self.handlers.get(name)
+        if handler is None:
+            return None
+
+        outer_context = _context()
+        context = {'lock_wait': 0.0, 'bytes_out': 0}
+        _current.context = context
+        start_time = time.perf_counter()
+        failed = True
+        try:
+            reply = handler(session, request)
+            if respond and reply is not None:
+                if callable(respond):
+                    respond(reply)
+                else:
+                    session.send(reply)
+            failed = False
+            return reply
+        finally:
+            elapsed = time.perf_counter() - start_time
+            _current.context = outer_context
+            if outer_context is not None:
+                outer_context['lock_wait'] += context['lock_wait']
+                outer_context['bytes_out'] += context['bytes_out']
+            with self.stats_lock:
+                stats = self.stats[name]
+                stats.calls += 1
+                stats.errors += failed
+                stats.total_seconds += elapsed
+                stats.lock_wait_seconds += context['lock_wait']
+                stats.bytes_in += bytes_in
+                stats.bytes_out += context['bytes_out']
+                stats.latency.record(elapsed)
+
+    def snapshot(self):
+        uptime = time.time() - self.started_at
+        with self.stats_lock:
+            commands = {}
+            for name, stats in self.stats.items():
+                if stats.calls:
+                    commands[name] = stats.snapshot(uptime)
+        return {'uptime_sec': round(uptime, 1), 'commands': commands}
+
+    def format_table(self):
+        snapshot = self.snapshot()
+        lines = [f"[Stats] uptime {snapshot['uptime_sec']}s",
+                 f"{'command':<18}{'calls':>9}{'/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'lockms':>10}{'in':>11}{'out':>12}"]
+        for name, row in sorted(snapshot['commands'].items(), key=lambda item: -item[1]['calls']):
+            lines.append(f"{name:<18}{row['calls']:>9}{row['per_sec']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+                         f"{row['p99_ms']:>9}{row['lock_wait_ms']:>10}{row['bytes_in']:>11}{row['bytes_out']:>12}")
+        return '\n'.join(lines)
+
+    def start_periodic_dump(self, interval):
+        def dump_loop():
+            while True:
+                time.sleep(interval)
+                print(self.format_table())
+
+        threading.Thread(target=dump_loop, daemon=True).start()
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import threading
+
+# Every mutation of the server database is appended to the journal as one JSON
+# line instead of rewriting db.json. db.json stays the snapshot format; a
+# background compactor periodically folds the journal back into it.
+#
+# The owner supplies apply_record(operation, args) for replay. Operations must
+# be idempotent, so replaying a record that is already part of the snapshot
+# (e.g. one written while a compaction was running) is harmless.
+
+class Journal:
+    def __init__(self, journal_path, fsync_interval=1.0):
+        # fsync_interval: 0 syncs every record, > 0 batches syncs to at most
+        # one per interval, < 0 leaves syncing to the OS.
+        self.journal_path = journal_path
+        self.compacting_path = journal_path + '.compacting'
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.file_handle = None
+        self.records_since_compaction = 0
+        self.last_compaction = time.time()
+        self.needs_sync = False
+
+    def open(self):
+        directory_path = os.path.dirname(self.journal_path)
+        if directory_path:
+            os.makedirs(directory_path, exist_ok=True)
+        self.file_handle = open(self.journal_path, 'a', encoding='utf-8')
+
+        if self.fsync_interval > 0:
+            threading.Thread(target=self._sync_loop, daemon=True).start()
+
+    def append(self, operation, args):
+        record = json.dumps({'op': operation, 'args': args})
+        with self.lock:
+            self.file_handle.write(record + '\n')
+            self.file_handle.flush()
+            self.records_since_compaction += 1
+            if self.fsync_interval == 0:
+                os.fsync(self.file_handle.fileno())
+            else:
+                self.needs_sync = True
+
+    def sync(self):
+        with self.lock:
+            if self.needs_sync and self.file_handle:
+                os.fsync(self.file_handle.fileno())
+                self.needs_sync = False
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+            except Exception as error:
+                print(f"[Journal] Sync Error: {error}")
+
+    def replay(self, apply_record):
+        replayed = 0
+        # A leftover .compacting file means the server stopped mid-compaction;
+        # its records are older than the live journal, so replay it first.
+        for path in (self.compacting_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as file_handle:
+                for line in file_handle:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # torn write at the tail of the log
+                        break
+                    apply_record(record['op'], record['args'])
+                    replayed += 1
+        return replayed
+
+    def compact(self, write_snapshot):
+        # Cut the log first, then snapshot: every record in the cut-off part
+        # was applied to memory before it was logged, so the snapshot
+        # contains it and the old part can be dropped.
+        with self.lock:
+            self.file_handle.flush()
+            os.fsync(self.file_handle.fileno())
+            self.file_handle.close()
+            if not os.path.exists(self.compacting_path):
+                os.replace(self.journal_path, self.compacting_path)
+            else:
+                # previous compaction never finished; keep its records too
+                with open(self.journal_path, 'r', encoding='utf-8') as src, \
+                     open(self.compacting_path, 'a', encoding='utf-8') as dst:
+                    dst.write(src.read())
+                os.remove(self.journal_path)
+            self.file_handle = open(self.journal_path, 'a', encoding='utf-8')
+            self.records_since_compaction = 0
+            self.last_compaction = time.time()
+            self.needs_sync = False
+
+        if write_snapshot():
+            os.remove(self.compacting_path)
+            return True
+        return False
+
+    def start_compactor(self, write_snapshot, interval=60.0, max_records=1000):
+        def compactor_loop():
+            while True:
+                time.sleep(1.0)
+                with self.lock:
+                    pending = self.records_since_compaction
+                    elapsed = time.time() - self.last_compaction
+                if pending == 0:
+                    continue
+                if pending >= max_records or elapsed >= interval:
+                    try:
+                        self.compact(write_snapshot)
+                        print(f"[Journal] Compacted {pending} records.")
+                    except Exception as error:
+                        print(f"[Journal] Compaction Error: {error}")
+
+        threading.Thread(target=compactor_loop, daemon=True).start()
+
+    def close(self):
+        with self.lock:
+            if self.file_handle:
+                self.file_handle.flush()
+                os.fsync(self.file_handle.fileno())
+                self.file_handle.close()
+                self.file_handle = None
@@ -0,0 +1,125 @@
+import threading
+from collections import deque
+
+# Bounded outbound queue owned by every client session. Commands never write
+# to another player's socket: they enqueue here and the session's own writer
+# (a thread or an asyncio task) drains the queue, so one stalled client can
+# only ever fill its own queue.
+#
+# The bound applies to pushed events (relays, room updates). Replies to the
+# connection's own requests are always queued, since the client is waiting
+# for them. What happens to a push when the queue is full depends on policy:
+#
+#   drop        discard the new event
+#   coalesce    drop a queued event with the same coalesce key (the new one
+#               goes to the tail, so it never overtakes events queued
+#               after the old one), otherwise discard the oldest queued
+#               event that has a key; events
+#               without one (game moves) are never discarded, so with none
+#               to evict the connection is closed
+#   disconnect  close the connection
+#
+# The queue itself is not synchronized; the owning session guards it.
+
+SLOW_CONSUMER_POLICIES = ('drop', 'coalesce', 'disconnect')
+
+class SlowConsumer(Exception):
+    pass
+
+class OutboxStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = 0
+        self.queued = 0
+        self.max_depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.disconnected = 0
+
+    def add(self, field, amount=1):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def observe_depth(self, depth):
+        if depth > self.max_depth:
+            with self.lock:
+                self.max_depth = max(self.max_depth, depth)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'queues': self.queues,
+                'queued_frames': self.queued,
+                'max_depth': self.max_depth,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'disconnected': self.disconnected
+            }
+
+outbox_stats = OutboxStats()
+
+class OutboundQueue:
+    def __init__(self, limit=256, policy='disconnect'):
+        self.limit = limit
+        self.policy = policy
+        self.items = deque()
+        outbox_stats.add('queues')
+
+    def __len__(self):
+        return len(self.items)
+
+    def offer(self, item, push=False, coalesce_key=None):
+        # item is ('frame', bytes) or ('file', path). Returns False when the
+        # item was dropped; raises SlowConsumer under the disconnect policy.
+        if push and len(self.items) >= self.limit:
+            if self.policy == 'disconnect':
+                outbox_stats.add('disconnected')
+                raise SlowConsumer()
+
+            if self.policy == 'drop':
+                outbox_stats.add('dropped')
+                return False
+
+            if not self._drop_same_key(coalesce_key) and not self._drop_oldest_keyed_push():
+                outbox_stats.add('disconnected')
+                raise SlowConsumer()
+            self._append(item, push, coalesce_key)
+            return True
+
+        self._append(item, push, coalesce_key)
+        return True
+
+    def _append(self, item, push, coalesce_key):
+        self.items.append((item, push, coalesce_key))
+        outbox_stats.add('queued')
+        outbox_stats.observe_depth(len(self.items))
+
+    def _drop_same_key(self, coalesce_key):
+        if coalesce_key is None:
+            return False
+        for index, (_, push, key) in enumerate(self.items):
+            if push and key == coalesce_key:
+                del self.items[index]
+                outbox_stats.add('queued', -1)
+                outbox_stats.add('coalesced')
+                return True
+        return False
+
+    def _drop_oldest_keyed_push(self):
+        for index, (_, push, key) in enumerate(self.items):
+            if push and key is not None:
+                del self.items[index]
+                outbox_stats.add('queued', -1)
+                outbox_stats.add('dropped')
+                return True
+        return False
+
+    def pop(self):
+        item, _, _ = self.items.popleft()
+        outbox_stats.add('queued', -1)
+        return item
+
+    def discard(self):
+        outbox_stats.add('queued', -len(self.items))
+        outbox_stats.add('queues', -1)
+        self.items.clear()
@@ -0,0 +1,163 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+# Inverted index for search_games over each game's name, author, description
+# and review comments. Every token maps to the games it appears in, with a
+# weight for where it appears; handlers update it as games are uploaded,
+# removed and reviewed, so a search never scans the catalog.
+#
+# Query terms match tokens they are a prefix of (for type-ahead; exact
+# matches score higher), and a game has to match every term. Relevance is
+# the weight of each term's best token times its idf, and the rating
+# (0 - 5) lifts it by up to RATING_WEIGHT.
+#
+# The index lives in memory and is built from storage when the server
+# starts. Handlers update it after the storage write, outside its lock.
+
+FIELD_WEIGHTS = {'name': 4.0, 'author': 2.0, 'description': 1.0}
+REVIEW_WEIGHT = 0.5
+# repeats of a token count this many times at most, per field
+MAX_REPEATS = 3
+PREFIX_MATCH = 0.7
+MIN_PREFIX = 2
+MAX_EXPANSIONS = 100
+RATING_WEIGHT = 0.5
+
+TOKEN = re.compile(r'\w+')
+
+def tokenize(text):
+    return TOKEN.findall((text or '').lower())
+
+class SearchIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # token -> {game_id: weight}, and every token, sorted, for prefixes
+        self.postings = {}
+        self.vocabulary = []
+        # game_id -> token weights from its own fields / token counts over
+        # its reviews; a game's posting weights are the two combined
+        self.fields = {}
+        self.reviews = {}
+        # game_id -> (type, author, rating) for filters and ranking
+        self.meta = {}
+
+    def build(self, games, reviews):
+        with self.lock:
+            self.postings, self.vocabulary, self.fields, self.reviews, self.meta = {}, [], {}, {}, {}
+        for game in games:
+            self.index_game(game)
+        for review in reviews:
+            self.add_review(review['game_id'], review['comment'])
+
+    def index_game(self, game):
+        # (Re)indexes a list_games entry: new games, new versions, ratings.
+        weights = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token, count in Counter(tokenize(game.get(field))).items():
+                weights[token] += weight * min(count, MAX_REPEATS)
+        with self.lock:
+            game_id = game['id']
+            old_tokens = set(self.fields.get(game_id, ()))
+            self.fields[game_id] = weights
+            self.reviews.setdefault(game_id, Counter())
+            self.meta[game_id] = (game.get('type'), game.get('author'), game.get('rating', 0.0))
+            self._update_postings(game_id, old_tokens | set(weights))
+
+    def add_review(self, game_id, comment, rating=None):
+        with self.lock:
+            if game_id not in self.fields:
+                return
+            tokens = Counter(tokenize(comment))
+            self.reviews[game_id].update(tokens)
+            if rating is not None:
+                game_type, author, _ = self.meta[game_id]
+                self.meta[game_id] = (game_type, author, rating)
+            self._update_postings(game_id, tokens)
+
+    def remove_game(self, game_id):
+        with self.lock:
+            if game_id not in self.fields:
+                return
+            tokens = set(self.fields.pop(game_id)) | set(self.reviews.pop(game_id))
+            self.meta.pop(game_id)
+            self._update_postings(game_id, tokens)
+
+    def _update_postings(self, game_id, tokens):
+        fields = self.fields.get(game_id, {})
+        reviews = self.reviews.get(game_id, {})
+        for token in tokens:
+            weight = fields.get(token, 0) + REVIEW_WEIGHT * min(reviews.get(token, 0), MAX_REPEATS)
+            games = self.postings.get(token)
+            if weight:
+                if games is None:
+                    games = self.postings[token] = {}
+                    bisect.insort(self.vocabulary, token)
+                games[game_id] = weight
+            elif games is not None:
+                games.pop(game_id, None)
+                if not games:
+                    del self.postings[token]
+                    del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def _expand(self, term):
+        # the tokens term is a prefix of, itself first
+        if len(term) < MIN_PREFIX:
+            return [term] if term in self.postings else []
+        start = bisect.bisect_left(self.vocabulary, term)
+        tokens = []
+        for token in self.vocabulary[start:start + MAX_EXPANSIONS]:
+            if not token.startswith(term):
+                break
+            tokens.append(token)
+        return tokens
+
+    def _term_scores(self, term):
+        # game_id -> score of its best token for term; the largest posting
+        # list is copied whole and the others merged into it
+        scores = None
+        game_count = len(self.fields) or 1
+        for token in sorted(self._expand(term), key=lambda token: -len(self.postings[token])):
+            games = self.postings[token]
+            factor = math.log(1 + game_count / len(games)) * (1.0 if token == term else PREFIX_MATCH)
+            if scores is None:
+                scores = {game_id: weight * factor for game_id, weight in games.items()}
+                continue
+            for game_id, weight in games.items():
+                score = weight * factor
+                if score > scores.get(game_id, 0):
+                    scores[game_id] = score
+        return scores or {}
+
+    def search(self, query, offset=0, limit=20, game_type=None, author=None, min_rating=None):
+        # (total matching, [(game_id, score)] for the page), best first
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+        with self.lock:
+            relevance = None
+            for term in terms:
+                scores = self._term_scores(term)
+                if relevance is None:
+                    relevance = scores
+                else:
+                    relevance = {game_id: score + scores[game_id]
+                                 for game_id, score in relevance.items() if game_id in scores}
+                if not relevance:
+                    return 0, []
+            meta = self.meta
+            if game_type is None and author is None and min_rating is None:
+                ranked = [(-score * (1 + RATING_WEIGHT * meta[game_id][2] / 5), game_id)
+                          for game_id, score in relevance.items()]
+            else:
+                ranked = [(-score * (1 + RATING_WEIGHT * rating / 5), game_id)
+                          for game_id, score in relevance.items()
+                          for game_type_of, author_of, rating in (meta[game_id],)
+                          if (game_type is None or game_type_of == game_type)
+                          and (author is None or author_of == author)
+                          and (min_rating is None or rating >= min_rating)]
+        page = heapq.nsmallest(offset + limit, ranked)[offset:]
+        return len(ranked), [(game_id, -score) for score, game_id in page]
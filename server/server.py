@@ -1,27 +1,46 @@
+import abc
 import socket
 import threading
+import asyncio
+import argparse
+import multiprocessing
+import concurrent.futures
 import os
-import json
 import sys
 import shutil
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from common.protocol import send_json, recv_json, recv_file, send_file
+from common.protocol import (recv_frame, unpack_message, recv_file, send_file, pack_message, PROTOCOL_VERSION,
+                             async_recv_frame, async_recv_file, async_send_file, file_sha256,
+                             TRANSFER_ENCODINGS)
+from common.codec import CODECS
+from common.delta import make_delta
+from common import protocol
+from storage import create_storage, SORT_ORDERS
+from blobs import BlobStore
+from catalog import CatalogVersion
+from search import SearchIndex
+from dispatch import CommandRegistry, TimedLock, count_bytes_out
+from outbox import OutboundQueue, SlowConsumer, SLOW_CONSUMER_POLICIES, outbox_stats
+from sharding import Router, new_channel, receive_handoff
 
 HOST = '0.0.0.0'
 PORT = 12131
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'server_data')
 GAMES_DIR = os.path.join(DATA_DIR, 'games')
-DB_FILE = os.path.join(DATA_DIR, 'db.json')
 
-database = {
-    "developers": {"admin": "admin"}, 
-    "players": {"p1": "p1", "p2": "p2", "p3": "p3", "p4": "p4"},
-    "games": [], 
-    "reviews": [],
-    "play_history": []
-}
+# Accounts, catalog, reviews and play history; see storage.py. Chosen at
+# startup with --storage.
+storage = None
+# bumped on every catalog change, for conditional list_games; see catalog.py
+catalog_version = CatalogVersion()
+# search_games index, built when storage opens; see search.py
+search_index = SearchIndex()
+
+def open_storage():
+    storage.open()
+    search_index.build(storage.list_games(), storage.all_reviews())
 
 available_plugins = [
     {
@@ -35,50 +54,324 @@ available_plugins = [
 active_rooms = {} 
 active_game_sessions = {} 
 online_users = {}
+# room_id -> sessions that receive room_event pushes (see subscribe_room)
+room_subscribers = {}
 
-server_lock = threading.Lock()
+# ===== locking =====
+# There is no global server lock. Each piece of shared state has its own lock
+# so relays in different rooms, catalog reads and logins never wait on each
+# other. Plain dict get/set/del and list() snapshots are atomic under the GIL,
+# so read-only commands (list_rooms, get_room_info) take no lock at all.
+#
+# Lock order (always acquire top to bottom, never two locks on one level):
+#   1. session_locks[room_id]   one game session in active_game_sessions
+#   2. rooms_lock               room id allocation in active_rooms
+#   3. room_locks[room_id]      one entry of active_rooms and room_subscribers
+#   4. online_users_lock
+#   5. storage internals        table locks / SQLite connection lock
+# All of these are TimedLocks, so time spent waiting on them shows up per
+# command in server_stats.
+class KeyedLocks:
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
 
-def save_database():
-    try:
-        os.makedirs(DATA_DIR, exist_ok=True)
-        with open(DB_FILE, 'w') as file_handle:
-            json.dump(database, file_handle, indent=4)
-        print("[DB] Saved.")
-    except Exception as error:
-        print(f"[DB] Save Error: {error}")
+    def __getitem__(self, key):
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = TimedLock()
+                self._locks[key] = lock
+            return lock
+
+session_locks = KeyedLocks()
+rooms_lock = TimedLock()
+room_locks = KeyedLocks()
+online_users_lock = TimedLock()
+
+# ===== connection sessions =====
+# process_request only talks to a session, so the same command code runs on
+# both the thread-per-connection engine and the asyncio engine.
+#
+# Nothing writes to a socket directly. send() queues a reply, push() queues an
+# event for another player (or an unsolicited one for this player), and each
+# session drains its own OutboundQueue with its own writer, so a relay holding
+# a session lock never waits on a peer's TCP window. See outbox.py for the
+# slow-consumer policies; both are set with command-line flags.
+OUTBOX_LIMIT = 256
+SLOW_CONSUMER_POLICY = 'disconnect'
+
+class ClientSession(abc.ABC):
+    # What a handler sees of a connection, whichever engine serves it:
+    # SocketSession (a thread per client) or StreamSession (asyncio). A
+    # subclass supplies the transport-specific methods below.
+    def __init__(self, address):
+        self.address = address
+        self.username = None
+        self.role = None
+        self.subscriptions = set()
+        # payload encoding for frames to this client, negotiated by hello
+        self.codec = 'json'
+        # set for relay-worker links; allows internal commands
+        self.internal = False
+        # id of the request being handled inline; send() copies it into
+        # replies (see process_request)
+        self.request_id = None
+        self.outbox = OutboundQueue(OUTBOX_LIMIT, SLOW_CONSUMER_POLICY)
+        self.closed = False
+
+    def send(self, message, files=()):
+        # files: send_file argument tuples for transfers that follow the
+        # reply. They are queued with it as one item, so a reply sent from
+        # the request pool can never land between the two.
+        if self.request_id is not None and 'id' not in message:
+            message = dict(message, id=self.request_id)
+        frame = pack_message(message, self.codec)
+        count_bytes_out(len(frame))
+        if files:
+            items = [('frame', frame)] + [self._file_item(*file_args) for file_args in files]
+            return self._enqueue(('group', items), False, None)
+        return self._enqueue(('frame', frame), False, None)
+
+    def push(self, message, coalesce_key=None):
+        frame = pack_message(message, self.codec)
+        count_bytes_out(len(frame))
+        return self._enqueue(('frame', frame), True, coalesce_key)
+
+    def _file_item(self, file_path, encoding=None, precompressed_path=None, offset=0):
+        sent_path = precompressed_path or file_path
+        if os.path.exists(sent_path):
+            count_bytes_out(os.path.getsize(sent_path) - offset)
+        return ('file', (file_path, encoding, precompressed_path, offset))
+
+    @abc.abstractmethod
+    def receive_file(self, save_path, on_complete, encoding=None):
+        # Reads the file transfer that follows the current request into
+        # save_path, then calls on_complete(received).
+        pass
+
+    @abc.abstractmethod
+    def _enqueue(self, item, push, coalesce_key):
+        # Queues an outbox item for this session's writer; safe to call from
+        # any thread.
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        pass
+
+def expand_item(item):
+    # a queued item is a ('frame' | 'file', payload) pair, or a 'group' of
+    # them that has to go out back to back
+    kind, payload = item
+    return payload if kind == 'group' else [item]
+
+class SocketSession(ClientSession):
+    def __init__(self, client_socket, address):
+        super().__init__(address)
+        self.socket = client_socket
+        self.outbox_ready = threading.Condition()
+        threading.Thread(target=self._writer_loop, daemon=True).start()
+
+    def _enqueue(self, item, push, coalesce_key):
+        with self.outbox_ready:
+            if self.closed:
+                return False
+            try:
+                queued = self.outbox.offer(item, push, coalesce_key)
+            except SlowConsumer:
+                print(f"[Outbox] {self.address} is not reading; disconnecting.")
+                self._shutdown()
+                return False
+            self.outbox_ready.notify()
+            return queued
+
+    def _writer_loop(self):
+        while True:
+            with self.outbox_ready:
+                while not self.outbox and not self.closed:
+                    self.outbox_ready.wait()
+                if self.closed:
+                    return
+                item = self.outbox.pop()
+
+            try:
+                for kind, payload in expand_item(item):
+                    if kind == 'frame':
+                        self.socket.sendall(payload)
+                    elif not send_file(self.socket, payload[0], payload[1], precompressed_path=payload[2],
+                                       offset=payload[3]):
+                        raise OSError(f"could not send {payload[0]}")
+            except Exception as error:
+                with self.outbox_ready:
+                    if not self.closed:
+                        print(f"[Protocol] Send Error: {error}")
+                        self._shutdown()
+                return
+
+    def _shutdown(self):
+        # Called with outbox_ready held. Wakes the reader thread, which then
+        # runs the normal disconnect cleanup.
+        if not self.closed:
+            self.closed = True
+            self.outbox.discard()
+            self.outbox_ready.notify()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def receive_file(self, save_path, on_complete, encoding=None):
+        on_complete(recv_file(self.socket, save_path, encoding))
+
+    def close(self):
+        with self.outbox_ready:
+            if not self.closed:
+                self.closed = True
+                self.outbox.discard()
+                self.outbox_ready.notify()
+
+class StreamSession(ClientSession):
+    # Queued frames and file sends are drained by a writer task that waits on
+    # drain(), so the transport buffer stays bounded. Uploads are queued and
+    # awaited by the connection task after the command returns.
+    def __init__(self, reader, writer, address):
+        super().__init__(address)
+        self.reader = reader
+        self.writer = writer
+        self.pending_transfers = []
+        self.outbox_ready = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.writer_task = self.loop.create_task(self._writer_loop())
+
+    def _enqueue(self, item, push, coalesce_key):
+        # Replies of concurrent requests are sent from the request pool;
+        # hand them to the loop thread, where everything else runs, so no
+        # lock is needed.
+        if threading.get_ident() != self.loop_thread:
+            self.loop.call_soon_threadsafe(self._enqueue, item, push, coalesce_key)
+            return True
+        if self.closed:
+            return False
+        try:
+            queued = self.outbox.offer(item, push, coalesce_key)
+        except SlowConsumer:
+            print(f"[Outbox] {self.address} is not reading; disconnecting.")
+            self.close()
+            self.writer.transport.abort()
+            return False
+        self.outbox_ready.set()
+        return queued
 
-def load_database():
-    global database
-    if os.path.exists(DB_FILE):
+    async def _writer_loop(self):
         try:
-            with open(DB_FILE, 'r') as file_handle: 
-                loaded_data = json.load(file_handle)
-                for key in database.keys():
-                    if key in loaded_data:
-                        database[key] = loaded_data[key]
-            print("[DB] Loaded.")
+            while not self.closed:
+                await self.outbox_ready.wait()
+                self.outbox_ready.clear()
+                while self.outbox and not self.closed:
+                    items = expand_item(self.outbox.pop())
+                    for index, (kind, payload) in enumerate(items):
+                        if kind == 'frame':
+                            self.writer.write(payload)
+                            # coalesce consecutive frames into one drain
+                            if index + 1 < len(items) or self.outbox:
+                                continue
+                            await self.writer.drain()
+                        else:
+                            await async_send_file(self.writer, payload[0], payload[1],
+                                                  precompressed_path=payload[2], offset=payload[3])
         except Exception as error:
-            print(f"[DB] Load Error: {error}")
+            if not self.closed:
+                print(f"[Protocol] Send Error: {error}")
+                self.close()
+                self.writer.transport.abort()
+
+    def receive_file(self, save_path, on_complete, encoding=None):
+        self.pending_transfers.append((save_path, on_complete, encoding, self.request_id))
+
+    async def flush(self):
+        while self.pending_transfers:
+            save_path, on_complete, encoding, request_id = self.pending_transfers.pop(0)
+            received = await async_recv_file(self.reader, save_path, encoding)
+            self.request_id = request_id
+            try:
+                on_complete(received)
+            finally:
+                self.request_id = None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.outbox.discard()
+            self.outbox_ready.set()
+
+# ===== room subscriptions =====
+# Waiting-room clients subscribe once instead of polling get_room_info. Every
+# change to a room is pushed to its subscribers as a small room_event while
+# the room lock is held, so subscribers see events in the order they happened.
+def publish_room_event(room_id, event, **fields):
+    # caller holds room_locks[room_id]
+    message = {'type': 'room_event', 'room_id': room_id, 'event': event}
+    message.update(fields)
+    # a newer status makes an older queued one pointless
+    coalesce_key = ('room_status', room_id) if event == 'status' else None
+    for subscriber in room_subscribers.get(room_id, ()):
+        subscriber.push(message, coalesce_key)
+
+def close_room(room_id):
+    # caller holds room_locks[room_id]
+    active_rooms.pop(room_id, None)
+    for subscriber in room_subscribers.pop(room_id, ()):
+        subscriber.push({'type': 'room_event', 'room_id': room_id, 'event': 'closed'})
+        subscriber.subscriptions.discard(room_id)
+
+# Game connections can live in a relay worker (--workers) while rooms live in
+# the lobby worker, so game handlers report status changes through here.
+lobby_link = None
 
-def handle_disconnect(client_socket, username, role):
+def report_room_status(room_id, status):
+    if lobby_link is not None:
+        lobby_link.send({'command': 'room_status', 'room_id': room_id, 'status': status})
+    else:
+        apply_room_status(room_id, status)
+
+def apply_room_status(room_id, status):
+    with room_locks[room_id]:
+        if room_id not in active_rooms:
+            return
+        if status == 'finished':
+            close_room(room_id)
+        else:
+            active_rooms[room_id]['status'] = status
+            publish_room_event(room_id, 'status', status=status)
+
+def handle_disconnect(session):
+    for room_id in list(session.subscriptions):
+        with room_locks[room_id]:
+            subscribers = room_subscribers.get(room_id)
+            if subscribers and session in subscribers:
+                subscribers.remove(session)
+    session.subscriptions.clear()
+
+    username = session.username
+    role = session.role
     if not username:
         return
     
-    with server_lock:
-        print(f"[DISCONNECT] Cleaning up for {username} ({role})")
-        
-        if role:
-            login_key = f"{role}_{username}"
-            if login_key in online_users:
-                if online_users[login_key] == client_socket:
-                    del online_users[login_key]
-        
-        for room_id, players in list(active_game_sessions.items()):
+    print(f"[DISCONNECT] Cleaning up for {username} ({role})")
+    
+    for room_id in list(active_game_sessions.keys()):
+        with session_locks[room_id]:
+            players = active_game_sessions.get(room_id)
+            if players is None:
+                continue
+            
             is_in_session = False
             remaining_players = []
             
             for player in players:
-                if player['socket'] == client_socket:
+                if player['session'] is session:
                     is_in_session = True
                 elif player['username'] == username:
                     is_in_session = True
@@ -89,489 +382,1020 @@ def handle_disconnect(client_socket, username, role):
                 active_game_sessions[room_id] = remaining_players
                 
                 for player in remaining_players:
-                    try:
-                        send_json(player['socket'], {'type': 'opponent_left'})
-                    except:
-                        pass
+                    player['session'].push({'type': 'opponent_left'}, 'opponent_left')
                 
                 if not remaining_players:
                     del active_game_sessions[room_id]
 
-        for room_id, room_info in list(active_rooms.items()):
-            if username in room_info['players']:
+    for room_id in list(active_rooms.keys()):
+        with room_locks[room_id]:
+            room_info = active_rooms.get(room_id)
+            if room_info and username in room_info['players']:
                 room_info['players'].remove(username)
                 
                 if not room_info['players']:
-                    del active_rooms[room_id]
-                elif room_info['host'] == username:
-                    room_info['host'] = room_info['players'][0]
+                    close_room(room_id)
+                else:
+                    publish_room_event(room_id, 'player_left', player=username)
+                    if room_info['host'] == username:
+                        room_info['host'] = room_info['players'][0]
+                        publish_room_event(room_id, 'host', host=room_info['host'])
 
-def handle_client(client_socket, client_address):
-    print(f"[CONN] New connection from {client_address}")
-    current_user = None 
-    current_role = None 
+    if role:
+        login_key = f"{role}_{username}"
+        with online_users_lock:
+            if online_users.get(login_key) is session:
+                del online_users[login_key]
+
+# ===== command handlers =====
+# Each handler returns its reply dict, or None when it has already answered
+# (replies followed by a file transfer) or the command has no reply (game
+# relay commands only push events).
+registry = CommandRegistry()
+command = registry.command
+
+# Requests may carry an 'id'; every reply to such a request carries the same
+# id, so clients can pipeline requests on one connection and match replies
+# as they come. Pushes never have one. Read-only commands with an id run on
+# a small shared pool and may answer after requests that arrived later;
+# everything else still runs in order on the connection's own thread (or
+# the event loop). Requests without an id behave exactly as before.
+REQUEST_WORKERS = 8
+request_pool = concurrent.futures.ThreadPoolExecutor(max_workers=REQUEST_WORKERS)
+
+def process_request(session, request, bytes_in=0):
+    request_id = request.get('id')
+    if request_id is None:
+        registry.dispatch(session, request, bytes_in)
+        return
+
+    name = request.get('command')
+    if name not in registry.handlers:
+        session.send({'status': 'fail', 'msg': f'Unknown command: {name}', 'id': request_id})
+    elif name in registry.concurrent:
+        request_pool.submit(run_detached, session, request, bytes_in, request_id)
+    else:
+        session.request_id = request_id
+        try:
+            registry.dispatch(session, request, bytes_in)
+        finally:
+            session.request_id = None
+
+def run_detached(session, request, bytes_in, request_id):
+    try:
+        registry.dispatch(session, request, bytes_in, respond=lambda reply: session.send(dict(reply, id=request_id)))
+    except Exception as error:
+        print(f"[ERR] {session.address}: {error}")
+        session.send({'status': 'fail', 'msg': 'Server error', 'id': request_id})
+
+def account_table(role):
+    if role == 'dev':
+        return 'developers'
+    return 'players'
+
+@command('hello')
+def handle_hello(session, request):
+    # The answer still goes out in the old codec; everything queued after it
+    # uses the new one. Clients read it as a {'type': 'codec'} frame.
+    offered = request.get('codecs', [])
+    codec = next((name for name in offered if name in CODECS), 'json')
+    session.send({'type': 'codec', 'codec': codec, 'version': PROTOCOL_VERSION})
+    session.codec = codec
+
+@command('login')
+def handle_login(session, request):
+    username = request['username']
+    password = request['password']
+    role = request['role']
+
+    table_name = account_table(role)
+    login_key = f"{role}_{username}"
     
+    with online_users_lock:
+        if login_key in online_users:
+            return {'status': 'fail', 'msg': 'Account already logged in.'}
+
+        if role == 'dev':
+            storage.add_account('developers', username, password)
+
+        password_ok = storage.get_password(table_name, username) == password
+        
+        if password_ok:
+            session.username = username
+            session.role = role
+            online_users[login_key] = session
+
+    if password_ok:
+        return {'status': 'success', 'msg': 'Login successful'}
+    return {'status': 'fail', 'msg': 'Invalid credentials'}
+
+@command('register')
+def handle_register(session, request):
+    username = request['username']
+    password = request['password']
+    table_name = account_table(request['role'])
+
+    if storage.add_account(table_name, username, password):
+        return {'status': 'success', 'msg': 'Registration successful'}
+    return {'status': 'fail', 'msg': 'Username already exists'}
+
+@command('game_join')
+def handle_game_join(session, request):
+    username = request['username']
+    room_id = int(request['room_id'])
+
+    with session_locks[room_id]:
+        if room_id not in active_game_sessions:
+            active_game_sessions[room_id] = []
+
+        filtered_players = []
+        current_players = active_game_sessions[room_id]
+        for player in current_players:
+            if player['username'] != username:
+                filtered_players.append(player)
+
+        active_game_sessions[room_id] = filtered_players
+
+        active_game_sessions[room_id].append({
+            'session': session,
+            'username': username
+        })
+
+        player_count = len(active_game_sessions[room_id])
+
+        if player_count == 2:
+            player1 = active_game_sessions[room_id][0]
+            player2 = active_game_sessions[room_id][1]
+            player1['session'].push({'type': 'game_start', 'symbol': 'X', 'opponent': player2['username'], 'turn': True}, 'game_start')
+            player2['session'].push({'type': 'game_start', 'symbol': 'O', 'opponent': player1['username'], 'turn': False}, 'game_start')
+
+        elif player_count > 2:
+            session.push({'type': 'game_start', 'symbol': f'P{player_count}', 'opponent': 'Others', 'turn': False}, 'game_start')
+
+@command('game_move')
+def handle_game_move(session, request):
+    room_id = int(request['room_id'])
+    move_data = request['index']
+    move_symbol = request['symbol']
+
+    with session_locks[room_id]:
+        if room_id in active_game_sessions:
+            for player in active_game_sessions[room_id]:
+                if player['session'] is not session:
+                    # every move matters, so moves are never coalesced
+                    player['session'].push({
+                        'type': 'opponent_move', 
+                        'index': move_data, 
+                        'symbol': move_symbol
+                    })
+
+            if move_symbol == 'WIN':
+                print(f"[Game] Room {room_id} finished. Removing session.")
+                del active_game_sessions[room_id]
+                report_room_status(room_id, 'finished')
+
+@command('game_over')
+def handle_game_over(session, request):
+    report_room_status(int(request['room_id']), 'waiting')
+
+@command('game_restart')
+def handle_game_restart(session, request):
+    room_id = int(request['room_id'])
+    with session_locks[room_id]:
+        if room_id in active_game_sessions:
+            if len(active_game_sessions[room_id]) == 2:
+                active_game_sessions[room_id].reverse()
+                player1 = active_game_sessions[room_id][0]
+                player2 = active_game_sessions[room_id][1]
+                player1['session'].push({'type': 'game_start', 'symbol': 'X', 'opponent': player2['username'], 'turn': True}, 'game_start')
+                player2['session'].push({'type': 'game_start', 'symbol': 'O', 'opponent': player1['username'], 'turn': False}, 'game_start')
+
+                report_room_status(room_id, 'playing')
+            else:
+                session.push({'type': 'opponent_left'}, 'opponent_left')
+
+# Game files by content; see blobs.py.
+blob_store = BlobStore(os.path.join(DATA_DIR, 'blobs'))
+
+def game_blob(game):
+    # sha256 of the game's current file, or None if it has none. Games
+    # published before the blob store are added on first use.
+    digest = game.get('sha256')
+    if digest and os.path.exists(blob_store.path(digest)):
+        return digest
+    file_path = os.path.join(GAMES_DIR, str(game['id']), 'game.py')
+    if not os.path.exists(file_path):
+        return None
+    digest = blob_store.add(file_path)
+    storage.set_game_blob(game['id'], digest)
+    return digest
+
+# Hashing a finished upload and building a blob's zlib copy read the whole
+# file, so they run on a background thread of their own, never in a request
+# handler (and so never on the asyncio engine's event loop). Until a blob's
+# copy is ready, downloads compress on the fly.
+blob_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+compressing = set()
+compressing_lock = threading.Lock()
+
+def compress_later(digest):
+    with compressing_lock:
+        if digest in compressing:
+            return
+        compressing.add(digest)
+
+    def compress():
+        try:
+            blob_store.compressed(digest)
+        except Exception as error:
+            print(f"[Blobs] compress {digest}: {error}")
+        finally:
+            with compressing_lock:
+                compressing.discard(digest)
+
+    blob_pool.submit(compress)
+
+# path -> (mtime_ns, size, sha256), so downloads do not rehash unchanged
+# files
+file_digests = {}
+
+def file_digest(file_path):
+    stat = os.stat(file_path)
+    cached = file_digests.get(file_path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    digest = file_sha256(file_path)
+    file_digests[file_path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+# ===== game versions =====
+# games/<id>/versions/<v>.py links the last KEEP_VERSIONS uploads of a game,
+# and versions/<v>.delta rebuilds version v + 1 from version v (see
+# common/delta.py). Deltas are built on a single background thread of their
+# own once an upload is in, so diffing never holds up the request pool;
+# until then, and for anyone whose copy is not a kept version, a download
+# sends the whole file.
+KEEP_VERSIONS = 10
+delta_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def version_path(game_path, version, suffix='.py'):
+    return os.path.join(game_path, 'versions', f'{version}{suffix}')
+
+def archive_version(game_path, version, digest):
+    os.makedirs(os.path.join(game_path, 'versions'), exist_ok=True)
+    archived_path = version_path(game_path, version)
+    blob_store.link(digest, archived_path)
+    # the hash is known here; delta_chain() need not read the file for it
+    stat = os.stat(archived_path)
+    file_digests[archived_path] = (stat.st_mtime_ns, stat.st_size, digest)
+
+def build_delta(game_path, version):
+    try:
+        with open(version_path(game_path, version - 1), 'rb') as file_handle:
+            old_data = file_handle.read()
+        with open(version_path(game_path, version), 'rb') as file_handle:
+            new_data = file_handle.read()
+        delta_path = version_path(game_path, version - 1, '.delta')
+        with open(delta_path + '.tmp', 'wb') as file_handle:
+            file_handle.write(make_delta(old_data, new_data))
+        os.replace(delta_path + '.tmp', delta_path)
+    except FileNotFoundError:
+        pass
+    except Exception as error:
+        print(f"[Delta] {game_path} v{version}: {error}")
+
+    for name in os.listdir(os.path.join(game_path, 'versions')):
+        kept_version = name.split('.')[0]
+        if kept_version.isdigit() and int(kept_version) <= version - KEEP_VERSIONS:
+            os.remove(os.path.join(game_path, 'versions', name))
+
+def delta_chain(game_path, compressed_path, have_version, have_sha256, version):
+    # Deltas from the client's version up to the current one, or None when
+    # the client's copy is not exactly a kept version, a link is missing or
+    # the chain is no smaller than the compressed file (or the raw one, as
+    # long as the compressed copy is not built yet).
+    if type(have_version) is not int or not 0 < have_version < version:
+        return None
+    base_path = version_path(game_path, have_version)
+    if not os.path.exists(base_path) or file_digest(base_path) != have_sha256:
+        return None
+    chain = [version_path(game_path, step, '.delta') for step in range(have_version, version)]
+    if not all(os.path.exists(delta_path) for delta_path in chain):
+        return None
+    if sum(os.path.getsize(delta_path) for delta_path in chain) >= os.path.getsize(compressed_path):
+        return None
+    return chain
+
+@command('upload_game')
+def handle_upload_game(session, request):
+    metadata = request['meta']
+
+    game, error = storage.publish_game(session.username, metadata['name'], metadata['description'], metadata['type'])
+    if error:
+        return {'status': 'fail', 'msg': error}
+    game_id = game['id']
+    catalog_version.bump(game_id, published=True)
+    search_index.index_game(storage.list_games([game_id])[0])
+
+    # The client may offer a compressed upload; old clients send it raw.
+    encoding = request.get('encoding') if request.get('encoding') in TRANSFER_ENCODINGS else None
+    reply = {'status': 'ready'}
+    if encoding:
+        reply['encoding'] = encoding
+    session.send(reply)
+
+    game_path = os.path.join(GAMES_DIR, str(game_id))
+    os.makedirs(game_path, exist_ok=True)
+    # The upload goes to a file of its own: game.py is a link into the blob
+    # store and must never be written in place.
+    upload_path = os.path.join(game_path, 'upload.part')
+    version = game['version']
+    # games uploaded before versions were kept: the current file is the
+    # previous version
+    if version > 1 and not os.path.exists(version_path(game_path, version - 1)):
+        previous_digest = game_blob(game)
+        if previous_digest:
+            archive_version(game_path, version - 1, previous_digest)
+
+    def finish_upload():
+        try:
+            digest = blob_store.add(upload_path)
+            os.remove(upload_path)
+            blob_store.link(digest, os.path.join(game_path, 'game.py'))
+            archive_version(game_path, version, digest)
+            storage.set_game_blob(game_id, digest)
+            catalog_version.bump(game_id)
+        except Exception as error:
+            print(f"[Upload] game {game_id}: {error}")
+            session.send({'status': 'fail', 'msg': 'Upload could not be stored'})
+            return
+        compress_later(digest)
+        delta_pool.submit(build_delta, game_path, version)
+        session.send({'status': 'success', 'msg': 'Upload complete'})
+
+    def on_upload_complete(received):
+        if received:
+            blob_pool.submit(finish_upload)
+
+    session.receive_file(upload_path, on_upload_complete, encoding)
+
+@command('my_games', concurrent=True)
+def handle_my_games(session, request):
+    return {'status': 'success', 'data': storage.games_by_author(session.username)}
+
+@command('remove_game')
+def handle_remove_game(session, request):
+    game_id = request['game_id']
+
+    if storage.remove_game(game_id, session.username):
+        catalog_version.bump(game_id, removed=True)
+        search_index.remove_game(game_id)
+        shutil.rmtree(os.path.join(GAMES_DIR, str(game_id)), ignore_errors=True)
+        return {'status': 'success', 'msg': 'Deleted'}
+    return {'status': 'fail', 'msg': 'Error'}
+
+MAX_REVIEW_PAGE = 20
+
+@command('get_game_details', concurrent=True)
+def handle_get_game_details(session, request):
+    game_id = request['game_id']
+
+    # Reviews come a page at a time, counted back from the newest:
+    # 'review_offset' skips that many of the newest, 'review_limit' (at most
+    # MAX_REVIEW_PAGE, 0 for the game alone) caps the page. A page lists its
+    # reviews oldest first, as the whole list used to be; 'reviews_total'
+    # tells whether there are older ones to fetch.
+    try:
+        offset = max(0, int(request.get('review_offset', 0)))
+        limit = min(MAX_REVIEW_PAGE, max(0, int(request.get('review_limit', MAX_REVIEW_PAGE))))
+    except (TypeError, ValueError):
+        return {'status': 'fail', 'msg': 'Bad page request'}
+
+    target_game = storage.get_game(game_id)
+    if not target_game:
+        return {'status': 'fail'}
+
+    total, reviews = storage.reviews_page(game_id, offset, limit)
+    return {'status': 'success', 'game': target_game, 'reviews': reviews, 'reviews_total': total,
+            'review_offset': offset, 'rating_summary': storage.get_rating_summary(game_id)}
+
+# list_games pages: 'sort' is one of SORT_ORDERS, 'filters' may hold
+# 'type', 'author' and 'min_rating'; a page holds at most MAX_PAGE games.
+PAGE_KEYS = ('offset', 'limit', 'sort', 'filters')
+MAX_PAGE = 100
+
+def list_games_page(request, reply, changes):
+    # The page comes from the storage's pre-sorted indexes, so it costs
+    # about its own size however large the catalog is. A page request with
+    # an up-to-date catalog version gets 'not_modified' and no page.
+    sort = request.get('sort', 'newest')
+    filters = request.get('filters') or {}
+    try:
+        offset = max(0, int(request.get('offset', 0)))
+        limit = min(MAX_PAGE, max(1, int(request.get('limit', MAX_PAGE))))
+        min_rating = filters.get('min_rating')
+        min_rating = float(min_rating) if min_rating is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return {'status': 'fail', 'msg': 'Bad page request'}
+    if sort not in SORT_ORDERS:
+        return {'status': 'fail', 'msg': f'Unknown sort: {sort}'}
+    if changes is not None and not changes[0] and not changes[1]:
+        reply['status'] = 'not_modified'
+        return reply
+
+    total, page = storage.query_games(sort, offset, limit, game_type=filters.get('type'),
+                                      author=filters.get('author'), min_rating=min_rating)
+    reply.update({'total': total, 'offset': offset, 'data': page})
+    return reply
+
+@command('list_games', concurrent=True)
+def handle_list_games(session, request):
+    # A client that sends the catalog_epoch / catalog_version of its cached
+    # list gets 'not_modified', or only the 'changed' entries and the ids
+    # 'removed' since; anyone else gets the whole list in 'data'. With any of
+    # PAGE_KEYS it asks for one sorted, filtered page instead.
+    epoch, version = catalog_version.current()
+    reply = {'status': 'success', 'catalog_epoch': epoch, 'catalog_version': version}
+    changes = None
+    if 'catalog_version' in request:
+        changes = catalog_version.changes_since(request.get('catalog_epoch'), request['catalog_version'])
+    if any(key in request for key in PAGE_KEYS):
+        return list_games_page(request, reply, changes)
+    if changes is None:
+        reply['data'] = storage.list_games()
+        return reply
+
+    changed, removed = changes
+    if not changed and not removed:
+        reply['status'] = 'not_modified'
+        return reply
+    reply['changed'] = storage.list_games(changed)
+    reply['removed'] = removed
+    return reply
+
+# check_updates: the client's whole library in one request
+@command('check_updates', concurrent=True)
+def handle_check_updates(session, request):
+    # 'installed' lists {'id', 'sha256', 'version'} for each game the client
+    # has (both None when its first download never finished). The reply
+    # names the games that need a download, as list_games entries with the
+    # 'size' of their file, and the ids of games that are gone. With
+    # 'missing' set it also lists, under 'missing', every game the client
+    # does not have yet.
+    try:
+        installed = {int(entry['id']): entry for entry in request.get('installed', [])}
+    except (TypeError, ValueError, KeyError):
+        return {'status': 'fail', 'msg': 'Bad library'}
+
+    games = {game['id']: game for game in storage.list_games(list(installed))}
+    updates = []
+    for game_id, entry in installed.items():
+        game = games.get(game_id)
+        if not game:
+            continue
+        # (a game without a file has nothing to download)
+        digest = game_blob(game)
+        if not digest or (entry.get('version') is not None and entry.get('sha256') == digest):
+            continue
+        updates.append(dict(game, size=os.path.getsize(blob_store.path(digest))))
+    removed = [game_id for game_id in installed if game_id not in games]
+    reply = {'status': 'success', 'updates': updates, 'removed': removed}
+    if request.get('missing'):
+        reply['missing'] = []
+        for game in storage.list_games():
+            digest = game_blob(game) if game['id'] not in installed else None
+            if digest:
+                reply['missing'].append(dict(game, size=os.path.getsize(blob_store.path(digest))))
+    return reply
+
+# search_games: 'query' text, plus 'offset' / 'limit' and the 'filters' of a
+# list_games page; entries come best match first.
+@command('search_games', concurrent=True)
+def handle_search_games(session, request):
+    filters = request.get('filters') or {}
+    try:
+        query = str(request.get('query', ''))
+        offset = max(0, int(request.get('offset', 0)))
+        limit = min(MAX_PAGE, max(1, int(request.get('limit', 20))))
+        min_rating = filters.get('min_rating')
+        min_rating = float(min_rating) if min_rating is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return {'status': 'fail', 'msg': 'Bad search request'}
+
+    total, hits = search_index.search(query, offset, limit, game_type=filters.get('type'),
+                                      author=filters.get('author'), min_rating=min_rating)
+    games = {game['id']: game for game in storage.list_games([game_id for game_id, _ in hits])}
+    # a game removed since the search is left out
+    page = [dict(games[game_id], score=round(score, 3)) for game_id, score in hits if game_id in games]
+    return {'status': 'success', 'query': query, 'total': total, 'offset': offset, 'data': page}
+
+@command('download_game')
+def handle_download_game(session, request):
+    game_id = request['game_id']
+
+    target_game = storage.get_game(game_id)
+    digest = game_blob(target_game) if target_game else None
+
+    if not digest:
+        return {'status': 'fail', 'msg': 'File not found'}
+
+    # A client whose installed file already has this hash ('if_none_match')
+    # only learns the current version; no file follows.
+    if request.get('if_none_match') == digest:
+        return {'status': 'not_modified', 'version': target_game['version'], 'sha256': digest}
+
+    # The reply names the full size and SHA-256 so the client can verify what
+    # it got. A client holding the first 'offset' bytes of the file with hash
+    # 'if_range' gets only the rest; if the file has changed since, it gets
+    # the whole file again (reply offset 0). An offset that is not a
+    # position in the file is refused.
+    file_path = blob_store.path(digest)
+    file_size = os.path.getsize(file_path)
     try:
+        offset = int(request.get('offset') or 0)
+    except (TypeError, ValueError):
+        return {'status': 'fail', 'msg': 'Bad offset'}
+    if request.get('if_range') != digest:
+        offset = 0
+    elif not 0 <= offset <= file_size:
+        return {'status': 'fail', 'msg': 'Bad offset'}
+    reply = {'status': 'success', 'version': target_game['version'], 'size': file_size, 'sha256': digest,
+             'offset': offset}
+
+    # A client that names the version (and hash) it has installed gets the
+    # deltas from there instead, as one raw transfer per step; their sizes
+    # are listed in 'patches'.
+    compressed_path = blob_store.compressed_if_ready(digest)
+    if not compressed_path:
+        compress_later(digest)
+    chain = None
+    if not offset:
+        chain = delta_chain(os.path.join(GAMES_DIR, str(game_id)), compressed_path or file_path,
+                            request.get('have_version'), request.get('have_sha256'), target_game['version'])
+    if chain:
+        reply['from_version'] = request['have_version']
+        reply['patches'] = [os.path.getsize(delta_path) for delta_path in chain]
+        session.send(reply, files=[(delta_path,) for delta_path in chain])
+        return
+
+    # Clients that accept zlib get the blob's copy compressed after upload,
+    # so a download costs no compression work; everyone else gets the raw
+    # file. The rest of a resumed download, and any download before that
+    # copy is built, is compressed on the fly.
+    accepted = request.get('accept_encoding') or []
+    if 'zlib' in accepted:
+        reply['encoding'] = 'zlib'
+        session.send(reply, files=[(file_path, 'zlib', None if offset else compressed_path, offset)])
+    else:
+        session.send(reply, files=[(file_path, None, None, offset)])
+
+@command('create_room')
+def handle_create_room(session, request):
+    game_id = request['game_id']
+
+    game = storage.get_game(game_id)
+    if not game:
+        return {'status': 'fail', 'msg': 'Game not found'}
+
+    with rooms_lock:
+        room_id = len(active_rooms) + 1
         while True:
-            request = recv_json(client_socket)
-            if not request:
+            if room_id in active_rooms:
+                room_id += 1
+            else:
                 break
-            
-            command = request.get('command')
 
-            if command == 'login':
-                username = request['username']
-                password = request['password']
-                role = request['role']
-                
-                with server_lock:
-                    login_key = f"{role}_{username}"
-                    if login_key in online_users:
-                         send_json(client_socket, {'status': 'fail', 'msg': 'Account already logged in.'})
-                         continue
-
-                    if role == 'dev':
-                        table_name = 'developers'
-                    else:
-                        table_name = 'players'
-                    
-                    if role == 'dev':
-                        if username not in database['developers']: 
-                            database['developers'][username] = password
-                            save_database()
-                    
-                    if username in database[table_name]:
-                        if database[table_name][username] == password:
-                            current_user = username
-                            current_role = role
-                            online_users[login_key] = client_socket
-                            send_json(client_socket, {'status': 'success', 'msg': 'Login successful'})
-                        else:
-                            send_json(client_socket, {'status': 'fail', 'msg': 'Invalid credentials'})
-                    else:
-                        send_json(client_socket, {'status': 'fail', 'msg': 'Invalid credentials'})
-
-            elif command == 'register':
-                username = request['username']
-                password = request['password']
-                role = request['role']
-                
-                with server_lock:
-                    if role == 'dev':
-                        table_name = 'developers'
-                    else:
-                        table_name = 'players'
-
-                    if username in database[table_name]:
-                        send_json(client_socket, {'status': 'fail', 'msg': 'Username already exists'})
-                    else:
-                        database[table_name][username] = password
-                        save_database()
-                        send_json(client_socket, {'status': 'success', 'msg': 'Registration successful'})
-
-            elif command == 'game_join':
-                username = request['username']
-                room_id = int(request['room_id'])
-                
-                with server_lock:
-                    if room_id not in active_game_sessions:
-                        active_game_sessions[room_id] = []
-                    
-                    filtered_players = []
-                    current_players = active_game_sessions[room_id]
-                    for player in current_players:
-                        if player['username'] != username:
-                            filtered_players.append(player)
-                    
-                    active_game_sessions[room_id] = filtered_players
-                    
-                    active_game_sessions[room_id].append({
-                        'socket': client_socket,
-                        'username': username
-                    })
-                    
-                    player_count = len(active_game_sessions[room_id])
-                    
-                    if player_count == 2:
-                        player1 = active_game_sessions[room_id][0]
-                        player2 = active_game_sessions[room_id][1]
-                        try:
-                            send_json(player1['socket'], {'type': 'game_start', 'symbol': 'X', 'opponent': player2['username'], 'turn': True})
-                            send_json(player2['socket'], {'type': 'game_start', 'symbol': 'O', 'opponent': player1['username'], 'turn': False})
-                        except:
-                            pass
-                    
-                    elif player_count > 2:
-                        try:
-                            send_json(client_socket, {'type': 'game_start', 'symbol': f'P{player_count}', 'opponent': 'Others', 'turn': False})
-                        except:
-                            pass
-
-            elif command == 'game_move':
-                room_id = int(request['room_id'])
-                move_data = request['index']
-                move_symbol = request['symbol']
-                
-                with server_lock:
-                    if room_id in active_game_sessions:
-                        for player in active_game_sessions[room_id]:
-                            if player['socket'] != client_socket:
-                                try:
-                                    send_json(player['socket'], {
-                                        'type': 'opponent_move', 
-                                        'index': move_data, 
-                                        'symbol': move_symbol
-                                    })
-                                except:
-                                    pass
-                        
-                        if move_symbol == 'WIN':
-                            print(f"[Game] Room {room_id} finished. Removing session.")
-                            del active_game_sessions[room_id]
-                            if room_id in active_rooms:
-                                del active_rooms[room_id]
-
-
-            elif command == 'game_over':
-                room_id = int(request['room_id'])
-                with server_lock:
-                    if room_id in active_rooms:
-                        active_rooms[room_id]['status'] = 'waiting'
-            
-            elif command == 'game_restart':
-                room_id = int(request['room_id'])
-                with server_lock:
-                    if room_id in active_game_sessions:
-                        if len(active_game_sessions[room_id]) == 2:
-                            active_game_sessions[room_id].reverse()
-                            player1 = active_game_sessions[room_id][0]
-                            player2 = active_game_sessions[room_id][1]
-                            try:
-                                send_json(player1['socket'], {'type': 'game_start', 'symbol': 'X', 'opponent': player2['username'], 'turn': True})
-                                send_json(player2['socket'], {'type': 'game_start', 'symbol': 'O', 'opponent': player1['username'], 'turn': False})
-                                
-                                if room_id in active_rooms:
-                                    active_rooms[room_id]['status'] = 'playing'
-                            except:
-                                pass
-                        else:
-                            send_json(client_socket, {'type': 'opponent_left'})
+        with room_locks[room_id]:
+            active_rooms[room_id] = {
+                "id": room_id,
+                "game_id": game_id,
+                "game_name": game['name'],
+                "host": session.username,
+                "players": [session.username],
+                "status": "waiting",
+                "chat_history": []  # Plugin
+            }
+    return {'status': 'success', 'room_id': room_id}
 
-            elif command == 'upload_game':
-                metadata = request['meta']
-                game_id = -1
-                
-                with server_lock:
-                    existing_game = None
-                    for game in database['games']:
-                        if game['name'] == metadata['name']:
-                            existing_game = game
-                            break
-                    
-                    if existing_game:
-                        if existing_game['author'] != current_user:
-                            send_json(client_socket, {'status': 'fail', 'msg': 'Permission denied'})
-                            continue
-                        existing_game['version'] += 1
-                        existing_game['description'] = metadata['description']
-                        existing_game['type'] = metadata['type']
-                        game_id = existing_game['id']
-                    else:
-                        game_id = len(database['games']) + 1
-                        while True:
-                            id_exists = False
-                            for game in database['games']:
-                                if game['id'] == game_id:
-                                    id_exists = True
-                                    break
-                            if id_exists:
-                                game_id += 1
-                            else:
-                                break
-                        
-                        new_game = {
-                            "id": game_id,
-                            "name": metadata['name'],
-                            "version": 1,
-                            "author": current_user,
-                            "description": metadata['description'],
-                            "type": metadata['type']
-                        }
-                        database['games'].append(new_game)
-                    
-                    save_database()
-                
-                send_json(client_socket, {'status': 'ready'})
-                
-                game_path = os.path.join(GAMES_DIR, str(game_id))
-                os.makedirs(game_path, exist_ok=True)
-                
-                if recv_file(client_socket, os.path.join(game_path, 'game.py')):
-                    send_json(client_socket, {'status': 'success', 'msg': 'Upload complete'})
-
-            elif command == 'my_games':
-                user_games = []
-                for game in database['games']:
-                    if game['author'] == current_user:
-                        user_games.append(game)
-                send_json(client_socket, {'status': 'success', 'data': user_games})
-
-            elif command == 'remove_game':
-                game_id = request['game_id']
-                
-                with server_lock:
-                    has_permission = False
-                    for game in database['games']:
-                        if game['id'] == game_id:
-                            if game['author'] == current_user:
-                                has_permission = True
-                            break
-                    
-                    if has_permission:
-                        games_to_keep = []
-                        for game in database['games']:
-                            if game['id'] != game_id:
-                                games_to_keep.append(game)
-                        
-                        database['games'] = games_to_keep
-                        save_database()
-                        
-                        shutil.rmtree(os.path.join(GAMES_DIR, str(game_id)), ignore_errors=True)
-                        send_json(client_socket, {'status': 'success', 'msg': 'Deleted'})
-                    else:
-                        send_json(client_socket, {'status': 'fail', 'msg': 'Error'})
-            
-            elif command == 'get_game_details':
-                game_id = request['game_id']
-                
-                target_game = None
-                for game in database['games']:
-                    if game['id'] == game_id:
-                        target_game = game
-                        break 
-
-                game_reviews = []
-                for review in database['reviews']:
-                    if review['game_id'] == game_id:
-                        game_reviews.append(review)
-                
-                if target_game:
-                    send_json(client_socket, {'status': 'success', 'game': target_game, 'reviews': game_reviews})
-                else:
-                    send_json(client_socket, {'status': 'fail'})
-
-            elif command == 'list_games':
-                game_list = []
-                with server_lock:
-                    for game in database['games']:
-                        game_info = game.copy()
-                        
-                        ratings = []
-                        for review in database['reviews']:
-                            if review['game_id'] == game['id']:
-                                ratings.append(review['rating'])
-                        
-                        if ratings:
-                            game_info['rating'] = round(sum(ratings) / len(ratings), 1)
-                        else:
-                            game_info['rating'] = 0.0
-                        
-                        game_list.append(game_info)
-                
-                send_json(client_socket, {'status': 'success', 'data': game_list})
+@command('list_rooms', concurrent=True)
+def handle_list_rooms(session, request):
+    return {'status': 'success', 'data': list(active_rooms.values())}
 
-            elif command == 'download_game':
-                game_id = request['game_id']
-                
-                target_game = None
-                for game in database['games']:
-                    if game['id'] == game_id:
-                        target_game = game
-                        break
-                
-                file_path = os.path.join(GAMES_DIR, str(game_id), 'game.py')
-                
-                if target_game and os.path.exists(file_path):
-                    send_json(client_socket, {'status': 'success', 'version': target_game['version']})
-                    send_file(client_socket, file_path)
-                else:
-                    send_json(client_socket, {'status': 'fail', 'msg': 'File not found'})
+@command('join_room')
+def handle_join_room(session, request):
+    room_id = int(request['room_id'])
 
-            elif command == 'create_room':
-                game_id = request['game_id']
-                
-                with server_lock:
-                    game_found = False
-                    game_name = "Unknown"
-                    for game in database['games']:
-                        if game['id'] == game_id:
-                            game_found = True
-                            game_name = game['name']
-                            break  
-                    
-                    if not game_found:
-                        send_json(client_socket, {'status': 'fail', 'msg': 'Game not found'})
-                        continue
-                    
-                    room_id = len(active_rooms) + 1
-                    while True:
-                        if room_id in active_rooms:
-                            room_id += 1
-                        else:
-                            break
-                    
-                    active_rooms[room_id] = {
-                        "id": room_id,
-                        "game_id": game_id,
-                        "game_name": game_name,
-                        "host": current_user,
-                        "players": [current_user],
-                        "status": "waiting",
-                        "chat_history": []  # Plugin
-                    }
-                    send_json(client_socket, {'status': 'success', 'room_id': room_id})
-
-            elif command == 'list_rooms':
-                send_json(client_socket, {'status': 'success', 'data': list(active_rooms.values())})
-
-            elif command == 'join_room':
-                room_id = int(request['room_id'])
-                
-                with server_lock:
-                    if room_id in active_rooms and active_rooms[room_id]['status'] == 'waiting':
-                        if current_user not in active_rooms[room_id]['players']:
-                            active_rooms[room_id]['players'].append(current_user)
-                        send_json(client_socket, {'status': 'success', 'game_id': active_rooms[room_id]['game_id']})
-                    else:
-                        send_json(client_socket, {'status': 'fail', 'msg': 'Full'})
-
-            elif command == 'leave_room':
-                room_id = int(request['room_id'])
-                with server_lock:
-                    if room_id in active_rooms:
-                        room = active_rooms[room_id]
-                
-                        if current_user in room['players']:
-                            room['players'].remove(current_user)
-                        
-                        if current_user == room['host']:
-                            # if host leave delete room
-                            del active_rooms[room_id]
-                            send_json(client_socket, {'status': 'success'})
-                        
-                        elif len(room['players']) == 0:
-                            # no player 
-                            del active_rooms[room_id]
-                            send_json(client_socket, {'status': 'success'})
-                        
-                        else:
-                            send_json(client_socket, {'status': 'success'})
-                    else:
-                        send_json(client_socket, {'status': 'fail', 'msg': 'Room not found'})
-            
-            elif command == 'get_room_info':
-                room_id = int(request['room_id'])
-                if room_id in active_rooms:
-                    send_json(client_socket, {'status': 'success', 'data': active_rooms[room_id]})
-                else:
-                    send_json(client_socket, {'status': 'fail'})
+    with room_locks[room_id]:
+        if room_id in active_rooms and active_rooms[room_id]['status'] == 'waiting':
+            if session.username not in active_rooms[room_id]['players']:
+                active_rooms[room_id]['players'].append(session.username)
+                publish_room_event(room_id, 'player_joined', player=session.username)
+            return {'status': 'success', 'game_id': active_rooms[room_id]['game_id']}
+    return {'status': 'fail', 'msg': 'Full'}
 
-            elif command == 'start_game':
-                room_id = int(request['room_id'])
-                
-                with server_lock:
-                    if room_id in active_rooms and active_rooms[room_id]['host'] == current_user:
-                        active_rooms[room_id]['status'] = 'playing'
-                        
-                        game_id = active_rooms[room_id]['game_id']
-                        for player_name in active_rooms[room_id]['players']:
-                            already_recorded = False
-                            for history in database['play_history']:
-                                if history['user'] == player_name and history['game_id'] == game_id:
-                                    already_recorded = True
-                                    break
-                            
-                            if not already_recorded:
-                                database['play_history'].append({"user": player_name, "game_id": game_id})
-                        
-                        save_database()
-                        send_json(client_socket, {'status': 'success'})
-                    else:
-                        send_json(client_socket, {'status': 'fail'})
-            
-            elif command == 'submit_review':
-                game_id = request['game_id']
-                rating = request['rating']
-                comment = request['comment']
-                
-                with server_lock:
-                    has_played = False
-                    for history in database['play_history']:
-                        if history['user'] == current_user and history['game_id'] == game_id:
-                            has_played = True
-                            break
-                    
-                    if not has_played:
-                        send_json(client_socket, {'status': 'fail', 'msg': 'You must play the game before reviewing it!'})
-                        continue
-
-                    already_reviewed = False
-                    for review in database['reviews']:
-                        if review['user'] == current_user and review['game_id'] == game_id:
-                            already_reviewed = True
-                            break
-                    
-                    if already_reviewed:
-                        send_json(client_socket, {'status': 'fail', 'msg': 'You have already reviewed this game.'})
-                        continue
-
-                    database['reviews'].append({
-                        "game_id": game_id,
-                        "user": current_user,
-                        "rating": rating,
-                        "comment": comment
-                    })
-                    save_database()
-                    send_json(client_socket, {'status': 'success'})
+@command('leave_room')
+def handle_leave_room(session, request):
+    room_id = int(request['room_id'])
+    with room_locks[room_id]:
+        if room_id not in active_rooms:
+            return {'status': 'fail', 'msg': 'Room not found'}
 
-            elif command == 'list_plugins':
-                send_json(client_socket, {'status': 'success', 'data': available_plugins})
+        room = active_rooms[room_id]
+        if session.username in room['players']:
+            room['players'].remove(session.username)
 
-            # PL3 : chat handle
-            elif command == 'send_chat':
-                room_id = int(request['room_id'])
-                msg = request['msg']
-                
-                with server_lock:
-                    if room_id in active_rooms:
-                        
-                        chat_entry = f"{current_user}: {msg}"
-                        active_rooms[room_id]['chat_history'].append(chat_entry)
-                        # max len = 50
-                        if len(active_rooms[room_id]['chat_history']) > 50:
-                            active_rooms[room_id]['chat_history'].pop(0)
-                        send_json(client_socket, {'status': 'success'})
-                    else:
-                        send_json(client_socket, {'status': 'fail'})
+        if session.username == room['host']:
+            # if host leave delete room
+            close_room(room_id)
+        elif len(room['players']) == 0:
+            # no player 
+            close_room(room_id)
+        else:
+            publish_room_event(room_id, 'player_left', player=session.username)
+    return {'status': 'success'}
+
+@command('get_room_info', concurrent=True)
+def handle_get_room_info(session, request):
+    room = active_rooms.get(int(request['room_id']))
+    if room:
+        return {'status': 'success', 'data': room}
+    return {'status': 'fail'}
+
+@command('subscribe_room')
+def handle_subscribe_room(session, request):
+    # Replies with the full room once; after that only room_event pushes
+    # (player_joined, player_left, host, status, chat, closed) are sent.
+    room_id = int(request['room_id'])
+    with room_locks[room_id]:
+        room = active_rooms.get(room_id)
+        if room is None:
+            return {'status': 'fail', 'msg': 'Room not found'}
+        subscribers = room_subscribers.setdefault(room_id, [])
+        if session not in subscribers:
+            subscribers.append(session)
+        session.subscriptions.add(room_id)
+        # queued under the room lock so no event can overtake the snapshot
+        session.send({'status': 'success', 'data': room})
+
+@command('unsubscribe_room')
+def handle_unsubscribe_room(session, request):
+    room_id = int(request['room_id'])
+    with room_locks[room_id]:
+        subscribers = room_subscribers.get(room_id)
+        if subscribers and session in subscribers:
+            subscribers.remove(session)
+        session.subscriptions.discard(room_id)
+    return {'status': 'success'}
+
+@command('start_game')
+def handle_start_game(session, request):
+    room_id = int(request['room_id'])
+
+    with room_locks[room_id]:
+        if room_id in active_rooms and active_rooms[room_id]['host'] == session.username:
+            active_rooms[room_id]['status'] = 'playing'
+            game_id = active_rooms[room_id]['game_id']
+            # the game may have been removed since the room was created
+            if storage.get_game(game_id):
+                storage.record_plays(game_id, active_rooms[room_id]['players'])
+                catalog_version.bump(game_id)
+            publish_room_event(room_id, 'status', status='playing')
+            return {'status': 'success'}
+    return {'status': 'fail'}
+
+@command('submit_review')
+def handle_submit_review(session, request):
+    game_id = request['game_id']
+    rating = request['rating']
+    comment = request['comment']
+
+    if not storage.has_played(session.username, game_id):
+        return {'status': 'fail', 'msg': 'You must play the game before reviewing it!'}
+
+    if not storage.add_review(game_id, session.username, rating, comment):
+        return {'status': 'fail', 'msg': 'You have already reviewed this game.'}
+
+    # the game may have been removed after the player opened its page
+    games = storage.list_games([game_id])
+    if games:
+        catalog_version.bump(game_id)
+        search_index.add_review(game_id, comment, games[0]['rating'])
+    return {'status': 'success'}
+
+@command('list_plugins', concurrent=True)
+def handle_list_plugins(session, request):
+    return {'status': 'success', 'data': available_plugins}
+
+# PL3 : chat handle
+@command('send_chat')
+def handle_send_chat(session, request):
+    room_id = int(request['room_id'])
+    msg = request['msg']
+
+    with room_locks[room_id]:
+        if room_id not in active_rooms:
+            return {'status': 'fail'}
+
+        chat_entry = f"{session.username}: {msg}"
+        active_rooms[room_id]['chat_history'].append(chat_entry)
+        # max len = 50
+        if len(active_rooms[room_id]['chat_history']) > 50:
+            active_rooms[room_id]['chat_history'].pop(0)
+        publish_room_event(room_id, 'chat', line=chat_entry)
+    return {'status': 'success'}
+
+@command('room_status')
+def handle_room_status(session, request):
+    # internal: sent by relay workers over their lobby link
+    if not session.internal:
+        return {'status': 'fail', 'msg': 'Permission denied'}
+    apply_room_status(int(request['room_id']), request['status'])
+
+@command('server_stats', concurrent=True)
+def handle_server_stats(session, request):
+    # admin only: per-command counters, latency percentiles, lock wait, bytes
+    if session.role != 'dev' or session.username != 'admin':
+        return {'status': 'fail', 'msg': 'Permission denied'}
+    data = registry.snapshot()
+    data['outbox'] = outbox_stats.snapshot()
+    return {'status': 'success', 'data': data}
+
+# Sub-commands that answer by themselves, move files or change how the
+# connection is read need a request of their own.
+UNBATCHABLE = {'batch', 'hello', 'upload_game', 'download_game', 'subscribe_room'}
+BATCH_LIMIT = 32
+
+@command('batch')
+def handle_batch(session, request):
+    # Runs the sub-commands in order, in this one pass, and answers once with
+    # their replies (None for commands without one). Each sub-command still
+    # takes only its own locks and shows up under its own name in
+    # server_stats.
+    sub_requests = request.get('commands') or []
+    if type(sub_requests) is not list:
+        return {'status': 'fail', 'msg': 'commands must be a list'}
+    if len(sub_requests) > BATCH_LIMIT:
+        return {'status': 'fail', 'msg': f'At most {BATCH_LIMIT} commands per batch'}
+
+    results = []
+    for sub_request in sub_requests:
+        if type(sub_request) is not dict:
+            results.append({'status': 'fail', 'msg': 'Not a command'})
+            continue
+        name = sub_request.get('command')
+        if type(name) is not str or name in UNBATCHABLE or name not in registry.handlers:
+            results.append({'status': 'fail', 'msg': f'Not allowed in batch: {name}'})
+            continue
+        try:
+            results.append(registry.dispatch(session, sub_request, respond=False))
+        except Exception as error:
+            print(f"[ERR] {session.address} batch {name}: {error}")
+            results.append({'status': 'fail', 'msg': 'Server error'})
+    return {'status': 'success', 'results': results}
+
+def handle_client(client_socket, client_address, internal=False):
+    print(f"[CONN] New connection from {client_address}")
+    session = SocketSession(client_socket, client_address)
+    session.internal = internal
+    
+    try:
+        while True:
+            payload = recv_frame(client_socket)
+            if not payload:
+                break
+            
+            process_request(session, unpack_message(payload), len(payload) + 4)
 
     except Exception as error:
         print(f"[ERR] {client_address}: {error}")
     finally:
-        handle_disconnect(client_socket, current_user, current_role)
+        handle_disconnect(session)
+        session.close()
         client_socket.close()
 
-if __name__ == '__main__':
-    os.makedirs(GAMES_DIR, exist_ok=True)
-    load_database()
+async def handle_stream_client(reader, writer, internal=False):
+    client_address = writer.get_extra_info('peername')
+    print(f"[CONN] New connection from {client_address}")
+    session = StreamSession(reader, writer, client_address)
+    session.internal = internal
     
+    try:
+        while True:
+            payload = await async_recv_frame(reader)
+            if not payload:
+                break
+            
+            process_request(session, unpack_message(payload), len(payload) + 4)
+            await session.flush()
+
+    except Exception as error:
+        print(f"[ERR] {client_address}: {error}")
+    finally:
+        handle_disconnect(session)
+        session.close()
+        writer.close()
+
+def run_threaded_server():
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((HOST, PORT))
     server_socket.listen(10)
     
-    print(f"Server running on {HOST}:{PORT}")
+    print(f"Server running on {HOST}:{PORT} (threaded)")
     
     while True:
         client_sock, client_addr = server_socket.accept()
         thread = threading.Thread(target=handle_client, args=(client_sock, client_addr), daemon=True)
-        thread.start()
\ No newline at end of file
+        thread.start()
+
+async def run_asyncio_server():
+    server = await asyncio.start_server(handle_stream_client, HOST, PORT, reuse_address=True, backlog=1024)
+    
+    print(f"Server running on {HOST}:{PORT} (asyncio)")
+    
+    async with server:
+        await server.serve_forever()
+
+# ===== multi-process mode (--workers) =====
+# The parent accepts and routes each connection (see sharding.py). Worker 0 is
+# the lobby: it owns storage, rooms, logins and subscriptions. Workers 1..N are
+# relays that only hold game sessions, so room traffic runs on N cores. Each
+# relay has a socketpair link to the lobby that the lobby serves like any
+# other connection, marked internal so it may send room_status.
+def run_threaded_worker(channel, lobby_links, relay_link):
+    global lobby_link
+    for link in lobby_links:
+        threading.Thread(target=handle_client, args=(link, 'relay-link', True), daemon=True).start()
+    if relay_link is not None:
+        lobby_link = SocketSession(relay_link, 'lobby-link')
+
+    while True:
+        client_sock = receive_handoff(channel)
+        if client_sock is None:
+            return
+        client_addr = client_sock.getpeername()
+        threading.Thread(target=handle_client, args=(client_sock, client_addr), daemon=True).start()
+
+async def run_asyncio_worker(channel, lobby_links, relay_link):
+    global lobby_link
+    loop = asyncio.get_running_loop()
+    # the loop only keeps weak references to tasks
+    connection_tasks = set()
+
+    def serve_socket(client_sock, internal=False):
+        async def serve():
+            reader, writer = await asyncio.open_connection(sock=client_sock)
+            await handle_stream_client(reader, writer, internal)
+
+        task = loop.create_task(serve())
+        connection_tasks.add(task)
+        task.add_done_callback(connection_tasks.discard)
+
+    for link in lobby_links:
+        serve_socket(link, True)
+    if relay_link is not None:
+        reader, writer = await asyncio.open_connection(sock=relay_link)
+        lobby_link = StreamSession(reader, writer, 'lobby-link')
+
+    parent_gone = loop.create_future()
+
+    def on_handoff():
+        try:
+            client_sock = receive_handoff(channel)
+        except BlockingIOError:
+            return
+        if client_sock is None:
+            loop.remove_reader(channel.fileno())
+            parent_gone.set_result(None)
+            return
+        serve_socket(client_sock)
+
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), on_handoff)
+    await parent_gone
+
+def run_worker(name, engine, channel, lobby_links, relay_link, stats_interval, inherited):
+    # Drop every other worker's sockets inherited through fork, so a worker
+    # sees EOF on its channel when the parent dies.
+    for other in inherited:
+        other.close()
+
+    if name == 'lobby':
+        open_storage()
+    if stats_interval > 0:
+        registry.start_periodic_dump(stats_interval)
+    print(f"[Worker] {name} ready (pid {os.getpid()}, {engine})")
+
+    try:
+        if engine == 'asyncio':
+            asyncio.run(run_asyncio_worker(channel, lobby_links, relay_link))
+        else:
+            run_threaded_worker(channel, lobby_links, relay_link)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if name == 'lobby':
+            storage.close()
+
+def run_multiprocess_server(relay_count, engine, stats_interval):
+    # fork keeps the parsed configuration and lets children inherit sockets
+    context = multiprocessing.get_context('fork')
+
+    lobby_channel, lobby_worker_channel = new_channel()
+    relay_channels = []
+    lobby_links = []
+    workers = [('lobby', lobby_worker_channel, lobby_links, None)]
+    for index in range(relay_count):
+        parent_end, worker_end = new_channel()
+        lobby_end, relay_end = socket.socketpair()
+        relay_channels.append(parent_end)
+        lobby_links.append(lobby_end)
+        workers.append((f"relay-{index}", worker_end, [], relay_end))
+
+    all_sockets = [lobby_channel] + relay_channels
+    for _, channel, links, relay_link in workers:
+        all_sockets += [channel] + links + ([relay_link] if relay_link is not None else [])
+
+    processes = []
+    for name, channel, links, relay_link in workers:
+        own = [channel] + links + [relay_link]
+        inherited = [other for other in all_sockets if not any(other is mine for mine in own)]
+        process = context.Process(target=run_worker, args=(name, engine, channel, links, relay_link, stats_interval, inherited),
+                                  name=name, daemon=True)
+        process.start()
+        processes.append(process)
+
+    # the parent keeps only its end of each channel
+    for _, channel, links, relay_link in workers:
+        channel.close()
+        for link in links:
+            link.close()
+        if relay_link is not None:
+            relay_link.close()
+
+    router = Router(lobby_channel, relay_channels)
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((HOST, PORT))
+    server_socket.listen(1024)
+
+    print(f"Server running on {HOST}:{PORT} (1 lobby + {relay_count} relay workers)")
+
+    try:
+        while True:
+            client_sock, client_addr = server_socket.accept()
+            router.dispatch(client_sock)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server_socket.close()
+        for process in processes:
+            process.join(timeout=5)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Game Store server")
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded',
+                        help="threaded: one thread per connection; asyncio: every connection on one event loop")
+    parser.add_argument('--storage', choices=['memory', 'sqlite'], default='memory',
+                        help="memory: db.json snapshot + journal; sqlite: indexed server_data/db.sqlite (migrates db.json on first start)")
+    parser.add_argument('--fsync-interval', type=float, default=1.0,
+                        help="journal fsync batching in seconds (0 = every mutation, <0 = leave it to the OS)")
+    parser.add_argument('--compact-interval', type=float, default=60.0,
+                        help="fold the journal into db.json at least this often (seconds)")
+    parser.add_argument('--compact-records', type=int, default=1000,
+                        help="fold the journal into db.json once it holds this many records")
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help="print per-command stats every N seconds (0 = off; admins can always use server_stats)")
+    parser.add_argument('--outbox-limit', type=int, default=OUTBOX_LIMIT,
+                        help="queued events per connection before the slow-consumer policy applies")
+    parser.add_argument('--slow-consumer', choices=SLOW_CONSUMER_POLICIES, default=SLOW_CONSUMER_POLICY,
+                        help="what to do with events for a client whose queue is full")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="run N relay worker processes plus one lobby worker; game rooms are pinned to relay room_id %% N (0 = single process)")
+    parser.add_argument('--no-sendfile', action='store_true',
+                        help="serve downloads with buffered copies instead of the kernel's sendfile")
+    args = parser.parse_args()
+
+    OUTBOX_LIMIT = args.outbox_limit
+    SLOW_CONSUMER_POLICY = args.slow_consumer
+    if args.no_sendfile:
+        protocol.USE_SENDFILE = False
+    os.makedirs(GAMES_DIR, exist_ok=True)
+    storage = create_storage(args.storage, DATA_DIR, args.fsync_interval, args.compact_interval, args.compact_records)
+    if args.workers > 0:
+        # storage is opened inside the lobby worker, after the fork
+        run_multiprocess_server(args.workers, args.engine, args.stats_interval)
+        sys.exit(0)
+
+    open_storage()
+    if args.stats_interval > 0:
+        registry.start_periodic_dump(args.stats_interval)
+    
+    if args.engine == 'asyncio':
+        try:
+            asyncio.run(run_asyncio_server())
+        except KeyboardInterrupt:
+            pass
+    else:
+        run_threaded_server()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import socket
+import struct
+import threading
+import time
+
+from common.codec import decode
+
+# Socket routing for --workers mode. The parent process only accepts; it
+# peeks at the first frame of each connection (without consuming it) and
+# passes the socket to a worker over an AF_UNIX channel:
+#
+#   game_join for room R   relay worker R % relay_count
+#   anything else          the lobby worker (accounts, catalog, rooms)
+#
+# Every connection of one room therefore lands on the same relay worker, and
+# rooms spread over all cores. Relay workers report room status changes
+# (game over, restart, finished) to the lobby over a private link; see
+# server.py.
+
+PEEK_TIMEOUT = 10.0
+PEEK_POLL = 0.002
+MAX_PEEK_BYTES = 64 * 1024
+
+LOBBY = -1
+
+def _peek(client_socket, length, deadline):
+    # MSG_WAITALL does not wait once some data is queued when combined with
+    # MSG_PEEK, so poll until the bytes are there.
+    while True:
+        data = client_socket.recv(length, socket.MSG_PEEK)
+        if len(data) >= length:
+            return data
+        if not data:
+            raise ValueError("connection closed before the first request")
+        if time.monotonic() > deadline:
+            raise ValueError("first request incomplete")
+        time.sleep(PEEK_POLL)
+
+def peek_first_request(client_socket):
+    # Returns the first request dict without removing it from the socket, or
+    # None if the client sent nothing usable in time. A leading codec hello
+    # is skipped: clients send it right before their real first request.
+    client_socket.settimeout(PEEK_TIMEOUT)
+    deadline = time.monotonic() + PEEK_TIMEOUT
+    try:
+        offset = 0
+        while True:
+            message_length = struct.unpack('>I', _peek(client_socket, offset + 4, deadline)[offset:])[0]
+            if offset + 4 + message_length > MAX_PEEK_BYTES:
+                return None
+            frame = _peek(client_socket, offset + 4 + message_length, deadline)
+            request = decode(memoryview(frame)[offset + 4:])
+            if request.get('command') != 'hello' or offset:
+                return request
+            offset += 4 + message_length
+    except (OSError, ValueError, struct.error):
+        return None
+    finally:
+        client_socket.settimeout(None)
+
+def route(request, relay_count):
+    if request and request.get('command') == 'game_join' and relay_count:
+        try:
+            return int(request['room_id']) % relay_count
+        except (KeyError, TypeError, ValueError):
+            pass
+    return LOBBY
+
+def new_channel():
+    # message-oriented, so concurrent hand-offs never interleave
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+def hand_off(channel, channel_lock, client_socket):
+    with channel_lock:
+        socket.send_fds(channel, [b'c'], [client_socket.fileno()])
+    client_socket.close()
+
+def receive_handoff(channel):
+    # Blocks until the parent passes a socket; None when the parent is gone.
+    _, fds, _, _ = socket.recv_fds(channel, 1, 1)
+    if not fds:
+        return None
+    return socket.socket(fileno=fds[0])
+
+class Router:
+    # Lives in the parent: one channel per worker, and a short-lived thread
+    # per new connection so a client that is slow to send its first frame
+    # never holds up accept().
+    def __init__(self, lobby_channel, relay_channels):
+        self.lobby = (lobby_channel, threading.Lock())
+        self.relays = [(channel, threading.Lock()) for channel in relay_channels]
+
+    def dispatch(self, client_socket):
+        threading.Thread(target=self._route, args=(client_socket,), daemon=True).start()
+
+    def _route(self, client_socket):
+        target = route(peek_first_request(client_socket), len(self.relays))
+        channel, channel_lock = self.lobby if target == LOBBY else self.relays[target]
+        try:
+            hand_off(channel, channel_lock, client_socket)
+        except OSError as error:
+            print(f"[Router] Hand-off Error: {error}")
+            client_socket.close()
@@ -0,0 +1,846 @@
+import os
+import json
+import bisect
+import sqlite3
+import threading
+from itertools import islice
+
+from journal import Journal
+from dispatch import TimedLock
+
+# Storage backends for accounts, the game catalog, reviews and play history.
+# Handlers in server.py only call the methods below, so either backend can be
+# selected at startup with --storage.
+#
+#   MemoryStorage  the original `database` dict, persisted as db.json plus the
+#                  append-only journal
+#   SqliteStorage  server_data/db.sqlite with indexes for every hot lookup
+#
+# Both backends do their own locking; their locks are the innermost ones in
+# the server lock order.
+
+def default_database():
+    return {
+        "developers": {"admin": "admin"},
+        "players": {"p1": "p1", "p2": "p2", "p3": "p3", "p4": "p4"},
+        "games": [],
+        "reviews": [],
+        "play_history": []
+    }
+
+def round_rating(total, count):
+    if count:
+        return round(total / count, 1)
+    return 0.0
+
+def new_rating_stats():
+    return {'count': 0, 'sum': 0, 'histogram': [0, 0, 0, 0, 0]}
+
+def add_to_rating_stats(stats, rating):
+    stats['count'] += 1
+    stats['sum'] += rating
+    star = int(rating)
+    if 1 <= star <= 5:
+        stats['histogram'][star - 1] += 1
+
+def rating_summary(stats):
+    return {
+        'average': round_rating(stats['sum'], stats['count']),
+        'count': stats['count'],
+        'histogram': list(stats['histogram'])
+    }
+
+# ----- paged listings -----
+# Orders for list_games pages. Ratings and play counts sort best first; ties
+# (and 'newest') go by id, newest first for 'newest'.
+SORT_ORDERS = ('newest', 'rating', 'name', 'most_played')
+
+def sort_keys(game_id, name, rating, plays):
+    # one key per order, each ending in the game id
+    return {
+        'newest': (-game_id, game_id),
+        'rating': (-rating, game_id),
+        'name': (name.lower(), game_id),
+        'most_played': (-plays, game_id),
+    }
+
+class GameOrder:
+    # Every game's sort keys kept in sorted lists, one per order for the
+    # whole catalog and one per order and game type, so an unfiltered page
+    # is a slice and a rating cut-off is a bisect.
+    def __init__(self):
+        self.entries = {}   # game_id -> (type, keys)
+        self.lists = {}     # (order, type or None) -> sorted keys
+
+    def put(self, game_id, game_type, keys):
+        self.remove(game_id)
+        self.entries[game_id] = (game_type, keys)
+        for order, key in keys.items():
+            bisect.insort(self.lists.setdefault((order, None), []), key)
+            bisect.insort(self.lists.setdefault((order, game_type), []), key)
+
+    def remove(self, game_id):
+        entry = self.entries.pop(game_id, None)
+        if not entry:
+            return
+        game_type, keys = entry
+        for order, key in keys.items():
+            for sorted_keys in (self.lists[(order, None)], self.lists[(order, game_type)]):
+                del sorted_keys[bisect.bisect_left(sorted_keys, key)]
+
+    def rebuild(self, entries):
+        # entries: (game_id, type, keys); one sort instead of n inserts
+        self.entries = {game_id: (game_type, keys) for game_id, game_type, keys in entries}
+        self.lists = {}
+        for game_type, keys in self.entries.values():
+            for order, key in keys.items():
+                self.lists.setdefault((order, None), []).append(key)
+                self.lists.setdefault((order, game_type), []).append(key)
+        for sorted_keys in self.lists.values():
+            sorted_keys.sort()
+
+    def ordered(self, order, game_type=None):
+        return self.lists.get((order, game_type), [])
+
+class MemoryStorage:
+    # The tables live in self.database exactly as they are written to db.json,
+    # except that games are keyed by id. Secondary indexes are maintained next
+    # to them so every command is O(1) or O(size of its own result):
+    #
+    #   name_index        name -> game
+    #   author_index      author -> {id: game}
+    #   reviews_by_game   game_id -> [review, ...] in submission order
+    #   reviewed          {(user, game_id)}
+    #   played            {(user, game_id)}
+    #   play_counts       game_id -> number of players who played it
+    #   game_order        pre-sorted keys for paged list_games (GameOrder),
+    #                     guarded by order_lock, taken after the table locks
+    #   rating_stats      game_id -> running count / sum / per-star histogram
+    #   next_game_id      monotonic id allocator, persisted in the snapshot
+    def __init__(self, data_dir, fsync_interval=1.0, compact_interval=60.0, compact_records=1000):
+        self.data_dir = data_dir
+        self.db_file = os.path.join(data_dir, 'db.json')
+        self.table_locks = {table_name: TimedLock() for table_name in default_database()}
+        self.order_lock = TimedLock()
+        self.db_file_lock = threading.Lock()
+        self.journal = Journal(os.path.join(data_dir, 'db.journal'), fsync_interval)
+        self.compact_interval = compact_interval
+        self.compact_records = compact_records
+        self.build_indexes(default_database())
+
+    def build_indexes(self, tables, next_game_id=1):
+        self.database = {
+            "developers": dict(tables['developers']),
+            "players": dict(tables['players']),
+            "games": {},
+            "reviews": [],
+            "play_history": []
+        }
+        self.name_index = {}
+        self.author_index = {}
+        self.reviews_by_game = {}
+        self.reviewed = set()
+        self.played = set()
+        self.play_counts = {}
+        self.rating_stats = {}
+        self.next_game_id = next_game_id
+
+        # the order is sorted once at the end rather than kept up to date
+        self.game_order = None
+        for game in tables['games']:
+            self._index_game(game)
+        for review in tables['reviews']:
+            self._index_review(review)
+        for history in tables['play_history']:
+            self._index_play(history)
+        self.game_order = GameOrder()
+        self.game_order.rebuild((game['id'], game['type'], self._sort_keys(game))
+                                for game in self.database['games'].values())
+
+    def _sort_keys(self, game):
+        return sort_keys(game['id'], game['name'], self._game_rating(game['id']), self.play_counts.get(game['id'], 0))
+
+    def _order_game(self, game_id):
+        # re-sorts a game after a change to its type, rating or play count
+        game = self.database['games'].get(game_id)
+        if game and self.game_order is not None:
+            with self.order_lock:
+                self.game_order.put(game_id, game['type'], self._sort_keys(game))
+
+    def _index_game(self, game):
+        self.database['games'][game['id']] = game
+        self.name_index.setdefault(game['name'], game)
+        self.author_index.setdefault(game['author'], {})[game['id']] = game
+        self.next_game_id = max(self.next_game_id, game['id'] + 1)
+        self._order_game(game['id'])
+
+    def _unindex_game(self, game):
+        if self.game_order is not None:
+            with self.order_lock:
+                self.game_order.remove(game['id'])
+        del self.database['games'][game['id']]
+        if self.name_index.get(game['name']) is game:
+            del self.name_index[game['name']]
+        author_games = self.author_index.get(game['author'], {})
+        author_games.pop(game['id'], None)
+        if not author_games:
+            self.author_index.pop(game['author'], None)
+
+    def _index_review(self, review):
+        key = (review['user'], review['game_id'])
+        if key in self.reviewed:
+            return False
+        self.reviewed.add(key)
+        self.database['reviews'].append(review)
+        self.reviews_by_game.setdefault(review['game_id'], []).append(review)
+        stats = self.rating_stats.setdefault(review['game_id'], new_rating_stats())
+        add_to_rating_stats(stats, review['rating'])
+        self._order_game(review['game_id'])
+        return True
+
+    def _index_play(self, history):
+        key = (history['user'], history['game_id'])
+        if key in self.played:
+            return False
+        self.played.add(key)
+        self.database['play_history'].append(history)
+        self.play_counts[history['game_id']] = self.play_counts.get(history['game_id'], 0) + 1
+        self._order_game(history['game_id'])
+        return True
+
+    # ----- lifecycle -----
+    def open(self):
+        self.load()
+        self.journal.open()
+        self.journal.start_compactor(self.save_snapshot, self.compact_interval, self.compact_records)
+
+    def close(self):
+        self.journal.close()
+
+    def load(self):
+        if os.path.exists(self.db_file):
+            try:
+                tables = default_database()
+                with open(self.db_file, 'r') as file_handle:
+                    loaded_data = json.load(file_handle)
+                    for key in tables.keys():
+                        if key in loaded_data:
+                            tables[key] = loaded_data[key]
+                self.build_indexes(tables, loaded_data.get('next_game_id', 1))
+                print("[DB] Loaded.")
+            except Exception as error:
+                print(f"[DB] Load Error: {error}")
+
+        try:
+            replayed = self.journal.replay(self.apply_mutation)
+            if replayed:
+                print(f"[DB] Replayed {replayed} journal records.")
+        except Exception as error:
+            print(f"[DB] Journal Replay Error: {error}")
+
+    # Journal replay. Every operation is idempotent, so a record that is
+    # already part of the snapshot can safely be applied again.
+    def apply_mutation(self, operation, args):
+        if operation == 'add_account':
+            self.database[args['table']][args['username']] = args['password']
+
+        elif operation == 'add_game':
+            if args['id'] not in self.database['games']:
+                self._index_game(dict(args))
+
+        elif operation == 'update_game':
+            game = self.database['games'].get(args['id'])
+            if game:
+                game.update(args)
+                self._order_game(game['id'])
+
+        elif operation == 'remove_game':
+            game = self.database['games'].get(args['id'])
+            if game:
+                self._unindex_game(game)
+
+        elif operation == 'add_play':
+            self._index_play(dict(args))
+
+        elif operation == 'add_review':
+            self._index_review(dict(args))
+
+        else:
+            print(f"[DB] Unknown journal operation: {operation}")
+
+    def export_tables(self):
+        snapshot = {}
+        for table_name, table in self.database.items():
+            with self.table_locks[table_name]:
+                if table_name == 'games':
+                    snapshot[table_name] = list(table.values())
+                    snapshot['next_game_id'] = self.next_game_id
+                else:
+                    snapshot[table_name] = table.copy()
+        return snapshot
+
+    # Writes a full snapshot; only the journal compactor calls this, with no
+    # table lock held.
+    def save_snapshot(self):
+        with self.db_file_lock:
+            snapshot = self.export_tables()
+            try:
+                os.makedirs(self.data_dir, exist_ok=True)
+                temp_path = self.db_file + '.tmp'
+                with open(temp_path, 'w') as file_handle:
+                    json.dump(snapshot, file_handle, indent=4)
+                    file_handle.flush()
+                    os.fsync(file_handle.fileno())
+                os.replace(temp_path, self.db_file)
+                print("[DB] Saved.")
+                return True
+            except Exception as error:
+                print(f"[DB] Save Error: {error}")
+                return False
+
+    # Called while the table lock is still held, so the journal order always
+    # matches the in-memory order.
+    def log_mutation(self, operation, args):
+        try:
+            self.journal.append(operation, args)
+        except Exception as error:
+            print(f"[DB] Journal Error: {error}")
+
+    # ----- accounts -----
+    def get_password(self, table_name, username):
+        with self.table_locks[table_name]:
+            return self.database[table_name].get(username)
+
+    def add_account(self, table_name, username, password):
+        with self.table_locks[table_name]:
+            if username in self.database[table_name]:
+                return False
+            self.database[table_name][username] = password
+            self.log_mutation('add_account', {'table': table_name, 'username': username, 'password': password})
+            return True
+
+    # ----- games -----
+    def get_game(self, game_id):
+        with self.table_locks['games']:
+            return self.database['games'].get(game_id)
+
+    def games_by_author(self, author):
+        with self.table_locks['games']:
+            return list(self.author_index.get(author, {}).values())
+
+    def publish_game(self, author, name, description, game_type):
+        # Returns (game, error). Re-publishing an existing name bumps its
+        # version, but only for the original author.
+        with self.table_locks['games']:
+            existing_game = self.name_index.get(name)
+
+            if existing_game:
+                if existing_game['author'] != author:
+                    return None, 'Permission denied'
+                existing_game['version'] += 1
+                existing_game['description'] = description
+                existing_game['type'] = game_type
+                self._order_game(existing_game['id'])
+                self.log_mutation('update_game', {
+                    'id': existing_game['id'],
+                    'version': existing_game['version'],
+                    'description': description,
+                    'type': game_type
+                })
+                return existing_game, None
+
+            new_game = {
+                "id": self.next_game_id,
+                "name": name,
+                "version": 1,
+                "author": author,
+                "description": description,
+                "type": game_type,
+                "sha256": None
+            }
+            self._index_game(new_game)
+            self.log_mutation('add_game', new_game)
+            return new_game, None
+
+    def set_game_blob(self, game_id, sha256):
+        # Points the game at the blob holding its current file (see
+        # blobs.py). Games published before the blob store have no sha256.
+        with self.table_locks['games']:
+            game = self.database['games'].get(game_id)
+            if not game:
+                return False
+            game['sha256'] = sha256
+            self.log_mutation('update_game', {'id': game_id, 'sha256': sha256})
+            return True
+
+    def remove_game(self, game_id, author):
+        with self.table_locks['games']:
+            game = self.database['games'].get(game_id)
+            if not game or game['author'] != author:
+                return False
+
+            self._unindex_game(game)
+            self.log_mutation('remove_game', {'id': game_id})
+            return True
+
+    def list_games(self, game_ids=None):
+        # Every game, or only those in game_ids, with their ratings.
+        game_list = []
+        with self.table_locks['games'], self.table_locks['reviews']:
+            games = self.database['games']
+            if game_ids is not None:
+                games = {game_id: games[game_id] for game_id in game_ids if game_id in games}
+            for game in games.values():
+                game_list.append(self._game_info(game))
+        return game_list
+
+    def _game_info(self, game):
+        # a list_games entry; the caller holds the games and reviews locks
+        game_info = game.copy()
+        stats = self.rating_stats.get(game['id'])
+        if stats:
+            game_info['rating'] = round_rating(stats['sum'], stats['count'])
+            game_info['rating_count'] = stats['count']
+        else:
+            game_info['rating'] = 0.0
+            game_info['rating_count'] = 0
+        game_info['play_count'] = self.play_counts.get(game['id'], 0)
+        return game_info
+
+    def query_games(self, order, offset, limit, game_type=None, author=None, min_rating=None):
+        # One page of list_games entries in the given order (SORT_ORDERS),
+        # after the filters: (total matching, page). Without an author it
+        # works on the pre-sorted keys: O(page size) plus a bisect for
+        # min_rating in rating order; min_rating in another order skips the
+        # games below it. An author's own games are few and sorted directly.
+        with self.table_locks['games'], self.table_locks['reviews'], self.order_lock:
+            if author is not None:
+                keys = sorted(self.game_order.entries[game['id']][1][order]
+                              for game in self.author_index.get(author, {}).values()
+                              if game_type is None or game['type'] == game_type)
+                if min_rating is not None:
+                    keys = [key for key in keys if self._game_rating(key[-1]) >= min_rating]
+                total = len(keys)
+                page = keys[offset:offset + limit]
+            else:
+                keys = self.game_order.ordered(order, game_type)
+                if min_rating is None:
+                    total = len(keys)
+                    page = keys[offset:offset + limit]
+                else:
+                    rating_keys = self.game_order.ordered('rating', game_type)
+                    total = bisect.bisect_right(rating_keys, (-min_rating, float('inf')))
+                    if order == 'rating':
+                        page = keys[offset:min(offset + limit, total)]
+                    else:
+                        page = list(islice((key for key in keys if self._game_rating(key[-1]) >= min_rating),
+                                           offset, offset + limit))
+            return total, [self._game_info(self.database['games'][key[-1]]) for key in page]
+
+    def _game_rating(self, game_id):
+        stats = self.rating_stats.get(game_id)
+        return round_rating(stats['sum'], stats['count']) if stats else 0.0
+
+    def get_rating_summary(self, game_id):
+        with self.table_locks['reviews']:
+            return rating_summary(self.rating_stats.get(game_id, new_rating_stats()))
+
+    # ----- reviews / play history -----
+    def reviews_page(self, game_id, offset, limit):
+        with self.table_locks['reviews']:
+            reviews = self.reviews_by_game.get(game_id, [])
+            end = max(0, len(reviews) - offset)
+            return len(reviews), reviews[max(0, end - limit):end]
+
+    def all_reviews(self):
+        with self.table_locks['reviews']:
+            return [review for reviews in self.reviews_by_game.values() for review in reviews]
+
+    def has_played(self, username, game_id):
+        with self.table_locks['play_history']:
+            return (username, game_id) in self.played
+
+    def record_plays(self, game_id, usernames):
+        with self.table_locks['play_history']:
+            for player_name in usernames:
+                history = {"user": player_name, "game_id": game_id}
+                if self._index_play(history):
+                    self.log_mutation('add_play', history)
+
+    def add_review(self, game_id, username, rating, comment):
+        # False when this user already reviewed the game.
+        with self.table_locks['reviews']:
+            new_review = {
+                "game_id": game_id,
+                "user": username,
+                "rating": rating,
+                "comment": comment
+            }
+            if not self._index_review(new_review):
+                return False
+            self.log_mutation('add_review', new_review)
+            return True
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    role_table TEXT NOT NULL,
+    username TEXT NOT NULL,
+    password TEXT NOT NULL,
+    PRIMARY KEY (role_table, username)
+);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    description TEXT NOT NULL,
+    type TEXT NOT NULL,
+    sha256 TEXT,
+    rating REAL NOT NULL DEFAULT 0,
+    play_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_games_name ON games(name);
+CREATE INDEX IF NOT EXISTS idx_games_author ON games(author);
+CREATE TABLE IF NOT EXISTS reviews (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    comment TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_reviews_game_user ON reviews(game_id, user);
+CREATE INDEX IF NOT EXISTS idx_reviews_game_seq ON reviews(game_id, seq);
+CREATE TABLE IF NOT EXISTS game_ratings (
+    game_id INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    star1 INTEGER NOT NULL,
+    star2 INTEGER NOT NULL,
+    star3 INTEGER NOT NULL,
+    star4 INTEGER NOT NULL,
+    star5 INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS play_history (
+    user TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    PRIMARY KEY (user, game_id)
+) WITHOUT ROWID;
+"""
+
+# games.rating and games.play_count copy game_ratings / play_history so
+# pages of list_games can walk an index in any order.
+SORT_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_games_rating ON games(rating DESC, id);
+CREATE INDEX IF NOT EXISTS idx_games_plays ON games(play_count DESC, id);
+CREATE INDEX IF NOT EXISTS idx_games_name_nocase ON games(name COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS idx_games_type_rating ON games(type, rating DESC, id);
+"""
+
+SQL_ORDERS = {
+    'newest': "g.id DESC",
+    'rating': "g.rating DESC, g.id",
+    'name': "g.name COLLATE NOCASE, g.id",
+    'most_played': "g.play_count DESC, g.id",
+}
+
+GAME_COLUMNS = "id, name, version, author, description, type, sha256"
+
+LISTING_SELECT = ("SELECT g.id, g.name, g.version, g.author, g.description, g.type, g.sha256, "
+                  "COALESCE(s.total, 0), COALESCE(s.count, 0), g.play_count "
+                  "FROM games g LEFT JOIN game_ratings s ON s.game_id = g.id")
+
+def game_from_row(row):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "version": row[2],
+        "author": row[3],
+        "description": row[4],
+        "type": row[5],
+        "sha256": row[6]
+    }
+
+def listing_from_row(row):
+    # a row of LISTING_SELECT as a list_games entry
+    game_info = game_from_row(row)
+    game_info['rating'] = round_rating(row[7], row[8])
+    game_info['rating_count'] = row[8]
+    game_info['play_count'] = row[9]
+    return game_info
+
+class SqliteStorage:
+    def __init__(self, data_dir, legacy_storage=None):
+        # legacy_storage: a MemoryStorage over the same data_dir; its db.json
+        # and journal are imported the first time the SQLite file is created.
+        self.data_dir = data_dir
+        self.db_path = os.path.join(data_dir, 'db.sqlite')
+        self.legacy_storage = legacy_storage
+        self.lock = TimedLock()
+        self.connection = None
+
+    # ----- lifecycle -----
+    def open(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        is_new = not os.path.exists(self.db_path)
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        # databases created before the blob store / paged listings
+        game_columns = [row[1] for row in self.connection.execute("PRAGMA table_info(games)")]
+        if 'sha256' not in game_columns:
+            self.connection.execute("ALTER TABLE games ADD COLUMN sha256 TEXT")
+        if 'rating' not in game_columns:
+            self.connection.execute("ALTER TABLE games ADD COLUMN rating REAL NOT NULL DEFAULT 0")
+            self.connection.execute("ALTER TABLE games ADD COLUMN play_count INTEGER NOT NULL DEFAULT 0")
+        games_sql = self.connection.execute("SELECT sql FROM sqlite_master WHERE name = 'games'").fetchone()[0]
+        if 'AUTOINCREMENT' not in games_sql:
+            self.migrate_game_ids()
+        self.connection.executescript(SORT_INDEXES)
+
+        if is_new:
+            if self.legacy_storage:
+                # db.json + journal, or the default accounts if neither exists
+                self.legacy_storage.load()
+                self.import_tables(self.legacy_storage.export_tables())
+                print(f"[DB] Migrated {self.legacy_storage.db_file} into {self.db_path}.")
+            else:
+                self.import_tables(default_database())
+        self.rebuild_rating_stats()
+        self.rebuild_sort_columns()
+        print("[DB] SQLite storage ready.")
+
+    def migrate_game_ids(self):
+        # Before AUTOINCREMENT, SQLite handed the id of the newest removed
+        # game to the next one published, which then inherited its reviews
+        # and play history. The table is rebuilt (its indexes go with the
+        # old one and SCHEMA recreates them) and leftover rows dropped.
+        self.connection.executescript(f"""
+            BEGIN;
+            ALTER TABLE games RENAME TO games_old;
+            {SCHEMA}
+            INSERT INTO games (id, name, version, author, description, type, sha256, rating, play_count)
+                SELECT id, name, version, author, description, type, sha256, rating, play_count FROM games_old;
+            DROP TABLE games_old;
+            {SCHEMA}
+            DELETE FROM reviews WHERE game_id NOT IN (SELECT id FROM games);
+            DELETE FROM play_history WHERE game_id NOT IN (SELECT id FROM games);
+            COMMIT;
+        """)
+
+    def rebuild_rating_stats(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM game_ratings")
+            self.connection.execute(
+                "INSERT INTO game_ratings "
+                "SELECT game_id, COUNT(*), SUM(rating), "
+                "SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5) "
+                "FROM reviews GROUP BY game_id")
+
+    def rebuild_sort_columns(self):
+        with self.lock, self.connection:
+            ratings = self.connection.execute("SELECT game_id, total, count FROM game_ratings").fetchall()
+            plays = self.connection.execute("SELECT game_id, COUNT(*) FROM play_history GROUP BY game_id").fetchall()
+            self.connection.execute("UPDATE games SET rating = 0, play_count = 0")
+            self.connection.executemany("UPDATE games SET rating = ? WHERE id = ?",
+                                        [(round_rating(total, count), game_id) for game_id, total, count in ratings])
+            self.connection.executemany("UPDATE games SET play_count = ? WHERE id = ?",
+                                        [(count, game_id) for game_id, count in plays])
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+    def import_tables(self, tables):
+        with self.lock, self.connection:
+            for table_name in ('developers', 'players'):
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO accounts (role_table, username, password) VALUES (?, ?, ?)",
+                    [(table_name, username, password) for username, password in tables[table_name].items()])
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO games ({GAME_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(g['id'], g['name'], g['version'], g['author'], g['description'], g['type'], g.get('sha256'))
+                 for g in tables['games']])
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO reviews (game_id, user, rating, comment) VALUES (?, ?, ?, ?)",
+                [(r['game_id'], r['user'], r['rating'], r['comment']) for r in tables['reviews']])
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO play_history (user, game_id) VALUES (?, ?)",
+                [(h['user'], h['game_id']) for h in tables['play_history']])
+            # ids MemoryStorage gave to games since removed stay unused
+            if 'next_game_id' in tables:
+                self.connection.execute("DELETE FROM sqlite_sequence WHERE name = 'games'")
+                self.connection.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) "
+                    "VALUES ('games', MAX(?, (SELECT COALESCE(MAX(id), 0) FROM games)))",
+                    (tables['next_game_id'] - 1,))
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    # ----- accounts -----
+    def get_password(self, table_name, username):
+        rows = self._query("SELECT password FROM accounts WHERE role_table = ? AND username = ?", (table_name, username))
+        if rows:
+            return rows[0][0]
+        return None
+
+    def add_account(self, table_name, username, password):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO accounts (role_table, username, password) VALUES (?, ?, ?)",
+                (table_name, username, password))
+            return cursor.rowcount == 1
+
+    # ----- games -----
+    def get_game(self, game_id):
+        rows = self._query(f"SELECT {GAME_COLUMNS} FROM games WHERE id = ?", (game_id,))
+        if rows:
+            return game_from_row(rows[0])
+        return None
+
+    def games_by_author(self, author):
+        rows = self._query(f"SELECT {GAME_COLUMNS} FROM games WHERE author = ? ORDER BY id", (author,))
+        return [game_from_row(row) for row in rows]
+
+    def publish_game(self, author, name, description, game_type):
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                f"SELECT {GAME_COLUMNS} FROM games WHERE name = ? LIMIT 1", (name,)).fetchone()
+
+            if row:
+                game = game_from_row(row)
+                if game['author'] != author:
+                    return None, 'Permission denied'
+                game['version'] += 1
+                game['description'] = description
+                game['type'] = game_type
+                self.connection.execute(
+                    "UPDATE games SET version = ?, description = ?, type = ? WHERE id = ?",
+                    (game['version'], description, game_type, game['id']))
+                return game, None
+
+            cursor = self.connection.execute(
+                "INSERT INTO games (name, version, author, description, type) VALUES (?, 1, ?, ?, ?)",
+                (name, author, description, game_type))
+            return {
+                "id": cursor.lastrowid,
+                "name": name,
+                "version": 1,
+                "author": author,
+                "description": description,
+                "type": game_type,
+                "sha256": None
+            }, None
+
+    def set_game_blob(self, game_id, sha256):
+        with self.lock, self.connection:
+            cursor = self.connection.execute("UPDATE games SET sha256 = ? WHERE id = ?", (sha256, game_id))
+            return cursor.rowcount == 1
+
+    def remove_game(self, game_id, author):
+        with self.lock, self.connection:
+            cursor = self.connection.execute("DELETE FROM games WHERE id = ? AND author = ?", (game_id, author))
+            if cursor.rowcount != 1:
+                return False
+            for table_name in ('reviews', 'game_ratings', 'play_history'):
+                self.connection.execute(f"DELETE FROM {table_name} WHERE game_id = ?", (game_id,))
+            return True
+
+    def list_games(self, game_ids=None):
+        sql = LISTING_SELECT
+        if game_ids is None:
+            rows = self._query(sql + " ORDER BY g.id")
+        else:
+            # in chunks, below SQLite's limit on query parameters
+            game_ids = sorted(game_ids)
+            rows = []
+            for start in range(0, len(game_ids), 500):
+                chunk = game_ids[start:start + 500]
+                rows += self._query(sql + f" WHERE g.id IN ({', '.join('?' * len(chunk))}) ORDER BY g.id", chunk)
+        return [listing_from_row(row) for row in rows]
+
+    def query_games(self, order, offset, limit, game_type=None, author=None, min_rating=None):
+        # Same contract as MemoryStorage.query_games; the ORDER BY walks one
+        # of SORT_INDEXES, so a page reads offset + limit index entries.
+        conditions, params = [], []
+        if game_type is not None:
+            conditions.append("g.type = ?")
+            params.append(game_type)
+        if author is not None:
+            conditions.append("g.author = ?")
+            params.append(author)
+        if min_rating is not None:
+            conditions.append("g.rating >= ?")
+            params.append(min_rating)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        with self.lock:
+            total = self.connection.execute("SELECT COUNT(*) FROM games g" + where, params).fetchone()[0]
+            rows = self.connection.execute(
+                f"{LISTING_SELECT}{where} ORDER BY {SQL_ORDERS[order]} LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+        return total, [listing_from_row(row) for row in rows]
+
+    def get_rating_summary(self, game_id):
+        rows = self._query(
+            "SELECT count, total, star1, star2, star3, star4, star5 FROM game_ratings WHERE game_id = ?", (game_id,))
+        stats = new_rating_stats()
+        if rows:
+            row = rows[0]
+            stats = {'count': row[0], 'sum': row[1], 'histogram': list(row[2:7])}
+        return rating_summary(stats)
+
+    # ----- reviews / play history -----
+    def reviews_page(self, game_id, offset, limit):
+        with self.lock:
+            total = self.connection.execute("SELECT COUNT(*) FROM reviews WHERE game_id = ?", (game_id,)).fetchone()[0]
+            rows = self.connection.execute(
+                "SELECT game_id, user, rating, comment FROM reviews WHERE game_id = ? ORDER BY seq DESC LIMIT ? OFFSET ?",
+                (game_id, limit, offset)).fetchall()
+        return total, [{"game_id": r[0], "user": r[1], "rating": r[2], "comment": r[3]} for r in reversed(rows)]
+
+    def all_reviews(self):
+        rows = self._query("SELECT game_id, user, rating, comment FROM reviews ORDER BY seq")
+        return [{"game_id": r[0], "user": r[1], "rating": r[2], "comment": r[3]} for r in rows]
+
+    def has_played(self, username, game_id):
+        rows = self._query("SELECT 1 FROM play_history WHERE user = ? AND game_id = ?", (username, game_id))
+        return bool(rows)
+
+    def record_plays(self, game_id, usernames):
+        with self.lock, self.connection:
+            for player_name in usernames:
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO play_history (user, game_id) VALUES (?, ?)", (player_name, game_id))
+                if cursor.rowcount == 1:
+                    self.connection.execute("UPDATE games SET play_count = play_count + 1 WHERE id = ?", (game_id,))
+
+    def add_review(self, game_id, username, rating, comment):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO reviews (game_id, user, rating, comment) VALUES (?, ?, ?, ?)",
+                (game_id, username, rating, comment))
+            if cursor.rowcount != 1:
+                return False
+
+            star = int(rating)
+            star_columns = [int(star == n) for n in range(1, 6)]
+            self.connection.execute(
+                "INSERT INTO game_ratings VALUES (?, 1, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(game_id) DO UPDATE SET count = count + 1, total = total + excluded.total, "
+                "star1 = star1 + excluded.star1, star2 = star2 + excluded.star2, star3 = star3 + excluded.star3, "
+                "star4 = star4 + excluded.star4, star5 = star5 + excluded.star5",
+                [game_id, rating] + star_columns)
+            count, total = self.connection.execute(
+                "SELECT count, total FROM game_ratings WHERE game_id = ?", (game_id,)).fetchone()
+            self.connection.execute("UPDATE games SET rating = ? WHERE id = ?", (round_rating(total, count), game_id))
+            return True
+
+def create_storage(backend, data_dir, fsync_interval=1.0, compact_interval=60.0, compact_records=1000):
+    memory_storage = MemoryStorage(data_dir, fsync_interval, compact_interval, compact_records)
+    if backend == 'sqlite':
+        return SqliteStorage(data_dir, legacy_storage=memory_storage)
+    return memory_storage